@@ -0,0 +1,279 @@
+"""Storage benchmark for the bot's data layer
+
+Generates synthetic bot data (users spread over guilds, with tickets, polls
+and warnings) and times the common storage operations for each strategy:
+
+    legacy   the old single bot_data.json, pretty-printed and fully
+             rewritten on every change
+    sharded  DataStore: per-guild snapshot + journal files
+    sqlite   SQLiteStore: indexed tables in bot_data.db
+
+Usage:
+    python bench_storage.py
+    python bench_storage.py --users 1000,100000,1000000 --guilds 50
+    DATA_FORMAT=orjson python bench_storage.py --strategies sharded
+
+Everything runs in a temporary directory; nothing in the working tree is
+touched. Times are medians in milliseconds.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import main
+
+TICKET_STATUSES = ('open', 'open', 'closed')
+
+# The store API is async; one loop drives every call so its setup cost stays out of the timings
+run = asyncio.new_event_loop().run_until_complete
+
+def generate_dataset(user_count, guild_count, tickets_per_guild, polls_per_guild, seed=0):
+    """Build bot data in the legacy bot_data.json layout"""
+    rng = random.Random(seed)
+    guild_ids = [str(100000000000000000 + i) for i in range(guild_count)]
+    now = datetime.now().isoformat()
+    data = {'users': {}, 'user_levels': {}, 'tickets': {}, 'polls': {}, 'warnings': {}}
+
+    for i in range(user_count):
+        user_id = str(200000000000000000 + i)
+        data['users'][user_id] = {'authenticated': True, 'join_date': now}
+        # Most members are in one guild, some in a second
+        guilds = [rng.choice(guild_ids)]
+        if rng.random() < 0.2:
+            guilds.append(rng.choice(guild_ids))
+        for guild_id in guilds:
+            total_xp = rng.randint(0, 50000)
+            level, xp = main.level_from_total_xp(total_xp)
+            data['user_levels'].setdefault(guild_id, {})[user_id] = {'level': level, 'xp': xp, 'total_xp': total_xp}
+            if rng.random() < 0.02:
+                count = rng.randint(1, 3)
+                data['warnings'].setdefault(guild_id, {})[user_id] = {
+                    'count': count,
+                    'history': [{'reason': 'spam', 'moderator_id': '1', 'timestamp': now}] * count
+                }
+
+    user_ids = list(data['users'])
+    ticket_id = 0
+    for guild_id in guild_ids:
+        for _ in range(tickets_per_guild):
+            ticket_id += 1
+            data['tickets'][str(ticket_id)] = {
+                'user_id': rng.choice(user_ids),
+                'channel_id': str(300000000000000000 + ticket_id),
+                'created_at': now,
+                'description': 'チケット作成',
+                'status': rng.choice(TICKET_STATUSES),
+                'guild_id': guild_id
+            }
+        for n in range(polls_per_guild):
+            options = ['A', 'B', 'C', 'D']
+            voters = {user_id: rng.randrange(len(options)) for user_id in rng.sample(user_ids, min(200, len(user_ids)))}
+            votes = [0] * len(options)
+            for option in voters.values():
+                votes[option] += 1
+            data['polls'][f'{guild_id}-{n}'] = {
+                'question': 'ベンチマーク',
+                'options': options,
+                'votes': votes,
+                'voters': voters,
+                'creator': 'bench',
+                'channel_id': 1,
+                'guild_id': guild_id
+            }
+    return data, guild_ids
+
+def busiest_guild(data):
+    return max(data['user_levels'], key=lambda guild_id: len(data['user_levels'][guild_id]))
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+class LegacyStrategy:
+    """The pre-DataStore code path: load_data / save_data on one JSON file"""
+    name = 'legacy'
+
+    def setup(self, data):
+        self.save(data)
+
+    def load(self):
+        with open(main.DATA_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, data):
+        with open(main.DATA_FILE, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def open(self):
+        self.data = self.load()
+
+    def full_save(self):
+        self.save(self.data)
+
+    def add_xp(self, guild_id, user_id):
+        levels = self.data['user_levels'].setdefault(guild_id, {})
+        old = levels.get(user_id) or main.new_level_record()
+        total_xp = old['total_xp'] + 5
+        level, xp = main.level_from_total_xp(total_xp)
+        levels[user_id] = {'level': level, 'xp': xp, 'total_xp': total_xp}
+        self.save(self.data)
+
+    def ranking(self, guild_id):
+        levels = self.data['user_levels'].get(guild_id, {})
+        return sorted(levels.items(), key=lambda item: item[1]['total_xp'], reverse=True)[:10]
+
+    def tickets(self, guild_id):
+        return [
+            (ticket_id, ticket) for ticket_id, ticket in self.data['tickets'].items()
+            if ticket['guild_id'] == guild_id and ticket['status'] == 'open'
+        ]
+
+class ShardedStrategy:
+    """DataStore: per-guild snapshots with an append-only journal"""
+    name = 'sharded'
+
+    def setup(self, data):
+        LegacyStrategy().save(data)
+        main.DataStore().load()  # migrates bot_data.json into data/
+
+    def open(self):
+        self.store = main.DataStore().load()
+        for guild_id in self.store.guild_ids():
+            self.store.guild_blocking(guild_id)
+
+    def full_save(self):
+        for shard in self.store._shards():
+            shard.dirty = True
+        self.store.compact()
+
+    def add_xp(self, guild_id, user_id):
+        run(self.store.add_xp(guild_id, user_id, 5))
+        self.store.flush()
+
+    def ranking(self, guild_id):
+        return run(self.store.top_levels(guild_id, 10))
+
+    def tickets(self, guild_id):
+        return run(self.store.list_tickets(guild_id, 'open'))
+
+class SQLiteStrategy:
+    """SQLiteStore: indexed tables, every change committed on the storage thread"""
+    name = 'sqlite'
+
+    def setup(self, data):
+        LegacyStrategy().save(data)
+        store = main.SQLiteStore(main.DB_FILE)
+        store.load()  # migrates bot_data.json via the JSON store
+        store.close()
+
+    def open(self):
+        # Nothing is read up front; the store is ready once the database is open
+        self.store = main.SQLiteStore(main.DB_FILE)
+        self.store.load()
+
+    full_save = None  # Every change is already in the database
+
+    def add_xp(self, guild_id, user_id):
+        # Committed on the storage thread before it returns
+        run(self.store.add_xp(guild_id, user_id, 5))
+
+    def ranking(self, guild_id):
+        return run(self.store.top_levels(guild_id, 10))
+
+    def tickets(self, guild_id):
+        return run(self.store.list_tickets(guild_id, 'open'))
+
+    def close(self):
+        self.store.close()
+
+STRATEGIES = {strategy.name: strategy for strategy in (LegacyStrategy, ShardedStrategy, SQLiteStrategy)}
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def run_strategy(strategy_cls, data, args):
+    strategy = strategy_cls()
+    workdir = tempfile.mkdtemp(prefix=f'bench-{strategy.name}-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        strategy.setup(data)
+        guild_id = busiest_guild(data)
+        user_ids = list(data['user_levels'][guild_id])
+        rng = random.Random(1)
+
+        result = {'load': timed(strategy.open, args.repeat)}
+        result['save'] = timed(strategy.full_save, args.repeat) if strategy.full_save else None
+        # Legacy rewrites the whole file per increment, so keep its sample small
+        xp_repeat = args.xp_ops if strategy.name != 'legacy' else max(3, min(args.xp_ops, args.repeat))
+        result['xp'] = timed(lambda: strategy.add_xp(guild_id, rng.choice(user_ids)), xp_repeat)
+        result['ranking'] = timed(lambda: strategy.ranking(guild_id), args.repeat * 10)
+        result['tickets'] = timed(lambda: strategy.tickets(guild_id), args.repeat * 10)
+        if hasattr(strategy, 'close'):
+            strategy.close()
+        result['disk'] = dir_size(workdir)
+        return result
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def format_ms(value):
+    return 'n/a' if value is None else f'{value:.3f}'
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+
+def print_table(rows):
+    headers = ('users', 'strategy', 'load ms', 'save ms', 'xp+persist ms', 'ranking ms', 'tickets ms', 'disk')
+    table = [headers] + rows
+    widths = [max(len(str(row[i])) for row in table) for i in range(len(headers))]
+    for n, row in enumerate(table):
+        print('  '.join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+        if n == 0:
+            print('  '.join('-' * width for width in widths))
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmark the bot storage strategies')
+    parser.add_argument('--users', default='1000,10000,100000', help='comma separated user counts')
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--tickets', type=int, default=200, help='tickets per guild')
+    parser.add_argument('--polls', type=int, default=20, help='polls per guild')
+    parser.add_argument('--repeat', type=int, default=5, help='samples for load/save')
+    parser.add_argument('--xp-ops', type=int, default=200, help='samples for the XP increment')
+    parser.add_argument('--strategies', default=','.join(STRATEGIES))
+    args = parser.parse_args()
+
+    print(f'Snapshot format: {main.DATA_FORMAT}')
+    rows = []
+    for user_count in (int(value) for value in args.users.split(',')):
+        data, _ = generate_dataset(user_count, args.guilds, args.tickets, args.polls)
+        for name in args.strategies.split(','):
+            result = run_strategy(STRATEGIES[name], data, args)
+            rows.append((
+                user_count, name,
+                format_ms(result['load']), format_ms(result['save']), format_ms(result['xp']),
+                format_ms(result['ranking']), format_ms(result['tickets']), format_size(result['disk'])
+            ))
+            print(f'  {user_count} users / {name}: done')
+    print()
+    print_table(rows)
+
+if __name__ == '__main__':
+    main_cli()
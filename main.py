@@ -1,10 +1,22 @@
 import discord
 from discord.ext import commands
 import json
+import re
 import os
-from datetime import datetime
+import heapq
+import bisect
+import random
+import sqlite3
+import asyncio
+import atexit
+import signal
+import sys
+import unicodedata
+from datetime import datetime, timedelta
 from flask import Flask
 from threading import Thread
+from collections import namedtuple, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import time
 
 app = Flask(__name__)
@@ -30,11 +42,677 @@ bot_start_time = datetime.now()
 
 ALLOWED_SERVERS = [1373116978709139577, 1383225206797242398]
 
-spam_tracker = {}
-bot_spam_tracker = {}
+SPAM_HISTORY_SIZE = 10  # recent messages remembered per member; caps a policy's repeat_count
+SPAM_IDLE_SECONDS = 300  # forget members who have been quiet this long
+SPAM_MAX_USERS = 20000  # hard cap on tracked members; the least recently active go first
+
+class SpamTracker:
+    """Recent messages per (guild, user) for the repeated-message check
+
+    Each member has a fixed-size ring buffer of (content hash, timestamp,
+    channel ID, message ID) - no message text is kept. Members are held in
+    least-recently-active order, so dropping idle ones only looks at the
+    oldest entries and memory stays flat however long the bot runs.
+    """
+
+    def __init__(self, history_size, idle_seconds, max_users):
+        self.history_size = history_size
+        self.idle_seconds = idle_seconds
+        self.max_users = max_users
+        self.histories = OrderedDict()  # {(guild_id, user_id): deque}, least recently active first
+
+    def __len__(self):
+        return len(self.histories)
+
+    def record(self, key, message, now):
+        """Add a message to the member's history and return the history"""
+        history = self.histories.get(key)
+        if history is None:
+            history = deque(maxlen=self.history_size)
+            self.histories[key] = history
+        else:
+            self.histories.move_to_end(key)
+        history.append((hash(message.content), now, message.channel.id, message.id))
+        self.evict_idle(now)
+        while len(self.histories) > self.max_users:
+            self.histories.popitem(last=False)
+        return history
+
+    @staticmethod
+    def repeated(history, now, count, window):
+        """If the last count messages are identical and within window, return every such entry, else []"""
+        content_hash = history[-1][0]
+        recent = list(history)[-count:]
+        if len(recent) < count or any(entry[0] != content_hash or now - entry[1] > window for entry in recent):
+            return []
+        return [entry for entry in history if entry[0] == content_hash and now - entry[1] <= window]
+
+    def forget(self, key):
+        self.histories.pop(key, None)
+
+    def clear(self):
+        self.histories.clear()
+
+    def evict_idle(self, now):
+        while self.histories:
+            key, history = next(iter(self.histories.items()))
+            if now - history[-1][1] <= self.idle_seconds:
+                break
+            del self.histories[key]
+
+    def memory_footprint(self):
+        """Approximate bytes held by the tracker"""
+        size = sys.getsizeof(self.histories)
+        for key, history in self.histories.items():
+            size += sys.getsizeof(key) + sys.getsizeof(history)
+            size += sum(sys.getsizeof(entry) for entry in history)
+        return size
+
+spam_tracker = SpamTracker(SPAM_HISTORY_SIZE, SPAM_IDLE_SECONDS, SPAM_MAX_USERS)
+
+ACTION_WORKERS = 4  # moderation REST calls in flight at once
+ACTION_MAX_RETRIES = 3  # 429 responses an action survives before it fails
+ACTION_MAX_BUCKETS = 4096  # idle (full) buckets are dropped past this many
+ACTION_ROUTES = {  # route: (priority, burst, tokens per second); lower priorities run first
+    'ban': (0, 5, 1.0),  # per guild
+    'kick': (0, 5, 1.0),  # per guild
+    'timeout': (0, 10, 2.0),  # per guild
+    'delete': (1, 5, 1.0),  # per channel; a bulk delete takes one token
+    'send': (2, 5, 1.0),  # per channel; warning embeds and other notices
+    'role': (3, 5, 3.0),  # per guild; role grants from jobs
+    'copy': (3, 5, 1.0),  # per channel; messages copied by jobs
+}
+BULK_DELETE_MAX = 100  # messages per bulk delete request
+BULK_DELETE_MAX_AGE = timedelta(days=14, minutes=-5)  # older messages can only be deleted one by one
+
+class TokenBucket:
+    """Request allowance for one route and guild/channel, refilled continuously"""
+    __slots__ = ('burst', 'rate', 'tokens', 'updated')
+
+    def __init__(self, burst, rate, now):
+        self.burst = burst
+        self.rate = rate
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Take a token and return 0, or return the seconds until one is available"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def limit(self, remaining, reset_after, now):
+        """Never allow more than Discord says is left (from rate-limit headers or a 429)"""
+        self._refill(now)
+        self.tokens = min(self.tokens, remaining if remaining > 0 else 1 - reset_after * self.rate)
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+class ScheduledAction:
+    __slots__ = ('route', 'scope', 'func', 'args', 'kwargs', 'future', 'retries')
+
+    def __init__(self, route, scope, func, args, kwargs):
+        self.route = route
+        self.scope = scope
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        # Fire-and-forget notices never read their result; don't warn about unread errors
+        self.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self.retries = 0
+
+async def discord_transport(func, args, kwargs):
+    """Make the REST call through discord.py; return (result, rate-limit headers)
+
+    discord.py keeps successful responses' headers to itself, so only 429s
+    (as HTTPException) tell the scheduler about Discord's own buckets.
+    """
+    return await func(*args, **kwargs), None
+
+class ActionScheduler:
+    """Orders moderation REST calls by priority and paces them per route
+
+    Every call goes through a token bucket for its route and guild or
+    channel, so a raid's hundreds of timeouts and deletes are spread out
+    instead of hitting 429s one after another, and a ban never waits
+    behind warning embeds. Each bucket keeps its actions in a FIFO lane;
+    only a lane's head is scheduled, one action per lane runs at a time,
+    and a lane out of tokens sleeps on a single timer until its next token
+    instead of re-queueing every action.
+    Deletes queued for a channel are merged into the pending bulk delete
+    until it runs. The transport is injectable so the pacing can be
+    exercised against a fake HTTP layer.
+    """
+
+    def __init__(self, transport, workers):
+        self.transport = transport
+        self.workers = workers
+        self.lanes = {}  # {(route, scope): deque of ScheduledAction in submission order}
+        self.ready = []  # heap of (priority, sequence, (route, scope)) for lanes whose head may run
+        self.scheduled = set()  # lanes in ready, sleeping on a timer or running their head; each at most once
+        self.sequence = 0
+        self.buckets = {}  # {(route, scope): TokenBucket}
+        self.pending_deletes = {}  # {channel ID: queued bulk delete action still accepting messages}
+        self.tasks = []
+        self._wakeup = None
+        self.executed = 0
+        self.deferred = 0
+        self.rate_limited = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def start(self):
+        if not self.tasks:
+            self._wakeup = asyncio.Event()
+            if self.ready:
+                self._wakeup.set()
+            self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def _schedule(self, key):
+        self.sequence += 1
+        heapq.heappush(self.ready, (ACTION_ROUTES[key[0]][0], self.sequence, key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _push(self, action, first=False):
+        key = (action.route, action.scope)
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = deque()
+        if first:
+            lane.appendleft(action)
+        else:
+            lane.append(action)
+        if key not in self.scheduled:
+            self.scheduled.add(key)
+            self._schedule(key)
+
+    def _enqueue(self, route, scope, func, args, kwargs):
+        action = ScheduledAction(route, scope, func, args, kwargs)
+        self._push(action)
+        return action
+
+    def submit(self, route, scope, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) on a route; return a future for its result"""
+        return self._enqueue(route, scope, func, args, kwargs).future
+
+    async def run(self, route, scope, func, *args, **kwargs):
+        return await self.submit(route, scope, func, *args, **kwargs)
+
+    @staticmethod
+    async def _delete_batch(channel, messages, reason):
+        await channel.delete_messages(list(messages.values()), reason=reason)
+        return len(messages)
+
+    def delete_messages(self, channel, message_ids, reason=None):
+        """Queue deletes in one channel; return futures resolving to the number deleted by each request"""
+        futures = []
+        cutoff = discord.utils.time_snowflake(discord.utils.utcnow() - BULK_DELETE_MAX_AGE)
+        for message_id in message_ids:
+            if message_id < cutoff:
+                action = self._enqueue('delete', channel.id, self._delete_batch, (channel, {message_id: discord.Object(id=message_id)}, reason), {})
+            else:
+                action = self.pending_deletes.get(channel.id)
+                if action is None or len(action.args[1]) >= BULK_DELETE_MAX:
+                    action = self._enqueue('delete', channel.id, self._delete_batch, (channel, {}, reason), {})
+                    self.pending_deletes[channel.id] = action
+                else:
+                    self.coalesced += 1
+                action.args[1][message_id] = discord.Object(id=message_id)
+            futures.append(action.future)
+        return list(dict.fromkeys(futures))
+
+    def _bucket(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= ACTION_MAX_BUCKETS:
+                self.buckets = {other: kept for other, kept in self.buckets.items() if not kept.idle(now)}
+            _, burst, rate = ACTION_ROUTES[key[0]]
+            bucket = self.buckets[key] = TokenBucket(burst, rate, now)
+        return bucket
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self.ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            _, _, key = heapq.heappop(self.ready)
+            lane = self.lanes[key]
+            while lane and lane[0].future.done():
+                lane.popleft()  # Cancelled by the caller
+            if not lane:
+                del self.lanes[key]
+                self.scheduled.discard(key)
+                continue
+            now = time.monotonic()
+            bucket = self._bucket(key, now)
+            delay = bucket.take(now)
+            if delay:
+                # Sleep the whole lane without holding a worker; other routes keep going
+                self.deferred += 1
+                loop.call_later(delay, self._schedule, key)
+                continue
+            # The lane stays scheduled while its head is in flight, so no other
+            # worker starts the bucket's next action until this one is done
+            action = lane.popleft()
+            if self.pending_deletes.get(action.scope) is action:
+                del self.pending_deletes[action.scope]
+            try:
+                await self._execute(action, bucket)
+            finally:
+                self._release(key)
+
+    def _release(self, key):
+        if self.lanes[key]:
+            self._schedule(key)
+        else:
+            del self.lanes[key]
+            self.scheduled.discard(key)
+
+    async def _execute(self, action, bucket):
+        try:
+            result, headers = await self.transport(action.func, action.args, action.kwargs)
+        except discord.HTTPException as e:
+            if e.status == 429 and action.retries < ACTION_MAX_RETRIES:
+                action.retries += 1
+                self.rate_limited += 1
+                retry_after = float(e.response.headers.get('Retry-After', 1))
+                bucket.limit(0, retry_after, time.monotonic())
+                self.lanes[(action.route, action.scope)].appendleft(action)
+                return
+            self._fail(action, e)
+            return
+        except Exception as e:
+            self._fail(action, e)
+            return
+        if headers and 'X-RateLimit-Remaining' in headers:
+            bucket.limit(
+                int(headers['X-RateLimit-Remaining']), float(headers.get('X-RateLimit-Reset-After', 0)), time.monotonic()
+            )
+        self.executed += 1
+        if not action.future.done():
+            action.future.set_result(result)
+
+    def _fail(self, action, error):
+        self.failed += 1
+        print(f"Moderation action {action.route} failed: {error}")
+        if not action.future.done():
+            action.future.set_exception(error)
+
+    def summary(self):
+        """One-line Japanese status for embeds"""
+        return (f"待機 {sum(map(len, self.lanes.values()))}件 / 実行 {self.executed}件 / 速度調整 {self.deferred}回 / "
+                f"429 {self.rate_limited}回 / 削除統合 {self.coalesced}件 / 失敗 {self.failed}件")
+
+action_scheduler = ActionScheduler(discord_transport, ACTION_WORKERS)
+
+async def bulk_delete_tracked(guild, entries, reason=None):
+    """Delete tracked messages through the action scheduler; return how many were deleted"""
+    by_channel = {}
+    for _, _, channel_id, message_id in entries:
+        by_channel.setdefault(channel_id, []).append(message_id)
+    futures = []
+    for channel_id, message_ids in by_channel.items():
+        channel = guild.get_channel_or_thread(channel_id)
+        if channel is not None:
+            futures += action_scheduler.delete_messages(channel, message_ids, reason=reason)
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    return sum(result for result in results if not isinstance(result, Exception))
+
+RAID_WINDOW_SECONDS = 60  # how long a message counts towards a raid
+RAID_MIN_LENGTH = 12  # shorter normalized texts (greetings, "lol") are ignored
+RAID_NEW_MEMBER_HOURS = 24  # only members who joined this recently, or have new accounts, count towards a raid
+RAID_FINGERPRINT_CHARS = 128  # only the start of long messages is fingerprinted
+RAID_SIMHASH_DISTANCE = 7  # differing simhash bits still counted as the same text
+RAID_TIMEOUT_SECONDS = 3600
+
+ZERO_WIDTH_CHARS = dict.fromkeys(map(ord, '\u00ad\u200b\u200c\u200d\u200e\u200f\u2060\ufeff'), None)
+
+def normalize_content(text):
+    """Lowercase and NFKC-fold, keeping only letters and digits (drops whitespace, zero-width and punctuation)"""
+    text = unicodedata.normalize('NFKC', text).lower().translate(ZERO_WIDTH_CHARS)
+    return ''.join(ch for ch in text if ch.isalnum())[:RAID_FINGERPRINT_CHARS]
+
+def simhash(text):
+    """64-bit simhash over character trigrams; similar texts differ in few bits"""
+    counts = [0] * 64
+    shingles = {text[i:i + 3] for i in range(max(1, len(text) - 2))}
+    for shingle in shingles:
+        bits = hash(shingle) & 0xFFFFFFFFFFFFFFFF
+        while bits:
+            low = bits & -bits
+            counts[low.bit_length() - 1] += 1
+            bits ^= low
+    half = len(shingles) / 2
+    return sum(1 << i for i, count in enumerate(counts) if count > half)
+
+def simhash_bands(value):
+    # With 8 bands of 8 bits, hashes within 7 bits of each other share at least one band
+    return [(band, (value >> (8 * band)) & 0xFF) for band in range(8)]
+
+class RaidCluster:
+    """Messages in the window that share a fingerprint"""
+    __slots__ = ('simhash', 'hashes', 'users', 'entries', 'alive')
+
+    def __init__(self, simhash_value):
+        self.simhash = simhash_value
+        self.hashes = set()  # exact content hashes matched to this cluster
+        self.users = {}  # {user_id: messages in the window}
+        self.entries = deque()  # (content hash, timestamp, channel ID, message ID), oldest first
+        self.alive = True
+
+class GuildFingerprints:
+    """Sliding window of one guild's message fingerprints
+
+    Identical texts meet in the exact-hash map without computing a simhash;
+    new texts are matched to near-duplicates through the simhash band index.
+    Every message is added once and expired once, so the work per message
+    does not depend on how big or busy the guild is.
+    """
+
+    def __init__(self):
+        self.window = deque()  # (timestamp, cluster, user ID), oldest first
+        self.exact = {}  # {content hash: RaidCluster}
+        self.bands = {}  # {(band, value): RaidCluster}
+
+    def _expire(self, cutoff):
+        while self.window and self.window[0][0] < cutoff:
+            _, cluster, user_id = self.window.popleft()
+            if not cluster.alive:
+                continue  # Already acted on
+            cluster.entries.popleft()
+            cluster.users[user_id] -= 1
+            if not cluster.users[user_id]:
+                del cluster.users[user_id]
+            if not cluster.entries:
+                self._drop(cluster)
+
+    def _drop(self, cluster):
+        cluster.alive = False
+        for content_hash in cluster.hashes:
+            if self.exact.get(content_hash) is cluster:
+                del self.exact[content_hash]
+        for band in simhash_bands(cluster.simhash):
+            if self.bands.get(band) is cluster:
+                del self.bands[band]
+
+    def _find_cluster(self, content_hash, text):
+        cluster = self.exact.get(content_hash)
+        if cluster is not None:
+            return cluster
+        value = simhash(text)
+        for band in simhash_bands(value):
+            cluster = self.bands.get(band)
+            if cluster is not None and bin(cluster.simhash ^ value).count('1') <= RAID_SIMHASH_DISTANCE:
+                break
+        else:
+            cluster = RaidCluster(value)
+            for band in simhash_bands(value):
+                self.bands.setdefault(band, cluster)
+        cluster.hashes.add(content_hash)
+        self.exact[content_hash] = cluster
+        return cluster
+
+    def observe(self, user_id, text, entry, now, min_users):
+        """Add a message; return its cluster once min_users members have posted it"""
+        self._expire(now - RAID_WINDOW_SECONDS)
+        cluster = self._find_cluster(entry[0], text)
+        cluster.entries.append(entry)
+        cluster.users[user_id] = cluster.users.get(user_id, 0) + 1
+        self.window.append((now, cluster, user_id))
+        if len(cluster.users) >= min_users:
+            # Hand the cluster over for action; later copies start a new one
+            self._drop(cluster)
+            return cluster
+        return None
+
+class RaidDetector:
+    """Spots many accounts posting the same or nearly the same text"""
+
+    def __init__(self):
+        self.guilds = {}  # {guild_id: GuildFingerprints}
+
+    @staticmethod
+    def is_suspect(member, now):
+        """Raids come from fresh joins or fresh accounts; regulars chatting alike are not one"""
+        if now - member.created_at.timestamp() < JOIN_MIN_ACCOUNT_AGE_DAYS * 86400:
+            return True
+        return member.joined_at is not None and now - member.joined_at.timestamp() < RAID_NEW_MEMBER_HOURS * 3600
+
+    def observe(self, message, now, min_users):
+        if message.author.guild_permissions.manage_messages:
+            return None  # Moderators posting announcements are not a raid
+        if not self.is_suspect(message.author, now):
+            return None
+        text = normalize_content(message.content)
+        if len(text) < RAID_MIN_LENGTH:
+            return None
+        fingerprints = self.guilds.get(message.guild.id)
+        if fingerprints is None:
+            fingerprints = self.guilds[message.guild.id] = GuildFingerprints()
+        entry = (hash(text), now, message.channel.id, message.id)
+        return fingerprints.observe(message.author.id, text, entry, now, min_users)
+
+    def tracked_messages(self):
+        return sum(len(fingerprints.window) for fingerprints in self.guilds.values())
+
+raid_detector = RaidDetector()
+
+async def handle_raid(message, cluster):
+    """Time out every member of a raid cluster and bulk delete their messages"""
+    guild = message.guild
+    reason = "複数アカウントによる同一メッセージの投稿（レイド）"
+    until = discord.utils.utcnow() + timedelta(seconds=RAID_TIMEOUT_SECONDS)
+    members = [member for member in map(guild.get_member, cluster.users) if member is not None]
+    timeouts = [action_scheduler.submit('timeout', guild.id, member.timeout, until, reason=reason) for member in members]
+    deleted = await bulk_delete_tracked(guild, cluster.entries, reason=reason)
+    results = await asyncio.gather(*timeouts, return_exceptions=True)
+    timed_out = sum(1 for result in results if not isinstance(result, Exception))
+    print(f"Raid detected in {guild.name}: {len(members)} members, {timed_out} timed out, {deleted} messages deleted")
+
+    embed = discord.Embed(
+        title="🚨 レイド検知",
+        description=f"{len(members)}人のアカウントが同じ内容のメッセージを投稿したため、{RAID_TIMEOUT_SECONDS // 60}分のタイムアウトを適用し、{deleted}件のメッセージを削除しました。",
+        color=0xff0000
+    )
+    action_scheduler.submit('send', message.channel.id, message.channel.send, embed=embed, delete_after=30)
+
+JOIN_WINDOW_SECONDS = 60
+JOIN_SPIKE_THRESHOLD = 10  # joins within the window that start a lockdown
+JOIN_MIN_ACCOUNT_AGE_DAYS = 7  # younger accounts are flagged during a spike
+JOIN_TRACK_MAX = 512  # joins remembered per guild
+JOIN_RAID_ACTION = 'timeout'  # 'timeout' or 'kick' for flagged accounts
+JOIN_RAID_TIMEOUT_SECONDS = 3600
+LOCKDOWN_SECONDS = 900
+
+class JoinGuard:
+    """Per-guild join-rate window and lockdown state
+
+    Joins are kept as (timestamp, member ID, new account?) tuples in a
+    bounded deque per guild, so a flood of thousands of joins per minute
+    costs one small tuple each and nothing grows without limit.
+    """
+
+    def __init__(self):
+        self.joins = {}  # {guild_id: deque}
+        self.lockdowns = {}  # {guild_id: (lift time, verification level before, lift task)}
+
+    def record(self, member, now):
+        """Record a join; return the flagged member IDs if this join starts a spike, else None"""
+        joins = self.joins.get(member.guild.id)
+        if joins is None:
+            joins = self.joins[member.guild.id] = deque(maxlen=JOIN_TRACK_MAX)
+        joins.append((now, member.id, self.is_new_account(member, now)))
+        while joins and joins[0][0] < now - JOIN_WINDOW_SECONDS:
+            joins.popleft()
+        if len(joins) >= JOIN_SPIKE_THRESHOLD and not self.is_locked(member.guild.id):
+            return [member_id for _, member_id, is_new in joins if is_new]
+        return None
+
+    def is_new_account(self, member, now):
+        return now - member.created_at.timestamp() < JOIN_MIN_ACCOUNT_AGE_DAYS * 86400
+
+    def is_locked(self, guild_id):
+        return guild_id in self.lockdowns
+
+    def join_rate(self, guild_id, now):
+        joins = self.joins.get(guild_id, ())
+        return sum(1 for joined, _, _ in joins if joined >= now - JOIN_WINDOW_SECONDS)
+
+join_guard = JoinGuard()
+
+async def act_on_flagged_members(guild, member_ids):
+    """Time out or kick flagged accounts concurrently; return how many succeeded"""
+    reason = "参加数急増（レイド）時の新規アカウント"
+    members = [member for member in map(guild.get_member, member_ids) if member is not None]
+    if JOIN_RAID_ACTION == 'kick':
+        actions = [action_scheduler.submit('kick', guild.id, member.kick, reason=reason) for member in members]
+    else:
+        until = discord.utils.utcnow() + timedelta(seconds=JOIN_RAID_TIMEOUT_SECONDS)
+        actions = [action_scheduler.submit('timeout', guild.id, member.timeout, until, reason=reason) for member in members]
+    results = await asyncio.gather(*actions, return_exceptions=True)
+    return sum(1 for result in results if not isinstance(result, Exception))
+
+async def send_guard_notice(guild, embed):
+    channel = guild.system_channel
+    if channel is None:
+        return
+    try:
+        await channel.send(embed=embed)
+    except discord.HTTPException:
+        pass
+
+async def start_lockdown(guild, flagged_ids, seconds=LOCKDOWN_SECONDS):
+    """Raise the verification level, pause the role panels and act on the flagged cohort"""
+    existing = join_guard.lockdowns.get(guild.id)
+    if existing is not None:
+        # Already locked down (or starting): keep the level saved before the first lockdown,
+        # and restart the timer instead of stacking another lift task
+        previous_level = existing[1]
+        if existing[2] is not None:
+            existing[2].cancel()
+    else:
+        previous_level = guild.verification_level if guild.verification_level < discord.VerificationLevel.high else None
+    # Record the lockdown before any await, so joins arriving meanwhile see it and don't start another
+    join_guard.lockdowns[guild.id] = (time.time() + seconds, previous_level, None)
+    if existing is None and previous_level is not None:
+        try:
+            await guild.edit(verification_level=discord.VerificationLevel.high, reason="参加数急増によるロックダウン")
+        except discord.HTTPException as e:
+            print(f"Failed to raise verification level in {guild.name}: {e}")
+            previous_level = None
+    state = join_guard.lockdowns.get(guild.id)
+    if state is None:
+        # Lifted while the verification level was being raised
+        if previous_level is not None:
+            try:
+                await guild.edit(verification_level=previous_level, reason="ロックダウン解除")
+            except discord.HTTPException as e:
+                print(f"Failed to restore verification level in {guild.name}: {e}")
+        return
+    task = asyncio.create_task(lift_lockdown_later(guild, seconds))
+    join_guard.lockdowns[guild.id] = (state[0], previous_level, task)
+
+    handled = await act_on_flagged_members(guild, flagged_ids)
+    action_text = 'キック' if JOIN_RAID_ACTION == 'kick' else 'タイムアウト'
+    print(f"Join spike in {guild.name}: lockdown started, {handled}/{len(flagged_ids)} new accounts handled")
+    embed = discord.Embed(
+        title="🔒 ロックダウン開始",
+        description=(f"{JOIN_WINDOW_SECONDS}秒以内の参加が{JOIN_SPIKE_THRESHOLD}人を超えたため、{seconds // 60}分間ロックダウンします。\n"
+                     f"• 認証レベルを引き上げ、ロールパネルを一時停止しました\n"
+                     f"• 作成{JOIN_MIN_ACCOUNT_AGE_DAYS}日未満のアカウント{handled}件を{action_text}しました"),
+        color=0xff0000
+    )
+    await send_guard_notice(guild, embed)
+
+async def lift_lockdown_later(guild, seconds):
+    await asyncio.sleep(seconds)
+    await lift_lockdown(guild)
+
+async def lift_lockdown(guild):
+    state = join_guard.lockdowns.pop(guild.id, None)
+    if state is None:
+        return False
+    _, previous_level, task = state
+    if task is not None and task is not asyncio.current_task():
+        task.cancel()
+    if previous_level is not None and guild.verification_level == discord.VerificationLevel.high:
+        try:
+            await guild.edit(verification_level=previous_level, reason="ロックダウン解除")
+        except discord.HTTPException as e:
+            print(f"Failed to restore verification level in {guild.name}: {e}")
+    embed = discord.Embed(
+        title="🔓 ロックダウン解除",
+        description="認証レベルを元に戻し、ロールパネルを再開しました。",
+        color=0x00ff00
+    )
+    await send_guard_notice(guild, embed)
+    return True
+
+LOCKDOWN_PANEL_MESSAGE = '❌ 現在レイド対策のロックダウン中のため、ロールの付与を一時停止しています。'
+
+BOT_SPAM_MAX_WINDOW_SECONDS = 60  # longest bot_window a policy may set; windows idle this long are dropped
+BOT_SPAM_MAX_THRESHOLD = 20  # highest bot_count a policy may set; bounds each window's deque
+BOT_SPAM_MAX_TRACKED = 5000  # (guild, channel, bot) windows kept; the least recently active go first
+
+class BotSpamDetector:
+    """Message-rate windows per (guild, channel, bot)
+
+    Each window is a deque of at most max_threshold (timestamp, message ID)
+    pairs, and windows are kept in least-recently-active order and dropped
+    once max_window_seconds pass without a message, so memory is bounded by
+    the bots active in the last minute. The rate itself comes from the
+    guild's policy on every call.
+    """
+
+    def __init__(self, max_window_seconds, max_threshold, max_tracked):
+        self.max_window_seconds = max_window_seconds
+        self.max_threshold = max_threshold
+        self.max_tracked = max_tracked
+        self.windows = OrderedDict()  # {(guild_id, channel_id, bot_id): deque}
+        self.checked = 0
+        self.flagged = 0  # spam bursts detected
+        self.banned = 0  # bots actually banned for them (bot_ban may be off)
+
+    def __len__(self):
+        return len(self.windows)
+
+    def record(self, key, message_id, now, window_seconds, threshold):
+        """Add a bot message; return its recent message IDs if threshold were sent within window_seconds, else None"""
+        self.checked += 1
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = deque(maxlen=self.max_threshold)
+        else:
+            self.windows.move_to_end(key)
+        window.append((now, message_id))
+        self._evict(now)
+        if len(window) >= threshold and now - window[-threshold][0] <= window_seconds:
+            self.flagged += 1
+            del self.windows[key]
+            return [message_id for sent, message_id in window if now - sent <= window_seconds]
+        return None
+
+    def _evict(self, now):
+        while self.windows:
+            key, window = next(iter(self.windows.items()))
+            if now - window[-1][0] <= self.max_window_seconds and len(self.windows) <= self.max_tracked:
+                break
+            del self.windows[key]
+
+    def clear(self):
+        self.windows.clear()
 
-user_message_history = {}
-bot_message_count = {}
+bot_spam_detector = BotSpamDetector(BOT_SPAM_MAX_WINDOW_SECONDS, BOT_SPAM_MAX_THRESHOLD, BOT_SPAM_MAX_TRACKED)
 
 DATA_FILE = 'bot_data.json'
 
@@ -49,13 +727,1635 @@ def load_data():
         'user_levels': {}
     }
 
-def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def write_file_atomic(path, raw):
+    # Write to a temp file and rename so a crash never leaves a half-written file
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+def encode_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def write_json_file(path, data):
+    write_file_atomic(path, encode_json(data))
+
+def read_json_file(path, default):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return default
+
+# Snapshot files start with DATA_MAGIC, a format version byte and a codec ID
+# byte, so any file can be read whatever DATA_FORMAT is set to now. Files
+# without the header are the plain JSON written by older versions.
+DATA_MAGIC = b'MMBD'
+DATA_FORMAT_VERSION = 1
+SNAPSHOT_CODECS = {  # {name: (codec ID, encode, decode)}
+    'json': (0, encode_json, lambda raw: json.loads(raw.decode('utf-8'))),
+}
+SNAPSHOT_DECODERS = {  # {codec ID: (name, decode)}
+    0: ('json', SNAPSHOT_CODECS['json'][2]),
+    1: ('orjson', SNAPSHOT_CODECS['json'][2]),  # orjson output is plain JSON
+}
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    SNAPSHOT_CODECS['orjson'] = (1, orjson.dumps, orjson.loads)
+    SNAPSHOT_DECODERS[1] = ('orjson', orjson.loads)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+else:
+    SNAPSHOT_CODECS['msgpack'] = (2, msgpack.packb, lambda raw: msgpack.unpackb(raw, strict_map_key=False))
+    SNAPSHOT_DECODERS[2] = ('msgpack', SNAPSHOT_CODECS['msgpack'][2])
+
+DATA_FORMAT = os.environ.get('DATA_FORMAT', 'json')  # json, orjson or msgpack
+if DATA_FORMAT not in SNAPSHOT_CODECS:
+    print(f"Data format {DATA_FORMAT!r} is not available, using json")
+    DATA_FORMAT = 'json'
+
+def encode_snapshot(data, codec=None):
+    codec_id, encode, _ = SNAPSHOT_CODECS[codec or DATA_FORMAT]
+    return DATA_MAGIC + bytes((DATA_FORMAT_VERSION, codec_id)) + encode(data)
+
+def decode_snapshot(raw):
+    """Return (data, codec name); the name is None for headerless legacy JSON"""
+    if not raw.startswith(DATA_MAGIC):
+        return json.loads(raw.decode('utf-8')), None
+    header_size = len(DATA_MAGIC) + 2
+    version, codec_id = raw[len(DATA_MAGIC):header_size]
+    if version != DATA_FORMAT_VERSION:
+        raise ValueError(f"Unsupported data format version {version}")
+    if codec_id not in SNAPSHOT_DECODERS:
+        raise ValueError(f"Data file needs codec {codec_id}, which is not installed")
+    name, decode = SNAPSHOT_DECODERS[codec_id]
+    return decode(raw[header_size:]), name
+
+def write_snapshot_file(path, data):
+    write_file_atomic(path, encode_snapshot(data))
+
+def read_snapshot_file(path, default):
+    if not os.path.exists(path):
+        return default, DATA_FORMAT
+    with open(path, 'rb') as f:
+        return decode_snapshot(f.read())
+
+class StorageIO:
+    """Runs file reads, serialization and writes on one dedicated thread
+
+    A single worker means writes are applied in the order they were
+    submitted and never interleave, and the event loop (gateway heartbeat,
+    other guilds' events) keeps running while the disk works.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def read_json(self, path, default):
+        return await self.run(read_json_file, path, default)
+
+    async def write_json(self, path, data):
+        await self.run(write_json_file, path, data)
+
+storage_io = StorageIO()
+
+DATA_FLUSH_INTERVAL = 5  # seconds to wait after a change before writing to disk
+DATA_DIR = 'data'
+SHARD_IDLE_SECONDS = 1800  # drop a guild's data from memory after this long without access
+JOURNAL_FILE = 'bot_data.journal'  # journal of the old single-file layout, read when migrating
+JOURNAL_COMPACT_RECORDS = 5000  # fold the journal into a snapshot after this many records
+JOURNAL_COMPACT_INTERVAL = 600  # ...or at least this often (seconds) while it has records
+
+XP_CURVE_LEVELS = 1000  # levels precomputed per curve; higher levels repeat the last step
+
+class XPCurve(namedtuple('XPCurve', 'kind base growth steps')):
+    """XP needed to go from each level to the next
+
+    linear: every level costs base XP
+    quadratic: level n costs base + growth * (n - 1), so totals grow quadratically
+    custom: steps lists the cost of each level; the last one repeats
+    """
+    KINDS = ('linear', 'quadratic', 'custom')
+
+    def step(self, level):
+        if self.kind == 'custom':
+            return self.steps[min(level, len(self.steps)) - 1]
+        if self.kind == 'quadratic':
+            return self.base + self.growth * (level - 1)
+        return self.base
+
+    @classmethod
+    def from_json(cls, value):
+        curve = cls(value['kind'], value.get('base', 100), value.get('growth', 0), tuple(value.get('steps', ())))
+        if curve.kind not in cls.KINDS or (curve.kind == 'custom' and not curve.steps):
+            raise ValueError(f"Invalid XP curve: {value}")
+        return curve
+
+    def to_json(self):
+        return dict(self._asdict(), steps=list(self.steps))
+
+class LevelTable:
+    """Cumulative XP thresholds of a curve; a level lookup is one bisect"""
+
+    def __init__(self, curve):
+        self.thresholds = [0]  # thresholds[n - 1]: total XP at which level n starts
+        for level in range(1, XP_CURVE_LEVELS):
+            self.thresholds.append(self.thresholds[-1] + curve.step(level))
+        self.last_step = curve.step(XP_CURVE_LEVELS)
+
+    def lookup(self, total_xp):
+        """Return (level, xp into that level, xp that level needs)"""
+        top = self.thresholds[-1]
+        if total_xp >= top:
+            extra_levels, xp = divmod(total_xp - top, self.last_step)
+            return XP_CURVE_LEVELS + extra_levels, xp, self.last_step
+        level = bisect.bisect_right(self.thresholds, total_xp)
+        return level, total_xp - self.thresholds[level - 1], self.thresholds[level] - self.thresholds[level - 1]
+
+DEFAULT_XP_CURVE = XPCurve('linear', 100, 0, ())
+DEFAULT_LEVEL_TABLE = LevelTable(DEFAULT_XP_CURVE)
+_level_tables = {}  # {guild_id: (XPCurve, LevelTable)}
+
+def level_table_for(guild_id):
+    """Return the compiled level table of the guild's XP curve"""
+    curve = config_registry.get('xp_curve', guild_id) if guild_id is not None else None
+    if curve is None:
+        return DEFAULT_LEVEL_TABLE
+    cached = _level_tables.get(str(guild_id))
+    if cached is None or cached[0] is not curve:
+        cached = (curve, LevelTable(curve))
+        _level_tables[str(guild_id)] = cached
+    return cached[1]
+
+def level_from_total_xp(total_xp, guild_id=None):
+    """Return (level, xp into that level) for a total XP amount on the guild's curve"""
+    level, xp, _ = level_table_for(guild_id).lookup(total_xp)
+    return level, xp
+
+def new_level_record():
+    return {'level': 1, 'xp': 0, 'total_xp': 0}
+
+class WriteBackStore:
+    """Debounced background flushing shared by the storage backends"""
+
+    def __init__(self):
+        self.dirty = set()
+        self._flush_event = None
+        self._flush_task = None
+        self._io_lock = None
+
+    def mark_dirty(self, name):
+        self.dirty.add(name)
+        if self._flush_event:
+            self._flush_event.set()
+
+    def start(self):
+        """Start the debounced background writer (needs a running event loop)"""
+        if self._flush_task is None:
+            self._flush_event = asyncio.Event()
+            self._io_lock = asyncio.Lock()
+            if self.dirty:
+                self._flush_event.set()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await self._flush_event.wait()
+            # Let more changes pile up so a burst of messages becomes one write
+            await asyncio.sleep(DATA_FLUSH_INTERVAL)
+            self._flush_event.clear()
+            try:
+                await self.flush_async()
+            except Exception as e:
+                print(f"Error saving bot data: {e}")
+
+def read_journal(path):
+    """Yield the records of a journal file, skipping a torn trailing line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A crash can leave the last record half-written
+                print(f"Skipping damaged journal record in {path}: {line[:50]!r}")
+                yield None
+
+class DataShard:
+    """One snapshot + journal file pair holding part of the bot data
+
+    Each mutation is a small record applied in memory and queued for the
+    journal. On load the journal is replayed on top of the snapshot, and
+    compaction folds it into a fresh snapshot written via temp file + rename.
+    """
+
+    def __init__(self, name, sections):
+        self.name = name
+        self.path = os.path.join(DATA_DIR, f'{name}.json')
+        self.journal_path = os.path.join(DATA_DIR, f'{name}.journal')
+        self.sections = sections
+        self.data = None
+        self.seq = 0
+        self.pending = []
+        self.journal_records = 0
+        self.dirty = False
+        self.last_access = time.monotonic()
+
+    def empty(self):
+        """Start a shard that has no files yet, without touching the disk"""
+        self.data = {name: {} for name in self.sections}
+        return self
+
+    def load(self):
+        data, codec = read_snapshot_file(self.path, {})
+        if codec != DATA_FORMAT:
+            self.dirty = True  # Rewritten in the configured format at the next compaction
+        self.seq = data.pop('_seq', 0)
+        for name in self.sections:
+            data.setdefault(name, {})
+        self.data = data
+        if self._replay_journal():
+            # Rewrite now so new records are not appended after a torn line
+            self._write_changes(*self.take_changes(True))
+        return self
+
+    def _replay_journal(self):
+        """Apply journal records newer than the snapshot; return True if any were damaged"""
+        damaged = False
+        for op in read_journal(self.journal_path):
+            if op is None:
+                damaged = True
+                continue
+            if op['s'] <= self.seq:
+                continue  # Already folded into the snapshot
+            self.seq = op['s']
+            self.apply(op)
+            self.journal_records += 1
+            self.dirty = True
+        return damaged
+
+    def commit(self, op):
+        self.seq += 1
+        op['s'] = self.seq
+        result = self.apply(op)
+        self.pending.append(op)
+        self.dirty = True
+        return result
+
+    def apply(self, op):
+        kind = op['op']
+        data = self.data
+        if kind == 'user':
+            data['users'][op['u']] = op['v']
+            return op['v']
+        if kind == 'xp':
+            old = data['user_levels'].get(op['u']) or new_level_record()
+            total_xp = old['total_xp'] + op['n']
+            level, xp = level_from_total_xp(total_xp, self.name)
+            record = {'level': level, 'xp': xp, 'total_xp': total_xp}
+            data['user_levels'][op['u']] = record
+            return old, record
+        if kind == 'relevel':
+            # The guild's XP curve changed: rebuild every level record in one pass
+            lookup = level_table_for(self.name).lookup
+            levels = {}
+            for user_id, record in data['user_levels'].items():
+                level, xp, _ = lookup(record['total_xp'])
+                levels[user_id] = {'level': level, 'xp': xp, 'total_xp': record['total_xp']}
+            data['user_levels'] = levels
+            return len(levels)
+        if kind == 'ticket':
+            ticket = dict(data['tickets'].get(op['t'], {}), **op['v'])
+            data['tickets'][op['t']] = ticket
+            return ticket
+        if kind == 'poll':
+            # Votes update the stored poll in place, so keep the journaled record untouched
+            poll = dict(op['v'], votes=list(op['v']['votes']), voters=dict(op['v']['voters']))
+            data['polls'][op['p']] = poll
+            return poll
+        if kind == 'vote':
+            poll = data['polls'].get(op['p'])
+            if poll is None:
+                return None
+            if op['u'] in poll['voters']:
+                poll['votes'][poll['voters'][op['u']]] -= 1
+            poll['voters'][op['u']] = op['o']
+            poll['votes'][op['o']] += 1
+            return poll
+        if kind == 'warn':
+            old = data['warnings'].get(op['u']) or {'count': 0, 'history': []}
+            record = {'count': old['count'] + 1, 'history': old['history'] + [op['v']]}
+            data['warnings'][op['u']] = record
+            return record
+        raise ValueError(f"Unknown journal op: {kind}")
+
+    def _snapshot(self):
+        """Copy the containers so the writer thread sees a stable document
+
+        Level, ticket, user and warning records are replaced rather than
+        modified, so sharing them is safe; polls are updated in place by
+        votes and are copied.
+        """
+        snapshot = {'_seq': self.seq}
+        for name in self.sections:
+            if name == 'polls':
+                snapshot[name] = {
+                    poll_id: dict(poll, votes=list(poll['votes']), voters=dict(poll['voters']))
+                    for poll_id, poll in self.data[name].items()
+                }
+            else:
+                snapshot[name] = dict(self.data[name])
+        return snapshot
+
+    def needs_compaction(self):
+        return bool(self.pending or self.journal_records or self.dirty)
+
+    def take_changes(self, compact):
+        """Detach pending records, plus a snapshot when compacting, for the writer"""
+        pending, self.pending = self.pending, []
+        self.journal_records += len(pending)
+        snapshot = None
+        if compact or self.journal_records >= JOURNAL_COMPACT_RECORDS:
+            snapshot = self._snapshot()
+            self.journal_records = 0
+            self.dirty = False
+        return pending, snapshot
+
+    def restore_changes(self, pending, snapshot):
+        """Put back changes whose write failed; replay skips records appended twice"""
+        self.pending = pending + self.pending
+        self.journal_records = max(0, self.journal_records - len(pending))
+        if snapshot is not None:
+            self.dirty = True
+
+    def _write_changes(self, pending, snapshot):
+        if pending:
+            lines = ''.join(json.dumps(op, ensure_ascii=False, separators=(',', ':')) + '\n' for op in pending)
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        if snapshot is not None:
+            write_snapshot_file(self.path, snapshot)
+            # The snapshot now covers every journaled record; replay would skip them anyway
+            open(self.journal_path, 'w').close()
+
+class DataStore(WriteBackStore):
+    """Per-guild sharded JSON storage kept in memory with journaled write-back
+
+    Users live in data/global.json, which load() reads; each guild's levels,
+    tickets, polls and warnings live in data/<guild_id>.json, so a busy guild
+    only ever rewrites its own file. A guild's shard is read through
+    storage_io the first time it is used and dropped from memory once it has
+    been idle for SHARD_IDLE_SECONDS with all its changes on disk, so memory
+    follows the guilds in use rather than every guild the bot has seen.
+    """
+    GUILD_SECTIONS = ('user_levels', 'tickets', 'polls', 'warnings')
+
+    def __init__(self):
+        super().__init__()
+        self.users = None
+        self.guilds = {}  # {guild ID: DataShard} of the shards in memory
+        self.on_disk = set()  # guild IDs with files in DATA_DIR
+        self._loading = {}  # {guild ID: task reading the shard on the storage thread}
+        self._compact_task = None
+
+    def load(self):
+        if self.users is None:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            is_new = not os.path.exists(os.path.join(DATA_DIR, 'global.json'))
+            # A new guild's first changes may only be in its journal, so look at both file kinds
+            self.on_disk = {
+                os.path.splitext(name)[0] for name in os.listdir(DATA_DIR) if name.endswith(('.json', '.journal'))
+            } - {'global'}
+            self.users = DataShard('global', ('users',)).load()
+            if is_new and os.path.exists(DATA_FILE):
+                migrate_legacy_data(self)
+        return self
+
+    async def guild(self, guild_id):
+        """Return the guild's shard, reading it on the storage thread if it is not in memory"""
+        self.load()
+        key = str(guild_id)
+        shard = self.guilds.get(key)
+        if shard is None:
+            if key in self.on_disk:
+                # Concurrent first uses share one read
+                task = self._loading.get(key)
+                if task is None:
+                    task = self._loading[key] = asyncio.create_task(self._read_guild(key))
+                shard = await task
+            else:
+                shard = self.guilds[key] = DataShard(key, self.GUILD_SECTIONS).empty()
+        shard.last_access = time.monotonic()
+        return shard
+
+    async def _read_guild(self, key):
+        try:
+            shard = await storage_io.run(DataShard(key, self.GUILD_SECTIONS).load)
+            self.guilds[key] = shard
+            return shard
+        finally:
+            del self._loading[key]
+
+    def guild_blocking(self, guild_id):
+        """guild() for code that runs off the event loop (migrations, shutdown); reads on the calling thread"""
+        self.load()
+        key = str(guild_id)
+        shard = self.guilds.get(key)
+        if shard is None:
+            shard = DataShard(key, self.GUILD_SECTIONS)
+            shard = self.guilds[key] = shard.load() if key in self.on_disk else shard.empty()
+        return shard
+
+    def guild_ids(self):
+        """IDs of every guild that has data, in memory or on disk"""
+        self.load()
+        return sorted(self.on_disk | set(self.guilds))
+
+    def evict_idle(self, now):
+        """Drop guild shards idle for SHARD_IDLE_SECONDS whose changes have all been written
+
+        Only call it with no write in flight (flush_async holds the I/O lock),
+        or a failed write would put its records back into a dropped shard.
+        """
+        for key, shard in list(self.guilds.items()):
+            if not shard.pending and now - shard.last_access >= SHARD_IDLE_SECONDS:
+                del self.guilds[key]
+
+    def _commit(self, shard, op):
+        result = shard.commit(op)
+        self.mark_dirty(shard.name)
+        return result
+
+    def _shards(self):
+        shards = [self.users] if self.users else []
+        return shards + list(self.guilds.values())
+
+    def _written(self, shards):
+        self.on_disk.update(shard.name for shard in shards if shard is not self.users)
+
+    def flush(self):
+        """Append pending changes to the journals (compacting those that grew large)"""
+        for shard in self._shards():
+            if shard.pending:
+                shard._write_changes(*shard.take_changes(False))
+                self._written([shard])
+        self.dirty.clear()
+
+    def compact(self):
+        """Fold every loaded shard's journal into a fresh snapshot"""
+        for shard in self._shards():
+            if shard.needs_compaction():
+                shard._write_changes(*shard.take_changes(True))
+                self._written([shard])
+
+    async def flush_async(self, compact=False):
+        if self.users is None:
+            return
+        async with self._io_lock:
+            self.dirty.clear()
+            writes = []
+            for shard in self._shards():
+                if shard.pending or (compact and shard.needs_compaction()):
+                    writes.append((shard,) + shard.take_changes(compact))
+            if writes:
+                try:
+                    await storage_io.run(self._write_all, writes)
+                except Exception:
+                    for shard, pending, snapshot in writes:
+                        shard.restore_changes(pending, snapshot)
+                    raise
+                self._written([shard for shard, _, _ in writes])
+            if compact:
+                self.evict_idle(time.monotonic())
+
+    def _write_all(self, writes):
+        for shard, pending, snapshot in writes:
+            shard._write_changes(pending, snapshot)
+
+    def start(self):
+        super().start()
+        if self._compact_task is None:
+            self._compact_task = asyncio.create_task(self._compact_loop())
+
+    async def _compact_loop(self):
+        while True:
+            await asyncio.sleep(JOURNAL_COMPACT_INTERVAL)
+            try:
+                await self.flush_async(compact=True)
+            except Exception as e:
+                print(f"Error compacting bot data: {e}")
+
+    # Users
+    async def get_user(self, user_id):
+        return self.load().users.data['users'].get(str(user_id))
+
+    async def set_user(self, user_id, record):
+        self._commit(self.load().users, {'op': 'user', 'u': str(user_id), 'v': record})
+
+    # Levels
+    async def get_level(self, guild_id, user_id):
+        return (await self.guild(guild_id)).data['user_levels'].get(str(user_id))
+
+    async def add_xp(self, guild_id, user_id, amount):
+        """Add XP and return (old_record, new_record)"""
+        return self._commit(await self.guild(guild_id), {'op': 'xp', 'u': str(user_id), 'n': amount})
+
+    async def recompute_levels(self, guild_id):
+        """Recompute every level record of the guild after its XP curve changed"""
+        return self._commit(await self.guild(guild_id), {'op': 'relevel'})
+
+    async def all_levels(self, guild_id):
+        """Return [(user_id, total_xp)] for every member with XP in the guild"""
+        return [(user_id, record['total_xp']) for user_id, record in (await self.guild(guild_id)).data['user_levels'].items()]
+
+    async def add_xp_many(self, grants):
+        """Apply {(guild_id, user_id): amount}; return [(guild_id, user_id, old, new)]"""
+        results = []
+        for (guild_id, user_id), amount in grants.items():
+            shard = await self.guild(guild_id)
+            results.append((guild_id, user_id) + self._commit(shard, {'op': 'xp', 'u': str(user_id), 'n': amount}))
+        return results
+
+    def add_xp_many_blocking(self, grants):
+        """add_xp_many() for shutdown, when no event loop is left to read shards through"""
+        return [
+            (guild_id, user_id) + self._commit(self.guild_blocking(guild_id), {'op': 'xp', 'u': str(user_id), 'n': amount})
+            for (guild_id, user_id), amount in grants.items()
+        ]
+
+    async def top_levels(self, guild_id, limit, offset=0):
+        guild_levels = (await self.guild(guild_id)).data['user_levels']
+        top = heapq.nlargest(offset + limit, guild_levels.items(), key=lambda item: item[1]['total_xp'])
+        return top[offset:]
+
+    # Tickets
+    async def get_ticket(self, guild_id, ticket_id):
+        return (await self.guild(guild_id)).data['tickets'].get(str(ticket_id))
+
+    async def next_ticket_id(self, guild_id):
+        tickets = (await self.guild(guild_id)).data['tickets']
+        ticket_id = len(tickets) + 1
+        while str(ticket_id) in tickets:
+            ticket_id += 1
+        return ticket_id
+
+    async def set_ticket(self, guild_id, ticket_id, record):
+        self._commit(await self.guild(guild_id), {'op': 'ticket', 't': str(ticket_id), 'v': dict(record, guild_id=str(guild_id))})
+
+    async def update_ticket(self, guild_id, ticket_id, fields):
+        if await self.get_ticket(guild_id, ticket_id) is None:
+            return None
+        return self._commit(await self.guild(guild_id), {'op': 'ticket', 't': str(ticket_id), 'v': fields})
+
+    async def list_tickets(self, guild_id, status=None):
+        return [
+            (ticket_id, ticket) for ticket_id, ticket in (await self.guild(guild_id)).data['tickets'].items()
+            if status is None or ticket['status'] == status
+        ]
+
+    # Polls
+    async def get_poll(self, guild_id, poll_id):
+        return (await self.guild(guild_id)).data['polls'].get(str(poll_id))
+
+    async def set_poll(self, guild_id, poll_id, record):
+        self._commit(await self.guild(guild_id), {'op': 'poll', 'p': str(poll_id), 'v': dict(record, guild_id=guild_id)})
+
+    async def record_vote(self, guild_id, poll_id, user_id, option_index):
+        if await self.get_poll(guild_id, poll_id) is None:
+            return None
+        return self._commit(await self.guild(guild_id), {'op': 'vote', 'p': str(poll_id), 'u': str(user_id), 'o': option_index})
+
+    # Warnings
+    async def get_warnings(self, guild_id, user_id):
+        return (await self.guild(guild_id)).data['warnings'].get(str(user_id))
+
+    async def add_warning(self, guild_id, user_id, entry):
+        return self._commit(await self.guild(guild_id), {'op': 'warn', 'u': str(user_id), 'v': entry})
+
+def migrate_legacy_data(store):
+    """Split the old single bot_data.json (and its journal) into shard files"""
+    data = load_data()
+    seq = data.pop('_seq', 0)
+    store.users.data['users'].update(data.get('users', {}))
+    for guild_id, guild_levels in data.get('user_levels', {}).items():
+        store.guild_blocking(guild_id).data['user_levels'].update(guild_levels)
+    for guild_id, guild_warnings in data.get('warnings', {}).items():
+        store.guild_blocking(guild_id).data['warnings'].update(guild_warnings)
+    ticket_guilds = {}
+    for ticket_id, ticket in data.get('tickets', {}).items():
+        store.guild_blocking(ticket['guild_id']).data['tickets'][ticket_id] = ticket
+        ticket_guilds[ticket_id] = ticket['guild_id']
+    poll_guilds = {}
+    for poll_id, poll in data.get('polls', {}).items():
+        store.guild_blocking(poll['guild_id']).data['polls'][poll_id] = poll
+        poll_guilds[poll_id] = poll['guild_id']
+
+    # Records that never made it into the old snapshot
+    for op in read_journal(JOURNAL_FILE):
+        if op is None or op['s'] <= seq:
+            continue
+        kind = op['op']
+        if kind == 'user':
+            shard = store.users
+        elif kind in ('xp', 'warn'):
+            shard = store.guild_blocking(op['g'])
+        elif kind == 'ticket':
+            ticket_guilds.setdefault(op['t'], op['v'].get('guild_id'))
+            if not ticket_guilds[op['t']]:
+                continue
+            shard = store.guild_blocking(ticket_guilds[op['t']])
+        else:
+            if kind == 'poll':
+                poll_guilds.setdefault(op['p'], op['v']['guild_id'])
+            if op['p'] not in poll_guilds:
+                continue
+            shard = store.guild_blocking(poll_guilds[op['p']])
+        shard.commit({key: value for key, value in op.items() if key not in ('g', 's')})
+
+    for shard in store._shards():
+        shard.dirty = True
+    store.compact()
+    for path in (DATA_FILE, JOURNAL_FILE):
+        if os.path.exists(path):
+            os.replace(path, path + '.migrated')
+    print(f"Migrated {DATA_FILE} into {len(store.guilds)} guild files under {DATA_DIR}/")
+
+DB_FILE = 'bot_data.db'
+SQLITE_WAL_SIZE_LIMIT = 4 * 1024 * 1024  # Bytes the WAL file is cut back to once a checkpoint lets it restart
+SQLITE_XP_BATCH = 500  # grants per upsert statement, 3 parameters each (SQLite allows 32766)
+
+class SQLiteStore(WriteBackStore):
+    """Indexed SQLite storage, enabled with STORAGE_BACKEND=sqlite
+
+    Writes run on the storage thread through a connection only that thread
+    uses, and each one is committed before its result comes back to the
+    loop. Reads use a second, query-only connection on the loop; in WAL mode
+    they never wait for the writer and see every committed write.
+    """
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            authenticated INTEGER NOT NULL DEFAULT 0,
+            join_date TEXT
+        );
+        CREATE TABLE IF NOT EXISTS user_levels (
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            level INTEGER NOT NULL,
+            xp INTEGER NOT NULL,
+            total_xp INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_levels_guild_xp ON user_levels (guild_id, total_xp);
+        CREATE TABLE IF NOT EXISTS tickets (
+            guild_id TEXT NOT NULL,
+            ticket_id INTEGER NOT NULL,
+            user_id TEXT,
+            channel_id TEXT,
+            created_at TEXT,
+            description TEXT,
+            status TEXT NOT NULL,
+            closed_at TEXT,
+            closed_by TEXT,
+            PRIMARY KEY (guild_id, ticket_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_tickets_guild_status ON tickets (guild_id, status);
+        CREATE TABLE IF NOT EXISTS polls (
+            poll_id TEXT PRIMARY KEY,
+            guild_id TEXT NOT NULL,
+            channel_id TEXT,
+            question TEXT,
+            options TEXT NOT NULL,
+            creator TEXT
+        );
+        CREATE TABLE IF NOT EXISTS poll_votes (
+            poll_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            option_index INTEGER NOT NULL,
+            PRIMARY KEY (poll_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS warnings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            reason TEXT,
+            moderator_id TEXT,
+            timestamp TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_warnings_guild_user ON warnings (guild_id, user_id);
+    '''
+    TICKET_FIELDS = ('user_id', 'channel_id', 'created_at', 'description', 'status', 'closed_at', 'closed_by')
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.conn = None  # query-only, used on the event loop
+        self.writer = None  # used by the storage thread (and at shutdown, once it is idle)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def load(self):
+        if self.conn is None:
+            is_new = not os.path.exists(self.path)
+            writer = self._connect()
+            writer.execute('PRAGMA journal_mode=WAL')
+            # A commit only appends to the WAL; fsync waits for the checkpoint
+            writer.execute('PRAGMA synchronous=NORMAL')
+            writer.execute(f'PRAGMA journal_size_limit={SQLITE_WAL_SIZE_LIMIT}')
+            writer.executescript(self.SCHEMA)
+            self.writer = writer
+            if is_new and (os.path.exists(DATA_FILE) or os.path.isdir(DATA_DIR)):
+                migrate_json_to_sqlite(DataStore().load(), self)
+            conn = self._connect()
+            conn.execute('PRAGMA query_only=ON')
+            self.conn = conn
+        return self.conn
+
+    def _query(self, sql, params=(), conn=None):
+        return (conn or self.load()).execute(sql, params).fetchall()
+
+    def _query_one(self, sql, params=(), conn=None):
+        rows = self._query(sql, params, conn)
+        return rows[0] if rows else None
+
+    def _write_now(self, func, *args):
+        """Run func(*args) against the writer connection and commit it"""
+        self.load()
+        try:
+            result = func(*args)
+            self.writer.commit()
+        except Exception:
+            self.writer.rollback()
+            raise
+        return result
+
+    async def _write(self, func, *args):
+        return await storage_io.run(self._write_now, func, *args)
+
+    def flush(self):
+        """Nothing is buffered: every write is committed before it returns"""
+
+    def close(self):
+        for conn in (self.conn, self.writer):
+            if conn is not None:
+                conn.close()
+        self.conn = self.writer = None
+
+    def _checkpoint(self):
+        # PASSIVE never waits for the loop's readers; the WAL is then reused from the
+        # start and journal_size_limit truncates it
+        self.writer.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    async def flush_async(self, compact=False):
+        if self.conn is None or not compact:
+            return
+        async with self._io_lock:
+            # Fold the WAL back into the database file
+            await storage_io.run(self._checkpoint)
+
+    # Users
+    async def get_user(self, user_id):
+        row = self._query_one(
+            'SELECT authenticated, join_date FROM users WHERE user_id = ?', (str(user_id),)
+        )
+        if row is None:
+            return None
+        return {'authenticated': bool(row['authenticated']), 'join_date': row['join_date']}
+
+    def _set_user(self, user_id, record):
+        self.writer.execute(
+            'INSERT OR REPLACE INTO users (user_id, authenticated, join_date) VALUES (?, ?, ?)',
+            (str(user_id), int(bool(record.get('authenticated'))), record.get('join_date'))
+        )
+
+    async def set_user(self, user_id, record):
+        await self._write(self._set_user, user_id, record)
+
+    # Levels
+    def _get_level(self, guild_id, user_id, conn=None):
+        row = self._query_one(
+            'SELECT level, xp, total_xp FROM user_levels WHERE guild_id = ? AND user_id = ?',
+            (str(guild_id), str(user_id)), conn
+        )
+        return dict(row) if row else None
+
+    async def get_level(self, guild_id, user_id):
+        return self._get_level(guild_id, user_id)
+
+    async def add_xp(self, guild_id, user_id, amount):
+        _, _, old, new = (await self.add_xp_many({(guild_id, user_id): amount}))[0]
+        return old, new
+
+    def _recompute_levels(self, guild_id):
+        lookup = level_table_for(guild_id).lookup
+        rows = []
+        for row in self._query('SELECT user_id, total_xp FROM user_levels WHERE guild_id = ?', (str(guild_id),), self.writer):
+            level, xp, _ = lookup(row['total_xp'])
+            rows.append((level, xp, str(guild_id), row['user_id']))
+        self.writer.executemany('UPDATE user_levels SET level = ?, xp = ? WHERE guild_id = ? AND user_id = ?', rows)
+        return len(rows)
+
+    async def recompute_levels(self, guild_id):
+        return await self._write(self._recompute_levels, guild_id)
+
+    async def all_levels(self, guild_id):
+        rows = self._query('SELECT user_id, total_xp FROM user_levels WHERE guild_id = ?', (str(guild_id),))
+        return [(row['user_id'], row['total_xp']) for row in rows]
+
+    def _add_xp_many(self, grants, lookups):
+        amounts = {(str(guild_id), str(user_id)): amount for (guild_id, user_id), amount in grants.items()}
+        items = list(amounts.items())
+        results = []
+        for start in range(0, len(items), SQLITE_XP_BATCH):
+            batch = items[start:start + SQLITE_XP_BATCH]
+            # Add to total_xp in place; RETURNING hands back the new total beside the
+            # level and xp still stored from before, so no row is read separately
+            rows = self.writer.execute(
+                'INSERT INTO user_levels (guild_id, user_id, level, xp, total_xp) VALUES '
+                + ', '.join(['(?, ?, 1, 0, ?)'] * len(batch))
+                + ' ON CONFLICT (guild_id, user_id) DO UPDATE SET total_xp = total_xp + excluded.total_xp'
+                ' RETURNING guild_id, user_id, level, xp, total_xp',
+                [value for (guild_id, user_id), amount in batch for value in (guild_id, user_id, amount)]
+            ).fetchall()
+            for row in rows:
+                key = (row['guild_id'], row['user_id'])
+                level, xp, _ = lookups[key[0]](row['total_xp'])
+                old = {'level': row['level'], 'xp': row['xp'], 'total_xp': row['total_xp'] - amounts[key]}
+                results.append(key + (old, {'level': level, 'xp': xp, 'total_xp': row['total_xp']}))
+        self.writer.executemany(
+            'UPDATE user_levels SET level = ?, xp = ? WHERE guild_id = ? AND user_id = ?',
+            [(new['level'], new['xp'], guild_id, user_id) for guild_id, user_id, _, new in results]
+        )
+        return results
+
+    @staticmethod
+    def _level_lookups(grants):
+        # Built on the loop, which owns the config registry
+        return {str(guild_id): level_table_for(guild_id).lookup for guild_id, _ in grants}
+
+    async def add_xp_many(self, grants):
+        """Apply {(guild_id, user_id): amount} with one upsert per batch; return [(guild_id, user_id, old, new)]"""
+        return await self._write(self._add_xp_many, grants, self._level_lookups(grants))
+
+    def add_xp_many_blocking(self, grants):
+        """add_xp_many() for shutdown, when no event loop is left"""
+        return self._write_now(self._add_xp_many, grants, self._level_lookups(grants))
+
+    async def top_levels(self, guild_id, limit, offset=0):
+        rows = self._query(
+            'SELECT user_id, level, xp, total_xp FROM user_levels WHERE guild_id = ? '
+            'ORDER BY total_xp DESC LIMIT ? OFFSET ?',
+            (str(guild_id), limit, offset)
+        )
+        return [(row['user_id'], {'level': row['level'], 'xp': row['xp'], 'total_xp': row['total_xp']}) for row in rows]
+
+    # Tickets
+    def _ticket_from_row(self, row):
+        ticket = {field: row[field] for field in self.TICKET_FIELDS if row[field] is not None}
+        ticket['guild_id'] = row['guild_id']
+        return ticket
+
+    def _get_ticket(self, guild_id, ticket_id, conn=None):
+        row = self._query_one(
+            'SELECT * FROM tickets WHERE guild_id = ? AND ticket_id = ?', (str(guild_id), int(ticket_id)), conn
+        )
+        return self._ticket_from_row(row) if row else None
+
+    async def get_ticket(self, guild_id, ticket_id):
+        return self._get_ticket(guild_id, ticket_id)
+
+    async def next_ticket_id(self, guild_id):
+        row = self._query_one(
+            'SELECT MAX(ticket_id) FROM tickets WHERE guild_id = ?', (str(guild_id),)
+        )
+        return (row[0] or 0) + 1
+
+    def _set_ticket(self, guild_id, ticket_id, record):
+        self.writer.execute(
+            'INSERT OR REPLACE INTO tickets (guild_id, ticket_id, user_id, channel_id, created_at, '
+            'description, status, closed_at, closed_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(guild_id), int(ticket_id)) + tuple(record.get(field) for field in self.TICKET_FIELDS)
+        )
+
+    async def set_ticket(self, guild_id, ticket_id, record):
+        await self._write(self._set_ticket, guild_id, ticket_id, record)
+
+    def _update_ticket(self, guild_id, ticket_id, fields):
+        ticket = self._get_ticket(guild_id, ticket_id, self.writer)
+        if ticket is None:
+            return None
+        ticket.update(fields)
+        self._set_ticket(guild_id, ticket_id, ticket)
+        return ticket
+
+    async def update_ticket(self, guild_id, ticket_id, fields):
+        return await self._write(self._update_ticket, guild_id, ticket_id, fields)
+
+    async def list_tickets(self, guild_id, status=None):
+        if status is None:
+            rows = self._query(
+                'SELECT * FROM tickets WHERE guild_id = ? ORDER BY ticket_id', (str(guild_id),)
+            )
+        else:
+            rows = self._query(
+                'SELECT * FROM tickets WHERE guild_id = ? AND status = ? ORDER BY ticket_id', (str(guild_id), status)
+            )
+        return [(str(row['ticket_id']), self._ticket_from_row(row)) for row in rows]
+
+    # Polls
+    def _get_poll(self, guild_id, poll_id, conn=None):
+        row = self._query_one(
+            'SELECT * FROM polls WHERE poll_id = ? AND guild_id = ?', (str(poll_id), str(guild_id)), conn
+        )
+        if row is None:
+            return None
+        options = json.loads(row['options'])
+        votes = [0] * len(options)
+        voters = {}
+        for vote in self._query('SELECT user_id, option_index FROM poll_votes WHERE poll_id = ?', (str(poll_id),), conn):
+            voters[vote['user_id']] = vote['option_index']
+            votes[vote['option_index']] += 1
+        return {
+            'question': row['question'],
+            'options': options,
+            'votes': votes,
+            'voters': voters,
+            'creator': row['creator'],
+            'channel_id': int(row['channel_id']) if row['channel_id'] else None,
+            'guild_id': int(row['guild_id'])
+        }
+
+    async def get_poll(self, guild_id, poll_id):
+        return self._get_poll(guild_id, poll_id)
+
+    def _set_poll(self, guild_id, poll_id, record):
+        self.writer.execute(
+            'INSERT OR REPLACE INTO polls (poll_id, guild_id, channel_id, question, options, creator) VALUES (?, ?, ?, ?, ?, ?)',
+            (str(poll_id), str(guild_id), str(record.get('channel_id') or ''), record['question'],
+             json.dumps(record['options'], ensure_ascii=False), record.get('creator'))
+        )
+        self.writer.execute('DELETE FROM poll_votes WHERE poll_id = ?', (str(poll_id),))
+        self.writer.executemany(
+            'INSERT INTO poll_votes (poll_id, user_id, option_index) VALUES (?, ?, ?)',
+            [(str(poll_id), str(user_id), option) for user_id, option in record.get('voters', {}).items()]
+        )
+
+    async def set_poll(self, guild_id, poll_id, record):
+        await self._write(self._set_poll, guild_id, poll_id, record)
+
+    def _record_vote(self, guild_id, poll_id, user_id, option_index):
+        if self._get_poll(guild_id, poll_id, self.writer) is None:
+            return None
+        self.writer.execute(
+            'INSERT OR REPLACE INTO poll_votes (poll_id, user_id, option_index) VALUES (?, ?, ?)',
+            (str(poll_id), str(user_id), option_index)
+        )
+        return self._get_poll(guild_id, poll_id, self.writer)
+
+    async def record_vote(self, guild_id, poll_id, user_id, option_index):
+        return await self._write(self._record_vote, guild_id, poll_id, user_id, option_index)
+
+    # Warnings
+    def _get_warnings(self, guild_id, user_id, conn=None):
+        rows = self._query(
+            'SELECT reason, moderator_id, timestamp FROM warnings WHERE guild_id = ? AND user_id = ? ORDER BY id',
+            (str(guild_id), str(user_id)), conn
+        )
+        if not rows:
+            return None
+        return {'count': len(rows), 'history': [dict(row) for row in rows]}
+
+    async def get_warnings(self, guild_id, user_id):
+        return self._get_warnings(guild_id, user_id)
+
+    def _add_warning(self, guild_id, user_id, entry):
+        self.writer.execute(
+            'INSERT INTO warnings (guild_id, user_id, reason, moderator_id, timestamp) VALUES (?, ?, ?, ?, ?)',
+            (str(guild_id), str(user_id), entry['reason'], entry['moderator_id'], entry['timestamp'])
+        )
+        return self._get_warnings(guild_id, user_id, self.writer)
+
+    async def add_warning(self, guild_id, user_id, entry):
+        return await self._write(self._add_warning, guild_id, user_id, entry)
+
+def migrate_json_to_sqlite(json_store, store):
+    """Copy the JSON data files into an empty SQLite store"""
+    for user_id, record in json_store.users.data['users'].items():
+        store._set_user(user_id, record)
+    for guild_id in json_store.guild_ids():
+        shard = json_store.guild_blocking(guild_id)
+        store.writer.executemany(
+            'INSERT OR REPLACE INTO user_levels (guild_id, user_id, level, xp, total_xp) VALUES (?, ?, ?, ?, ?)',
+            [(guild_id, user_id, r['level'], r['xp'], r['total_xp']) for user_id, r in shard.data['user_levels'].items()]
+        )
+        for ticket_id, ticket in shard.data['tickets'].items():
+            store._set_ticket(guild_id, ticket_id, ticket)
+        for poll_id, poll in shard.data['polls'].items():
+            store._set_poll(guild_id, poll_id, poll)
+        for user_id, record in shard.data['warnings'].items():
+            for entry in record['history']:
+                store._add_warning(guild_id, user_id, entry)
+        # Nothing changed, so the shard can go straight away
+        del json_store.guilds[guild_id]
+    store.writer.commit()
+    print(f"Migrated {DATA_DIR}/ into {store.path}")
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+
+data_store = SQLiteStore(DB_FILE) if STORAGE_BACKEND == 'sqlite' else DataStore()
+atexit.register(data_store.flush)
+
+CONFIG_FILE = 'config.json'
+LEGACY_CONFIG_FILES = {
+    'meigen': 'meigen_config.json',
+    'server_log': 'server_log_config.json',
+    'channel': 'channel_config.json',
+}
+
+class MeigenConfig(namedtuple('MeigenConfig', 'channel_id interval')):
+    """Quote channel of a guild; interval is None for the random once-a-day mode"""
+
+    @classmethod
+    def from_json(cls, value):
+        if isinstance(value, dict):
+            return cls(value['channel_id'], value.get('interval'))
+        return cls(value, None)  # old format: bare channel ID
+
+    def to_json(self):
+        return self._asdict()
+
+class ServerLogConfig(namedtuple('ServerLogConfig', 'target_server channel_id')):
+    """Log forwarding of a guild; channel_id is None to forward every channel"""
+
+    @classmethod
+    def from_json(cls, value):
+        if isinstance(value, dict):
+            return cls(value['target_server'], value.get('channel_id'))
+        return cls(value, None)  # old format: bare target server ID
+
+    def to_json(self):
+        return self._asdict()
+
+class ChannelConfig(dict):
+    """Free-form channel settings; replace the entry instead of editing it"""
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(value)
+
+    def to_json(self):
+        return dict(self)
+
+class BotAllowlist(frozenset):
+    """IDs (as strings) of bots the bot-spam detector ignores"""
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(str(bot_id) for bot_id in value)
+
+    def to_json(self):
+        return sorted(self)
+
+class AntiSpamPolicy(namedtuple('AntiSpamPolicy', 'repeat_window repeat_count timeout_minutes bot_window bot_count bot_ban raid_users')):
+    """Per-guild anti-spam thresholds, validated once when stored
+
+    timeout_minutes 0 only deletes repeated messages, bot_ban False only
+    deletes bot spam and raid_users 0 turns raid detection off.
+    """
+
+    @classmethod
+    def from_json(cls, value):
+        policy = DEFAULT_ANTISPAM_POLICY._replace(**{field: value[field] for field in cls._fields if field in value})
+        invalid = policy.invalid_fields()
+        if invalid:
+            raise ValueError(f"Invalid anti-spam policy fields: {', '.join(invalid)}")
+        return policy
+
+    def invalid_fields(self):
+        invalid = [
+            field for field, (low, high) in ANTISPAM_LIMITS.items()
+            if type(getattr(self, field)) is not int or not low <= getattr(self, field) <= high
+        ]
+        if self.raid_users == 1:
+            invalid.append('raid_users')
+        if type(self.bot_ban) is not bool:
+            invalid.append('bot_ban')
+        return invalid
+
+    def to_json(self):
+        return self._asdict()
+
+DEFAULT_ANTISPAM_POLICY = AntiSpamPolicy(
+    repeat_window=30, repeat_count=3, timeout_minutes=60, bot_window=10, bot_count=5, bot_ban=True, raid_users=8
+)
+ANTISPAM_LIMITS = {  # field: (lowest, highest) accepted value
+    'repeat_window': (5, 600),
+    'repeat_count': (2, SPAM_HISTORY_SIZE),
+    'timeout_minutes': (0, 40320),  # Discord caps timeouts at 28 days
+    'bot_window': (1, BOT_SPAM_MAX_WINDOW_SECONDS),
+    'bot_count': (2, BOT_SPAM_MAX_THRESHOLD),
+    'raid_users': (0, 50),
+}
+
+class AutoModConfig(namedtuple('AutoModConfig', 'invites domains max_mentions max_emoji caps_percent zalgo timeout_minutes')):
+    """Per-guild message rules, validated once when stored; 0 / empty turns a rule off"""
+
+    @classmethod
+    def from_json(cls, value):
+        fields = {field: value[field] for field in cls._fields if field in value}
+        if isinstance(fields.get('domains'), list):
+            fields['domains'] = tuple(fields['domains'])
+        config = DEFAULT_AUTOMOD._replace(**fields)
+        invalid = config.invalid_fields()
+        if invalid:
+            raise ValueError(f"Invalid automod fields: {', '.join(invalid)}")
+        return config
+
+    def invalid_fields(self):
+        invalid = [
+            field for field, (low, high) in AUTOMOD_LIMITS.items()
+            if type(getattr(self, field)) is not int or not low <= getattr(self, field) <= high
+        ]
+        invalid += [field for field in ('invites', 'zalgo') if type(getattr(self, field)) is not bool]
+        if (type(self.domains) is not tuple or len(self.domains) > AUTOMOD_MAX_DOMAINS
+                or not all(type(domain) is str and AUTOMOD_DOMAIN.fullmatch(domain) for domain in self.domains)):
+            invalid.append('domains')
+        return invalid
+
+    def to_json(self):
+        return dict(self._asdict(), domains=list(self.domains))
+
+DEFAULT_AUTOMOD = AutoModConfig(
+    invites=True, domains=(), max_mentions=5, max_emoji=15, caps_percent=70, zalgo=True, timeout_minutes=10
+)
+AUTOMOD_LIMITS = {  # field: (lowest, highest) accepted value
+    'max_mentions': (0, 100),
+    'max_emoji': (0, 200),
+    'caps_percent': (0, 100),
+    'timeout_minutes': (0, 40320),  # Discord caps timeouts at 28 days
+}
+AUTOMOD_MAX_DOMAINS = 100  # blocked domains per guild
+AUTOMOD_DOMAIN = re.compile(r'(?:[a-z0-9-]+\.)+[a-z0-9-]+')  # a lower-case host name without scheme or path
+AUTOMOD_CAPS_MIN_LETTERS = 12  # shorter messages are never caps spam
+
+class AutoModRules:
+    """An AutoModConfig compiled into one regex with a named group per rule
+
+    A single finditer pass over the message counts every rule at once, so
+    adding domains or rules does not add passes over the text.
+    """
+
+    PATTERNS = {
+        'invite': r'(?i:discord(?:app)?\.com/invite|discord\.gg)/[\w-]+',
+        'mention': r'<@[!&]?\d+>|@everyone|@here',
+        'emoji': r'<a?:\w+:\d+>|[\U0001F300-\U0001FAFF\u2600-\u27BF]',
+        'zalgo': r'[\u0300-\u036f\u0489]{3,}',
+    }
+
+    def __init__(self, config):
+        self.config = config
+        # Specific rules come first so they win over the letter runs at the same position
+        groups = []
+        if config.invites:
+            groups.append(('invite', self.PATTERNS['invite']))
+        if config.domains:
+            domains = '|'.join(re.escape(domain) for domain in sorted(config.domains, key=len, reverse=True))
+            # With or without a scheme, but only a whole host: "notexample.com" is not "example.com"
+            groups.append(('domain', rf'(?<![\w.-])(?i:(?:https?://)?(?:[\w-]+\.)*(?:{domains}))(?![\w.-])'))
+        if config.max_mentions:
+            groups.append(('mention', self.PATTERNS['mention']))
+        if config.max_emoji:
+            groups.append(('emoji', self.PATTERNS['emoji']))
+        if config.zalgo:
+            groups.append(('zalgo', self.PATTERNS['zalgo']))
+        if config.caps_percent:
+            # A letter run stops where an invite starts, so "joindiscord.gg/x" still counts as one
+            stop = f'(?!{self.PATTERNS["invite"]})' if config.invites else ''
+            groups += [('upper', f'(?:{stop}[A-Z])+'), ('lower', f'(?:{stop}[a-z])+')]
+        self.regex = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in groups)) if groups else None
+
+    def check(self, content):
+        """Return the Japanese description of the first rule the content breaks, or None"""
+        if self.regex is None:
+            return None
+        counts = dict.fromkeys(('invite', 'domain', 'mention', 'emoji', 'zalgo', 'upper', 'lower'), 0)
+        for match in self.regex.finditer(content):
+            name = match.lastgroup
+            counts[name] += len(match.group()) if name in ('upper', 'lower') else 1
+        config = self.config
+        if counts['invite']:
+            return '招待リンクの投稿'
+        if counts['domain']:
+            return 'ブロックされたドメインへのリンク'
+        if config.max_mentions and counts['mention'] > config.max_mentions:
+            return f'大量メンション（{counts["mention"]}件）'
+        if config.max_emoji and counts['emoji'] > config.max_emoji:
+            return f'絵文字の連投（{counts["emoji"]}個）'
+        if counts['zalgo']:
+            return '崩し文字（Zalgo）'
+        letters = counts['upper'] + counts['lower']
+        if config.caps_percent and letters >= AUTOMOD_CAPS_MIN_LETTERS and counts['upper'] * 100 > letters * config.caps_percent:
+            return '大文字の多用'
+        return None
+
+_automod_rules = {}  # {guild_id: AutoModRules}
+
+def automod_rules_for(guild_id):
+    """Return the guild's compiled rules, or None when automod is off"""
+    config = config_registry.get('automod', guild_id)
+    if config is None:
+        return None
+    rules = _automod_rules.get(guild_id)
+    if rules is None or rules.config is not config:
+        rules = _automod_rules[guild_id] = AutoModRules(config)
+    return rules
+
+async def handle_automod(message, violation, config):
+    """Delete a rule-breaking message and time its author out"""
+    reason = f"自動モデレーション: {violation}"
+    try:
+        deletes = action_scheduler.delete_messages(message.channel, [message.id], reason=reason)
+        if config.timeout_minutes:
+            until = discord.utils.utcnow() + timedelta(minutes=config.timeout_minutes)
+            await action_scheduler.run('timeout', message.guild.id, message.author.timeout, until, reason=reason)
+        await asyncio.gather(*deletes)
+        action = f'{config.timeout_minutes}分のタイムアウトが適用されました。' if config.timeout_minutes else 'メッセージを削除しました。'
+        embed = discord.Embed(
+            title="🚫 自動モデレーション",
+            description=f"{message.author.mention} のメッセージは「{violation}」のため削除され、{action}",
+            color=0xff0000
+        )
+        action_scheduler.submit('send', message.channel.id, message.channel.send, embed=embed, delete_after=15)
+    except discord.Forbidden as e:
+        print(f"Failed to moderate {message.author.name} - insufficient permissions: {e}")
+    except discord.HTTPException as e:
+        print(f"Error in automod: {e}")
+
+class ConfigRegistry(WriteBackStore):
+    """Per-guild bot settings of every kind, persisted together in one file
+
+    Entries are immutable (namedtuples are replaced, never edited), so the
+    writer thread can serialize them while handlers keep running. Changes
+    only mark the registry dirty; the debounced writer turns a burst of
+    them into one atomic rewrite of config.json.
+    """
+
+    KINDS = {
+        'meigen': MeigenConfig,
+        'server_log': ServerLogConfig,
+        'channel': ChannelConfig,
+        'xp_curve': XPCurve,
+        'automod': AutoModConfig,
+        'bot_allowlist': BotAllowlist,
+        'antispam': AntiSpamPolicy,
+    }
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.entries = {kind: {} for kind in self.KINDS}
+        self.log_sources = {}  # {target guild ID: {source guild IDs}}
+
+    def _load_file(self):
+        data = read_json_file(self.path, None)
+        if data is None:
+            # First start with the registry: pick up the old per-feature files
+            data = {kind: read_json_file(path, {}) for kind, path in LEGACY_CONFIG_FILES.items()}
+            if any(data.values()):
+                write_json_file(self.path, data)
+                for path in LEGACY_CONFIG_FILES.values():
+                    if os.path.exists(path):
+                        os.replace(path, path + '.migrated')
+        return data
+
+    async def load(self):
+        try:
+            data = await storage_io.run(self._load_file)
+        except Exception as e:
+            print(f"Error loading config: {e}")
+            return
+        for kind, entry_type in self.KINDS.items():
+            for guild_id, value in data.get(kind, {}).items():
+                try:
+                    self._store(kind, guild_id, entry_type.from_json(value))
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"Skipping broken {kind} config for guild {guild_id}: {e}")
+
+    def _store(self, kind, guild_id, entry):
+        old = self.entries[kind].get(guild_id)
+        if kind == 'server_log' and old is not None:
+            self.log_sources.get(old.target_server, set()).discard(guild_id)
+        if entry is None:
+            self.entries[kind].pop(guild_id, None)
+        else:
+            self.entries[kind][guild_id] = entry
+            if kind == 'server_log':
+                self.log_sources.setdefault(entry.target_server, set()).add(guild_id)
+
+    def get(self, kind, guild_id):
+        return self.entries[kind].get(str(guild_id))
+
+    def items(self, kind):
+        return list(self.entries[kind].items())
+
+    def set(self, kind, guild_id, entry):
+        self._store(kind, str(guild_id), entry)
+        self.mark_dirty(kind)
+
+    def remove(self, kind, guild_id):
+        if str(guild_id) in self.entries[kind]:
+            self.set(kind, guild_id, None)
+
+    def log_sources_for(self, target_guild_id):
+        """Source guild IDs forwarding their messages to target_guild_id"""
+        return sorted(self.log_sources.get(str(target_guild_id), ()))
+
+    @staticmethod
+    def _serialize(entries):
+        return {kind: {guild_id: entry.to_json() for guild_id, entry in values.items()}
+                for kind, values in entries.items()}
+
+    def flush(self):
+        if self.dirty:
+            self.dirty.clear()
+            write_json_file(self.path, self._serialize(self.entries))
+
+    async def flush_async(self):
+        async with self._io_lock:
+            if not self.dirty:
+                return
+            dirty = set(self.dirty)
+            self.dirty.clear()
+            # Copy the entry maps on the loop; the entries themselves are immutable
+            entries = {kind: dict(values) for kind, values in self.entries.items()}
+            try:
+                await storage_io.run(lambda: write_json_file(self.path, self._serialize(entries)))
+            except Exception:
+                self.dirty |= dirty
+                raise
+
+config_registry = ConfigRegistry(CONFIG_FILE)
+atexit.register(config_registry.flush)
+
+JOBS_FILE = 'jobs.json'
+JOB_WORKERS = 2  # jobs running at once across all guilds
+JOB_GUILD_LIMIT = 1  # jobs running at once per guild; later ones wait in the queue
+JOB_HISTORY = 50  # finished jobs kept for /jobs list
+JOB_STATUS_LABELS = {
+    'queued': '⏳ 待機中',
+    'running': '🔄 実行中',
+    'paused': '⏸️ 一時停止中',
+    'done': '✅ 完了',
+    'cancelled': '🛑 キャンセル',
+    'failed': '❌ 失敗',
+    'interrupted': '⚠️ 中断（再起動）',
+}
+JOB_ACTIVE_STATUSES = ('queued', 'running', 'paused')
+
+class Job:
+    """A long-running admin task; everything but the runtime handles is persisted"""
+
+    def __init__(self, job_id, kind, guild_id, params, status='queued', progress=None, created_at=None,
+                 finished_at=None, error=None):
+        self.id = job_id
+        self.kind = kind
+        self.guild_id = guild_id
+        self.params = params
+        self.status = status
+        self.progress = progress or {}
+        self.created_at = created_at or datetime.now().isoformat()
+        self.finished_at = finished_at
+        self.error = error
+        self.task = None
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(value['id'], value['kind'], value['guild_id'], value['params'], value['status'], value.get('progress'),
+                   value.get('created_at'), value.get('finished_at'), value.get('error'))
+
+    def to_json(self):
+        return {
+            'id': self.id, 'kind': self.kind, 'guild_id': self.guild_id, 'params': self.params, 'status': self.status,
+            'progress': dict(self.progress), 'created_at': self.created_at, 'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+    def report(self, **progress):
+        """Record progress; it reaches jobs.json with the next debounced write"""
+        self.progress.update(progress)
+        job_manager.mark_dirty('jobs')
+
+    async def checkpoint(self):
+        """Called by job runners between units of work; waits here while paused"""
+        await self.resumed.wait()
+
+class JobManager(WriteBackStore):
+    """Persistent job table drained by a bounded pool of workers
+
+    Jobs wait in the table until a worker is free and their guild is under
+    JOB_GUILD_LIMIT, lowest JOB_TYPES priority first, then oldest first.
+    Their REST calls go through the action scheduler on low-priority
+    routes, so moderation actions are never stuck behind a copy. Jobs
+    still active at shutdown are picked up again on the next start if
+    their type can resume, and marked interrupted otherwise.
+    """
+
+    def __init__(self, path, workers, guild_limit):
+        super().__init__()
+        self.path = path
+        self.workers = workers
+        self.guild_limit = guild_limit
+        self.jobs = {}  # {job ID: Job}, oldest first
+        self.next_id = 1
+        self.running = {}  # {guild ID: running job count}
+        self.tasks = []
+        self._wakeup = None
+
+    async def load(self):
+        try:
+            data = await storage_io.read_json(self.path, {})
+        except Exception as e:
+            print(f"Error loading jobs: {e}")
+            return
+        self.next_id = data.get('next_id', 1)
+        for value in data.get('jobs', []):
+            job = Job.from_json(value)
+            if job.status in JOB_ACTIVE_STATUSES:
+                job_type = JOB_TYPES.get(job.kind)
+                if job_type is None or not job_type.resumable:
+                    job.status = 'interrupted'
+                    job.finished_at = datetime.now().isoformat()
+                elif job.status == 'paused':
+                    job.resumed.clear()
+                else:
+                    job.status = 'queued'
+            self.jobs[job.id] = job
+
+    def start(self):
+        super().start()
+        if not self.tasks:
+            self._wakeup = asyncio.Event()
+            self._wakeup.set()
+            self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def submit(self, kind, guild_id, params):
+        job = Job(self.next_id, kind, guild_id, params)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        self._prune()
+        self.mark_dirty('jobs')
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def get(self, guild_id, job_id):
+        job = self.jobs.get(job_id)
+        return job if job is not None and job.guild_id == guild_id else None
+
+    def for_guild(self, guild_id):
+        return [job for job in self.jobs.values() if job.guild_id == guild_id]
+
+    def queue_position(self, job):
+        waiting = sorted(self._waiting(), key=self._order)
+        return waiting.index(job) + 1 if job in waiting else None
+
+    def cancel(self, job):
+        if job.status == 'queued' or (job.status == 'paused' and job.task is None):
+            self._finish(job, 'cancelled')
+        elif job.task is not None:
+            job.resumed.set()  # A paused job has to wake up to be cancelled
+            job.task.cancel()
+
+    def pause(self, job):
+        job.resumed.clear()
+        job.status = 'paused'
+        self.mark_dirty('jobs')
+
+    def resume(self, job):
+        job.status = 'running' if job.task is not None else 'queued'
+        job.resumed.set()
+        self.mark_dirty('jobs')
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _waiting(self):
+        return [job for job in self.jobs.values() if job.status == 'queued']
+
+    @staticmethod
+    def _order(job):
+        return (JOB_TYPES[job.kind].priority, job.id)
+
+    def _next_runnable(self):
+        for job in sorted(self._waiting(), key=self._order):
+            if self.running.get(job.guild_id, 0) < self.guild_limit:
+                return job
+        return None
+
+    async def _work(self):
+        while True:
+            job = self._next_runnable()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._run(job)
+            # A finished job may unblock its guild's next one for another worker
+            self._wakeup.set()
+
+    async def _run(self, job):
+        job.status = 'running'
+        self.running[job.guild_id] = self.running.get(job.guild_id, 0) + 1
+        self.mark_dirty('jobs')
+        job.task = asyncio.create_task(JOB_TYPES[job.kind].run(job))
+        try:
+            await asyncio.wait([job.task])
+        finally:
+            self.running[job.guild_id] -= 1
+        if job.task.cancelled():
+            self._finish(job, 'cancelled')
+        elif job.task.exception() is not None:
+            print(f"Job {job.id} ({job.kind}) failed: {job.task.exception()}")
+            self._finish(job, 'failed', str(job.task.exception()))
+        else:
+            self._finish(job, 'done')
+        job.task = None
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.now().isoformat()
+        job.resumed.set()
+        self._prune()
+        self.mark_dirty('jobs')
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in JOB_ACTIVE_STATUSES]
+        for job_id in finished[:-JOB_HISTORY]:
+            del self.jobs[job_id]
+
+    def _serialize(self):
+        return {'next_id': self.next_id, 'jobs': [job.to_json() for job in self.jobs.values()]}
+
+    def flush(self):
+        if self.dirty:
+            self.dirty.clear()
+            write_json_file(self.path, self._serialize())
+
+    async def flush_async(self):
+        async with self._io_lock:
+            if not self.dirty:
+                return
+            dirty = set(self.dirty)
+            self.dirty.clear()
+            # Job params and progress hold nested cursors that runners keep updating on the loop,
+            # so encode them here and hand the thread nothing but bytes
+            raw = encode_json(self._serialize())
+            try:
+                await storage_io.run(write_file_atomic, self.path, raw)
+            except Exception:
+                self.dirty |= dirty
+                raise
+
+job_manager = JobManager(JOBS_FILE, JOB_WORKERS, JOB_GUILD_LIMIT)
+atexit.register(job_manager.flush)
 
 def is_allowed_server(guild_id):
     return guild_id in ALLOWED_SERVERS
 
+@bot.event
+async def setup_hook():
+    # Runs once before connecting to the gateway, so no event sees half-loaded state
+    # Config first: replaying the data journals computes levels on each guild's XP curve
+    await config_registry.load()
+    config_registry.start()
+    await storage_io.run(data_store.load)
+    data_store.start()
+    xp_accumulator.start()
+    voice_sessions.start()
+    message_pipeline.start()
+    action_scheduler.start()
+    await job_manager.load()
+    job_manager.start()
+
 @bot.event
 async def on_ready():
     print(f'{bot.user} has connected to Discord!')
@@ -64,20 +2364,16 @@ async def on_ready():
     activity = discord.Game(name=f"{server_count}サーバをプレイ中...")
     await bot.change_presence(status=discord.Status.online, activity=activity)
 
-    load_translation_config()
-    load_server_log_config()
-    load_meigen_config()
-    
-    for guild_id, config in meigen_channels.items():
+    for guild_id, config in config_registry.items('meigen'):
         if guild_id not in meigen_tasks:
-            if isinstance(config, dict):
-                channel_id = config["channel_id"]
-                interval = config["interval"]
-                task = asyncio.create_task(send_interval_meigen(guild_id, channel_id, interval))
+            if config.interval:
+                task = asyncio.create_task(send_interval_meigen(guild_id, config.channel_id, config.interval))
             else:
-                channel_id = config
-                task = asyncio.create_task(send_daily_meigen(guild_id, channel_id))
+                task = asyncio.create_task(send_daily_meigen(guild_id, config.channel_id))
             meigen_tasks[guild_id] = task
+
+    # Members already in voice when the bot (re)connects
+    voice_sessions.rebuild([guild for guild in bot.guilds if is_allowed_server(guild.id)], time.monotonic())
     
     try:
         synced = await bot.tree.sync()
@@ -99,6 +2395,116 @@ async def on_guild_remove(guild):
     await bot.change_presence(status=discord.Status.online, activity=activity)
     print(f"Left guild: {guild.name} (ID: {guild.id}). Now in {server_count} servers.")
 
+@bot.event
+async def on_member_join(member):
+    await leaderboards.member_joined(member.guild.id, member.id)
+
+    if not is_allowed_server(member.guild.id) or member.bot:
+        return
+    now = time.time()
+    flagged = join_guard.record(member, now)
+    if flagged is not None:
+        await start_lockdown(member.guild, flagged)
+    elif join_guard.is_locked(member.guild.id) and join_guard.is_new_account(member, now):
+        await act_on_flagged_members(member.guild, [member.id])
+
+@bot.event
+async def on_member_remove(member):
+    leaderboards.member_left(member.guild.id, member.id)
+
+@bot.event
+async def on_voice_state_update(member, before, after):
+    if not is_allowed_server(member.guild.id):
+        return
+    now = time.monotonic()
+    voice_sessions.refresh(member, now)
+    for channel in {before.channel, after.channel}:
+        if channel is not None:
+            voice_sessions.refresh_channel(channel, now)
+
+class PipelineStage:
+    """A side-effect handler for messages, drained in the background
+
+    Messages are spread over `workers` lanes by channel, each a bounded
+    queue with one worker, so a channel's messages are handled in order
+    while different channels proceed concurrently. submit never waits: a
+    full lane drops the message and counts it, so a stalled stage sheds its
+    own load instead of holding up on_message.
+    """
+
+    def __init__(self, name, handler, workers, queue_size):
+        self.name = name
+        self.handler = handler
+        self.lanes = [asyncio.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self.tasks = []
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.peak_depth = 0
+        self.wait_time = 0.0  # seconds processed messages spent queued
+        self.busy_time = 0.0  # seconds spent in the handler
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._work(lane)) for lane in self.lanes]
+
+    def submit(self, message):
+        lane = self.lanes[message.channel.id % len(self.lanes)]
+        try:
+            lane.put_nowait((time.monotonic(), message))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        self.peak_depth = max(self.peak_depth, self.depth())
+        return True
+
+    def depth(self):
+        return sum(lane.qsize() for lane in self.lanes)
+
+    async def _work(self, lane):
+        while True:
+            queued_at, message = await lane.get()
+            started = time.monotonic()
+            self.wait_time += started - queued_at
+            try:
+                await self.handler(message)
+            except Exception as e:
+                self.failed += 1
+                print(f"Error in {self.name} stage: {e}")
+            finally:
+                self.busy_time += time.monotonic() - started
+                self.processed += 1
+                lane.task_done()
+
+    def summary(self):
+        """One-line Japanese status for embeds"""
+        average_wait = self.wait_time / self.processed * 1000 if self.processed else 0
+        return (f"待機 {self.depth()}件（最大 {self.peak_depth}件）/ 処理 {self.processed}件 / "
+                f"破棄 {self.dropped}件 / 失敗 {self.failed}件 / 平均待ち {average_wait:.0f}ms")
+
+class MessagePipeline:
+    """The background stages every allowed message is fanned out to"""
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def submit(self, message):
+        for stage in self.stages:
+            stage.submit(message)
+
+    def dropped(self):
+        return sum(stage.dropped for stage in self.stages)
+
+async def delete_webhook(webhook_id, reason):
+    webhook = await bot.fetch_webhook(webhook_id)
+    await webhook.delete(reason=reason)
+
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
@@ -107,9 +2513,9 @@ async def on_message(message):
     if not is_allowed_server(message.guild.id):
         return
 
-    await on_message_for_copy(message)
-    await on_message_for_server_translation(message)
-    await on_message_for_server_logging(message)
+    # Logging only has side effects elsewhere, so it runs in the
+    # background and never delays moderation of this message
+    message_pipeline.submit(message)
 
     if message.content.startswith('!'):
         await bot.process_commands(message)
@@ -117,91 +2523,87 @@ async def on_message(message):
 
     user_id = message.author.id
     current_time = time.time()
+    policy = config_registry.get('antispam', message.guild.id) or DEFAULT_ANTISPAM_POLICY
+
+    # Our own copy webhooks post in bursts on purpose; any other webhook is checked like a bot
+    # (a webhook message's author ID is the webhook's, so the allowlist covers webhooks too)
+    if (message.author.bot and not copy_webhooks.owns(message.webhook_id)
+            and str(user_id) not in (config_registry.get('bot_allowlist', message.guild.id) or ())):
+        spam_ids = bot_spam_detector.record(
+            (message.guild.id, message.channel.id, user_id), message.id, current_time, policy.bot_window, policy.bot_count
+        )
 
-    if message.author.bot:
-        if user_id not in bot_message_count:
-            bot_message_count[user_id] = 0
-
-        bot_message_count[user_id] += 1
-
-        if bot_message_count[user_id] >= 2:
+        if spam_ids:
             try:
-                await message.delete()
-                await message.guild.ban(message.author, reason="Bot spam detected - 2+ consecutive messages")
-
-                warning_embed = discord.Embed(
-                    title="🚫 Bot Ban",
-                    description=f"Bot {message.author.mention} has been banned for consecutive message spam.",
-                    color=0xff0000
-                )
-                await message.channel.send(embed=warning_embed, delete_after=10)
+                reason = f"Bot spam detected - {policy.bot_count}+ messages in {policy.bot_window}s"
+                await bulk_delete_tracked(message.guild, [(None, None, message.channel.id, message_id) for message_id in spam_ids], reason=reason)
+                if policy.bot_ban:
+                    if message.webhook_id is None:
+                        await action_scheduler.run('ban', message.guild.id, message.guild.ban, message.author, reason=reason)
+                        description = f"Bot {message.author.mention} has been banned for message spam."
+                    else:
+                        # A webhook has no member to ban; deleting it stops the spam instead
+                        await action_scheduler.run('ban', message.guild.id, delete_webhook, message.webhook_id, reason)
+                        description = f"Webhook {message.author.name} has been deleted for message spam."
+                    bot_spam_detector.banned += 1
 
-                if user_id in bot_message_count:
-                    del bot_message_count[user_id]
+                    warning_embed = discord.Embed(
+                        title="🚫 Bot Ban",
+                        description=description,
+                        color=0xff0000
+                    )
+                    action_scheduler.submit('send', message.channel.id, message.channel.send, embed=warning_embed, delete_after=10)
+                else:
+                    print(f"Deleted {len(spam_ids)} spam messages from bot {message.author.name}")
 
             except discord.Forbidden:
                 print(f"Failed to ban bot {message.author.name} - insufficient permissions")
             except Exception as e:
                 print(f"Error banning bot: {e}")
-    else:
-        if user_id in bot_message_count:
-            del bot_message_count[user_id]
 
-    if not message.author.bot:
-        if user_id not in user_message_history:
-            user_message_history[user_id] = []
+    if not message.author.bot and message.content.strip():
+        rules = automod_rules_for(message.guild.id)
+        if rules and not message.author.guild_permissions.manage_messages:
+            violation = rules.check(message.content)
+            if violation:
+                await handle_automod(message, violation, rules.config)
+                return
 
-        user_message_history[user_id].append({
-            'content': message.content,
-            'timestamp': current_time
-        })
+        raid = raid_detector.observe(message, current_time, policy.raid_users) if policy.raid_users else None
+        if raid:
+            await handle_raid(message, raid)
 
-        user_message_history[user_id] = [
-            msg for msg in user_message_history[user_id]
-            if current_time - msg['timestamp'] <= 30
-        ]
+        spam_key = (message.guild.id, user_id)
+        history = spam_tracker.record(spam_key, message, current_time)
 
-        if len(user_message_history[user_id]) >= 3:
-            recent_messages = user_message_history[user_id][-3:]
+        if len(history) >= policy.repeat_count:
+            repeated = spam_tracker.repeated(history, current_time, policy.repeat_count, policy.repeat_window)
             
-            if (len(set(msg['content'] for msg in recent_messages)) == 1 and 
-                recent_messages[0]['content'].strip() != ""):
+            if repeated:
                 
                 try:
                     print(f"Identical message spam detected from {message.author.name} (ID: {user_id})")
                     print(f"Repeated message: {message.content[:50]}...")
 
-                    messages_to_delete = []
-                    async for msg in message.channel.history(limit=10):
-                        if (msg.author.id == user_id and 
-                            msg.content == message.content and
-                            current_time - msg.created_at.timestamp() <= 30):
-                            messages_to_delete.append(msg)
-                            if len(messages_to_delete) >= 3:
-                                break
-                    
-                    for msg in messages_to_delete[:3]:
-                        try:
-                            await msg.delete()
-                        except:
-                            pass
-
-                    print(f"Deleted {min(len(messages_to_delete), 3)} consecutive identical messages")
-
-                    from datetime import timedelta
-                    timeout_duration = discord.utils.utcnow() + timedelta(hours=1)
-                    await message.author.timeout(timeout_duration, reason="同じメッセージの連投によるスパム")
-
-                    print(f"Successfully timed out {message.author.name}")
+                    deleted = await bulk_delete_tracked(message.guild, repeated, reason="同じメッセージの連投によるスパム")
+                    print(f"Deleted {deleted} identical messages")
 
-                    warning_embed = discord.Embed(
-                        title="🚫 タイムアウト適用",
-                        description=f"{message.author.mention} は同じメッセージの連投により1時間のタイムアウトが適用されました。",
-                        color=0xff0000
-                    )
-                    sent_warning = await message.channel.send(embed=warning_embed, delete_after=15)
+                    if policy.timeout_minutes:
+                        timeout_duration = discord.utils.utcnow() + timedelta(minutes=policy.timeout_minutes)
+                        await action_scheduler.run(
+                            'timeout', message.guild.id, message.author.timeout, timeout_duration, reason="同じメッセージの連投によるスパム"
+                        )
+
+                        print(f"Successfully timed out {message.author.name}")
+
+                        warning_embed = discord.Embed(
+                            title="🚫 タイムアウト適用",
+                            description=f"{message.author.mention} は同じメッセージの連投により{policy.timeout_minutes}分のタイムアウトが適用されました。",
+                            color=0xff0000
+                        )
+                        action_scheduler.submit('send', message.channel.id, message.channel.send, embed=warning_embed, delete_after=15)
 
-                    user_message_history[user_id] = []
+                    spam_tracker.forget(spam_key)
 
                 except discord.Forbidden as e:
                     print(f"Failed to moderate {message.author.name} - insufficient permissions: {e}")
@@ -209,10 +2611,18 @@ async def on_message(message):
                     print(f"Error in anti-spam: {e}")
 
     if not message.author.bot and not message.content.startswith('/'):
-        add_experience(message.author.id, message.guild.id, 5)
+        add_experience(message.author.id, message.guild.id, 5, cooldown=True)
 
     await bot.process_commands(message)
 
+async def authenticate_user(user_id):
+    user_data = await data_store.get_user(user_id)
+    if user_data is None:
+        user_data = {'authenticated': True, 'join_date': datetime.now().isoformat()}
+    else:
+        user_data = dict(user_data, authenticated=True)
+    await data_store.set_user(user_id, user_data)
+
 class RoleSelectionView(discord.ui.View):
     def __init__(self, available_roles):
         super().__init__(timeout=300)
@@ -237,6 +2647,10 @@ class RoleSelectionView(discord.ui.View):
 
     async def assign_role(self, interaction, role):
         try:
+            if join_guard.is_locked(interaction.guild.id):
+                await interaction.response.send_message(LOCKDOWN_PANEL_MESSAGE, ephemeral=True)
+                return
+
             if not interaction.user.guild_permissions.administrator:
                 await interaction.response.send_message('❌ ロール取得は管理者のみが利用できます。', ephemeral=True)
                 return
@@ -247,18 +2661,7 @@ class RoleSelectionView(discord.ui.View):
 
             await interaction.user.add_roles(role)
 
-            data = load_data()
-            user_id = str(interaction.user.id)
-
-            if user_id not in data['users']:
-                data['users'][user_id] = {
-                    'authenticated': True,
-                    'join_date': datetime.now().isoformat()
-                }
-            else:
-                data['users'][user_id]['authenticated'] = True
-
-            save_data(data)
+            await authenticate_user(interaction.user.id)
 
             await interaction.response.send_message(f'✅ {role.name} ロールが付与されました！', ephemeral=True)
 
@@ -274,22 +2677,15 @@ class SpecificRoleView(discord.ui.View):
 
     @discord.ui.button(label='ろーるをしゅとく！', style=discord.ButtonStyle.primary)
     async def get_role_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if join_guard.is_locked(interaction.guild.id):
+            await interaction.response.send_message(LOCKDOWN_PANEL_MESSAGE, ephemeral=True)
+            return
+
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message('❌ ロール取得は管理者のみが利用できます。', ephemeral=True)
             return
 
-        data = load_data()
-        user_id = str(interaction.user.id)
-
-        if user_id not in data['users']:
-            data['users'][user_id] = {
-                'authenticated': True,
-                'join_date': datetime.now().isoformat()
-            }
-        else:
-            data['users'][user_id]['authenticated'] = True
-
-        save_data(data)
+        await authenticate_user(interaction.user.id)
 
         try:
             if self.role in interaction.user.roles:
@@ -310,22 +2706,15 @@ class PublicAuthView(discord.ui.View):
 
     @discord.ui.button(label='認証する', style=discord.ButtonStyle.primary)
     async def authenticate_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if join_guard.is_locked(interaction.guild.id):
+            await interaction.response.send_message(LOCKDOWN_PANEL_MESSAGE, ephemeral=True)
+            return
+
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message('❌ 認証は管理者のみが利用できます。', ephemeral=True)
             return
 
-        data = load_data()
-        user_id = str(interaction.user.id)
-
-        if user_id not in data['users']:
-            data['users'][user_id] = {
-                'authenticated': True,
-                'join_date': datetime.now().isoformat()
-            }
-        else:
-            data['users'][user_id]['authenticated'] = True
-
-        save_data(data)
+        await authenticate_user(interaction.user.id)
 
         assignable_roles = []
         for role in interaction.guild.roles:
@@ -422,15 +2811,12 @@ async def view_profile(interaction: discord.Interaction, user: discord.Member =
     if user is None:
         user = interaction.user
 
-    data = load_data()
-    user_id = str(user.id)
+    user_data = await data_store.get_user(user.id)
 
-    if user_id not in data['users']:
+    if user_data is None:
         await interaction.response.send_message('❌ ユーザーが見つかりません。')
         return
 
-    user_data = data['users'][user_id]
-
     embed = discord.Embed(
         title=f'👤 {user.display_name} のプロフィール',
         color=0x00ff00
@@ -513,81 +2899,268 @@ async def view_servers(interaction: discord.Interaction, user: discord.Member =
         await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
         return
 
-    if user is None:
-        user = interaction.user
+    if user is None:
+        user = interaction.user
+
+    mutual_guilds = user.mutual_guilds
+
+    if not mutual_guilds:
+        await interaction.response.send_message(f'❌ {user.display_name} との共通サーバーが見つかりません。')
+        return
+
+    embed = discord.Embed(
+        title=f'🌐 {user.display_name} が参加しているサーバー',
+        description=f'Botと共通のサーバー: {len(mutual_guilds)}個',
+        color=0x0099ff
+    )
+
+    for guild in mutual_guilds:
+        member = guild.get_member(user.id)
+        if member:
+            joined_at = member.joined_at
+            join_date = joined_at.strftime('%Y/%m/%d') if joined_at else '不明'
+
+            member_count = guild.member_count
+
+            roles = [role.name for role in member.roles if role.name != '@everyone']
+            roles_text = ', '.join(roles[:3]) + ('...' if len(roles) > 3 else '') if roles else 'なし'
+
+            embed.add_field(
+                name=f'📋 {guild.name}',
+                value=f'**メンバー数:** {member_count}\n**参加日:** {join_date}\n**ロール:** {roles_text}',
+                inline=True
+            )
+
+    embed.set_footer(text=f'総サーバー数: {len(mutual_guilds)}')
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name='antispam-config', description='荒らし対策設定を表示・変更')
+async def antispam_config(interaction: discord.Interaction, action: str = "show", repeat_window: int = None,
+                          repeat_count: int = None, timeout_minutes: int = None, bot_window: int = None,
+                          bot_count: int = None, bot_ban: bool = None, raid_users: int = None):
+    if not is_allowed_server(interaction.guild.id):
+        await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
+        return
+
+    if not interaction.user.guild_permissions.manage_messages:
+        await interaction.response.send_message('❌ メッセージ管理権限が必要です。', ephemeral=True)
+        return
+
+    guild_id = interaction.guild.id
+    if action == "set":
+        changes = {
+            'repeat_window': repeat_window, 'repeat_count': repeat_count, 'timeout_minutes': timeout_minutes,
+            'bot_window': bot_window, 'bot_count': bot_count, 'bot_ban': bot_ban, 'raid_users': raid_users
+        }
+        changes = {field: value for field, value in changes.items() if value is not None}
+        policy = (config_registry.get('antispam', guild_id) or DEFAULT_ANTISPAM_POLICY)._replace(**changes)
+        invalid = policy.invalid_fields()
+        if invalid:
+            ranges = '\n'.join(
+                f'• {field}: {ANTISPAM_LIMITS[field][0]}〜{ANTISPAM_LIMITS[field][1]}' for field in dict.fromkeys(invalid)
+            )
+            await interaction.response.send_message(f'❌ 範囲外の値があります（raid_usersは0で無効）:\n{ranges}', ephemeral=True)
+            return
+        # The new policy replaces the old one in a single assignment; the next message already uses it
+        config_registry.set('antispam', guild_id, policy)
+    elif action == "default":
+        config_registry.remove('antispam', guild_id)
+    elif action == "reset":
+        spam_tracker.clear()
+        raid_detector.guilds.clear()
+        bot_spam_detector.clear()
+
+        await interaction.response.send_message('✅ 荒らし対策データをリセットしました。', ephemeral=True)
+        return
+    elif action != "show":
+        await interaction.response.send_message('❌ actionは show / set / default / reset のいずれかを指定してください。', ephemeral=True)
+        return
+
+    policy = config_registry.get('antispam', guild_id)
+    embed = discord.Embed(
+        title="🛡️ 荒らし対策設定",
+        description="現在の荒らし対策設定:" if policy else "現在の荒らし対策設定（標準設定）:",
+        color=0x0099ff
+    )
+    policy = policy or DEFAULT_ANTISPAM_POLICY
+    punishment = f"全て削除 + {policy.timeout_minutes}分タイムアウト" if policy.timeout_minutes else "全て削除"
+    embed.add_field(
+        name="同一メッセージ連投検知",
+        value=f"• {policy.repeat_window}秒以内に同じメッセージを{policy.repeat_count}回以上: {punishment}",
+        inline=False
+    )
+    embed.add_field(
+        name="Bot対策",
+        value=f"• 同じチャンネルで{policy.bot_window}秒以内に{policy.bot_count}件以上のメッセージで{'削除 + Ban（Webhookは削除）' if policy.bot_ban else '削除'}（`/bot-allowlist` に登録したBot・Webhookは除外）",
+        inline=False
+    )
+    embed.add_field(
+        name="レイド検知",
+        value=(
+            f"• {RAID_WINDOW_SECONDS}秒以内に{policy.raid_users}人以上の新規メンバー（参加{RAID_NEW_MEMBER_HOURS}時間以内または作成{JOIN_MIN_ACCOUNT_AGE_DAYS}日未満のアカウント）が"
+            f"同じ（またはほぼ同じ）メッセージを投稿: 全員{RAID_TIMEOUT_SECONDS // 60}分タイムアウト + 削除"
+            if policy.raid_users else "• 無効"
+        ),
+        inline=False
+    )
+    embed.add_field(
+        name="自動削除",
+        value="• スパムメッセージは自動削除",
+        inline=False
+    )
+
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name='automod', description='リンク・メンション・大文字などの自動モデレーションを設定')
+async def automod_command(interaction: discord.Interaction, action: str = "show", invites: bool = None, domains: str = None,
+                          max_mentions: int = None, max_emoji: int = None, caps_percent: int = None, zalgo: bool = None,
+                          timeout_minutes: int = None):
+    if not is_allowed_server(interaction.guild.id):
+        await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
+        return
+
+    if not interaction.user.guild_permissions.manage_messages:
+        await interaction.response.send_message('❌ メッセージ管理権限が必要です。', ephemeral=True)
+        return
 
-    mutual_guilds = user.mutual_guilds
+    guild_id = interaction.guild.id
+    if action == "set":
+        config = config_registry.get('automod', guild_id) or DEFAULT_AUTOMOD
+        changes = {
+            'invites': invites, 'max_mentions': max_mentions, 'max_emoji': max_emoji,
+            'caps_percent': caps_percent, 'zalgo': zalgo, 'timeout_minutes': timeout_minutes
+        }
+        changes = {field: value for field, value in changes.items() if value is not None}
+        if domains is not None:
+            # "-" clears the list
+            changes['domains'] = tuple(
+                domain.strip().lower() for domain in domains.split(',') if domain.strip() and domain.strip() != '-'
+            )
+        config = config._replace(**changes)
+        invalid = config.invalid_fields()
+        if invalid:
+            problems = [f'• {field}: {AUTOMOD_LIMITS[field][0]}〜{AUTOMOD_LIMITS[field][1]}' for field in invalid if field in AUTOMOD_LIMITS]
+            if 'domains' in invalid:
+                problems.append(f'• domains: example.com の形式で{AUTOMOD_MAX_DOMAINS}個まで（https:// やパスは不要）')
+            await interaction.response.send_message('❌ 無効な値があります:\n' + '\n'.join(problems), ephemeral=True)
+            return
+        config_registry.set('automod', guild_id, config)
+    elif action == "off":
+        config_registry.remove('automod', guild_id)
+        await interaction.response.send_message('✅ 自動モデレーションを無効にしました。', ephemeral=True)
+        return
+    elif action != "show":
+        await interaction.response.send_message('❌ actionは show / set / off のいずれかを指定してください。', ephemeral=True)
+        return
 
-    if not mutual_guilds:
-        await interaction.response.send_message(f'❌ {user.display_name} との共通サーバーが見つかりません。')
+    config = config_registry.get('automod', guild_id)
+    if config is None:
+        await interaction.response.send_message('🔴 自動モデレーションは無効です。`/automod set` で有効にできます。', ephemeral=True)
         return
 
+    def state(value, text):
+        return text if value else '無効'
+
     embed = discord.Embed(
-        title=f'🌐 {user.display_name} が参加しているサーバー',
-        description=f'Botと共通のサーバー: {len(mutual_guilds)}個',
+        title="🛡️ 自動モデレーション設定",
+        description="違反したメッセージは削除され、送信者にタイムアウトが適用されます。（メッセージ管理権限を持つユーザーは対象外）",
         color=0x0099ff
     )
+    embed.add_field(name="招待リンク", value=state(config.invites, '禁止'), inline=True)
+    embed.add_field(name="メンション上限", value=state(config.max_mentions, f'{config.max_mentions}件'), inline=True)
+    embed.add_field(name="絵文字上限", value=state(config.max_emoji, f'{config.max_emoji}個'), inline=True)
+    embed.add_field(name="大文字の割合上限", value=state(config.caps_percent, f'{config.caps_percent}%'), inline=True)
+    embed.add_field(name="崩し文字（Zalgo）", value=state(config.zalgo, '禁止'), inline=True)
+    embed.add_field(name="タイムアウト", value=state(config.timeout_minutes, f'{config.timeout_minutes}分'), inline=True)
+    embed.add_field(name="ブロック中のドメイン", value=', '.join(config.domains) if config.domains else 'なし', inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
-    for guild in mutual_guilds:
-        member = guild.get_member(user.id)
-        if member:
-            joined_at = member.joined_at
-            join_date = joined_at.strftime('%Y/%m/%d') if joined_at else '不明'
-
-            member_count = guild.member_count
-
-            roles = [role.name for role in member.roles if role.name != '@everyone']
-            roles_text = ', '.join(roles[:3]) + ('...' if len(roles) > 3 else '') if roles else 'なし'
+@bot.tree.command(name='lockdown', description='参加数急増時のロックダウン状態を確認・操作')
+async def lockdown_command(interaction: discord.Interaction, action: str = "status"):
+    if not is_allowed_server(interaction.guild.id):
+        await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
+        return
 
-            embed.add_field(
-                name=f'📋 {guild.name}',
-                value=f'**メンバー数:** {member_count}\n**参加日:** {join_date}\n**ロール:** {roles_text}',
-                inline=True
-            )
+    if not interaction.user.guild_permissions.manage_guild:
+        await interaction.response.send_message('❌ サーバー管理権限が必要です。', ephemeral=True)
+        return
 
-    embed.set_footer(text=f'総サーバー数: {len(mutual_guilds)}')
-    await interaction.response.send_message(embed=embed)
+    guild = interaction.guild
+    if action == "start":
+        if join_guard.is_locked(guild.id):
+            await interaction.response.send_message('❌ 既にロックダウン中です。', ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True)
+        await start_lockdown(guild, [])
+        await interaction.followup.send('✅ ロックダウンを開始しました。', ephemeral=True)
+    elif action == "lift":
+        await interaction.response.defer(ephemeral=True)
+        if await lift_lockdown(guild):
+            await interaction.followup.send('✅ ロックダウンを解除しました。', ephemeral=True)
+        else:
+            await interaction.followup.send('❌ ロックダウン中ではありません。', ephemeral=True)
+    elif action == "status":
+        now = time.time()
+        embed = discord.Embed(title="🔒 ロックダウン状態", color=0x0099ff)
+        state = join_guard.lockdowns.get(guild.id)
+        if state:
+            embed.add_field(name="状態", value=f"🔴 ロックダウン中（<t:{int(state[0])}:R>に自動解除）", inline=False)
+        else:
+            embed.add_field(name="状態", value="🟢 通常", inline=False)
+        embed.add_field(name=f"直近{JOIN_WINDOW_SECONDS}秒の参加数", value=f"{join_guard.join_rate(guild.id, now)}人 / しきい値{JOIN_SPIKE_THRESHOLD}人", inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        await interaction.response.send_message('❌ actionは status / start / lift のいずれかを指定してください。', ephemeral=True)
 
-@bot.tree.command(name='antispam-config', description='荒らし対策設定を表示・変更')
-async def antispam_config(interaction: discord.Interaction, action: str = "show"):
+@bot.tree.command(name='bot-allowlist', description='スパム検知の対象外にするBotを管理')
+async def bot_allowlist_command(interaction: discord.Interaction, action: str = "list", bot_user: discord.Member = None,
+                                webhook_id: str = None):
     if not is_allowed_server(interaction.guild.id):
         await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
         return
 
-    if not interaction.user.guild_permissions.manage_messages:
-        await interaction.response.send_message('❌ メッセージ管理権限が必要です。', ephemeral=True)
+    if not interaction.user.guild_permissions.manage_guild:
+        await interaction.response.send_message('❌ サーバー管理権限が必要です。', ephemeral=True)
         return
 
-    if action == "show":
+    guild_id = interaction.guild.id
+    allowlist = config_registry.get('bot_allowlist', guild_id) or BotAllowlist()
+
+    if action in ("add", "remove"):
+        if webhook_id is not None:
+            if not webhook_id.isdigit():
+                await interaction.response.send_message('❌ 無効なWebhook IDです。数字のみを入力してください。', ephemeral=True)
+                return
+            entry, label = webhook_id, f'Webhook (ID: {webhook_id})'
+        elif bot_user is not None and bot_user.bot:
+            entry, label = str(bot_user.id), bot_user.mention
+        else:
+            await interaction.response.send_message('❌ BotまたはWebhook IDを指定してください。', ephemeral=True)
+            return
+        if action == "add":
+            allowlist = BotAllowlist(allowlist | {entry})
+            text = f'✅ {label} を許可リストに追加しました。'
+        else:
+            allowlist = BotAllowlist(allowlist - {entry})
+            text = f'✅ {label} を許可リストから削除しました。'
+        if allowlist:
+            config_registry.set('bot_allowlist', guild_id, allowlist)
+        else:
+            config_registry.remove('bot_allowlist', guild_id)
+        await interaction.response.send_message(text, ephemeral=True)
+    elif action == "list":
+        names = []
+        for bot_id in sorted(allowlist):
+            member = interaction.guild.get_member(int(bot_id))
+            names.append(f'• {member.mention}' if member else f'• ID: {bot_id}')
         embed = discord.Embed(
-            title="🛡️ 荒らし対策設定",
-            description="現在の荒らし対策設定:",
+            title="🤖 Bot許可リスト",
+            description='\n'.join(names) if names else '登録されているBotはありません。',
             color=0x0099ff
         )
-        embed.add_field(
-            name="同一メッセージ連投検知",
-            value="• 30秒以内に同じメッセージを3回以上: 全て削除 + 1時間タイムアウト",
-            inline=False
-        )
-        embed.add_field(
-            name="Bot対策",
-            value="• 2連続以上のメッセージでBan",
-            inline=False
-        )
-        embed.add_field(
-            name="自動削除",
-            value="• スパムメッセージは自動削除",
-            inline=False
-        )
-
         await interaction.response.send_message(embed=embed, ephemeral=True)
-
-    elif action == "reset":
-        global user_message_history, bot_message_count
-        user_message_history.clear()
-        bot_message_count.clear()
-
-        await interaction.response.send_message('✅ 荒らし対策データをリセットしました。', ephemeral=True)
+    else:
+        await interaction.response.send_message('❌ actionは list / add / remove のいずれかを指定してください。', ephemeral=True)
 
 @bot.tree.command(name='spam-status', description='現在のスパム検知状況を表示')
 async def spam_status(interaction: discord.Interaction):
@@ -604,12 +3177,31 @@ async def spam_status(interaction: discord.Interaction):
         color=0x00ff00
     )
 
-    active_users = len([uid for uid, history in user_message_history.items() if history])
-    tracked_bots = len(bot_message_count)
+    spam_tracker.evict_idle(time.time())
+    active_users = len(spam_tracker)
+    tracked_bots = len(bot_spam_detector)
 
     embed.add_field(name="監視中ユーザー", value=f"{active_users}人", inline=True)
     embed.add_field(name="追跡中Bot", value=f"{tracked_bots}個", inline=True)
-    embed.add_field(name="システム状態", value="🟢 稼働中", inline=True)
+    embed.add_field(name="システム状態", value="🟡 処理遅延あり" if message_pipeline.dropped() else "🟢 稼働中", inline=True)
+    embed.add_field(name="レイド検知中のメッセージ", value=f"{raid_detector.tracked_messages()}件", inline=True)
+    allowlist = config_registry.get('bot_allowlist', interaction.guild.id) or ()
+    embed.add_field(
+        name="Bot検知",
+        value=f"確認 {bot_spam_detector.checked}件 / 検知 {bot_spam_detector.flagged}件 / Ban {bot_spam_detector.banned}件 / 許可リスト {len(allowlist)}個",
+        inline=False
+    )
+    embed.add_field(
+        name="トラッカー使用メモリ",
+        value=f"約{spam_tracker.memory_footprint() / 1024:.1f} KB（1人あたり最大{SPAM_HISTORY_SIZE}件・{SPAM_IDLE_SECONDS // 60}分無発言で破棄）",
+        inline=False
+    )
+    embed.add_field(name="管理操作キュー", value=action_scheduler.summary(), inline=False)
+    embed.add_field(
+        name="バックグラウンド処理",
+        value='\n'.join(f"**{stage.name}:** {stage.summary()}" for stage in message_pipeline.stages),
+        inline=False
+    )
 
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
@@ -786,50 +3378,384 @@ async def giveaway(interaction: discord.Interaction, prize: str):
             pass
 
 # Level and Experience System
-def add_experience(user_id, guild_id, amount):
-    """Add experience to user and check for level up"""
-    data = load_data()
-    if 'user_levels' not in data:
-        data['user_levels'] = {}
-    
-    guild_key = str(guild_id)
-    user_key = str(user_id)
-    
-    if guild_key not in data['user_levels']:
-        data['user_levels'][guild_key] = {}
-    
-    if user_key not in data['user_levels'][guild_key]:
-        data['user_levels'][guild_key][user_key] = {'level': 1, 'xp': 0, 'total_xp': 0}
-    
-    user_data = data['user_levels'][guild_key][user_key]
-    user_data['xp'] += amount
-    user_data['total_xp'] += amount
-    
-    # Calculate level (100 XP per level)
-    new_level = (user_data['total_xp'] // 100) + 1
-    
-    if new_level > user_data['level']:
-        user_data['level'] = new_level
-        user_data['xp'] = user_data['total_xp'] % 100
-        save_data(data)
-        return new_level  # Return new level for level up message
-    
-    save_data(data)
-    return None
+class _SkipNode:
+    __slots__ = ('key', 'next', 'width')
 
-def get_user_level_data(user_id, guild_id):
-    """Get user level data"""
-    data = load_data()
-    if 'user_levels' not in data:
-        return {'level': 1, 'xp': 0, 'total_xp': 0}
-    
-    guild_key = str(guild_id)
-    user_key = str(user_id)
-    
-    if guild_key not in data['user_levels'] or user_key not in data['user_levels'][guild_key]:
-        return {'level': 1, 'xp': 0, 'total_xp': 0}
-    
-    return data['user_levels'][guild_key][user_key]
+    def __init__(self, key, height):
+        self.key = key
+        self.next = [None] * height
+        self.width = [1] * height  # positions skipped by each link
+
+class IndexableSkipList:
+    """Sorted keys with O(log n) insert, remove, rank and positional lookup"""
+    MAX_HEIGHT = 24
+
+    def __init__(self):
+        self.head = _SkipNode(None, self.MAX_HEIGHT)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _find(self, key):
+        """Return the last node before key on every level, and the position of each"""
+        chain = [None] * self.MAX_HEIGHT
+        positions = [0] * self.MAX_HEIGHT
+        node, position = self.head, 0
+        for level in reversed(range(self.MAX_HEIGHT)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self._find(key)
+        height = 1
+        while height < self.MAX_HEIGHT and random.random() < 0.5:
+            height += 1
+        node = _SkipNode(key, height)
+        position = positions[0]
+        for level in range(height):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - (position - positions[level])
+            prev.width[level] = position - positions[level] + 1
+        for level in range(height, self.MAX_HEIGHT):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(len(node.next), self.MAX_HEIGHT):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, key):
+        """0-based position of key"""
+        chain, positions = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return positions[0]
+
+    def slice(self, offset, limit):
+        """Return up to limit keys starting at position offset"""
+        if offset >= self.size or limit <= 0:
+            return []
+        node, remaining = self.head, offset + 1
+        for level in reversed(range(self.MAX_HEIGHT)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not None and len(keys) < limit:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class Leaderboard:
+    """One guild's current members ordered by total XP (ties by user ID)"""
+
+    def __init__(self):
+        self.order = IndexableSkipList()
+        self.totals = {}  # {user_id: total_xp}
+
+    def __len__(self):
+        return len(self.totals)
+
+    def update(self, user_id, total_xp):
+        old = self.totals.get(user_id)
+        if old is not None:
+            self.order.remove((-old, user_id))
+        self.totals[user_id] = total_xp
+        self.order.insert((-total_xp, user_id))
+
+    def discard(self, user_id):
+        old = self.totals.pop(user_id, None)
+        if old is not None:
+            self.order.remove((-old, user_id))
+
+    def rank(self, user_id):
+        """1-based rank of the user, or None if they are not on the board"""
+        total_xp = self.totals.get(user_id)
+        if total_xp is None:
+            return None
+        return self.order.index((-total_xp, user_id)) + 1
+
+    def page(self, offset, limit):
+        """Return [(user_id, total_xp)] for ranks offset+1 .. offset+limit"""
+        return [(user_id, -negative_xp) for negative_xp, user_id in self.order.slice(offset, limit)]
+
+class LeaderboardIndex:
+    """Per-guild leaderboards, built from the store on first use and kept current
+
+    Only members still in the guild are on a board: departed users are
+    skipped when it is built and when their buffered XP is applied, and
+    dropped by on_member_remove.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.boards = {}  # {guild_id: Leaderboard}
+
+    async def board(self, guild):
+        """Return the guild's leaderboard, building it on first use"""
+        key = str(guild.id)
+        board = self.boards.get(key)
+        if board is None:
+            board = Leaderboard()
+            for user_id, total_xp in await self.store.all_levels(key):
+                if guild.get_member(int(user_id)) is not None:
+                    board.update(user_id, total_xp)
+            self.boards[key] = board
+        return board
+
+    def update(self, guild_id, user_id, total_xp):
+        board = self.boards.get(str(guild_id))
+        if board is None:
+            return
+        # XP earned just before leaving is applied after on_member_remove
+        guild = bot.get_guild(int(guild_id))
+        if guild is None or guild.get_member(int(user_id)) is None:
+            board.discard(str(user_id))
+        else:
+            board.update(str(user_id), total_xp)
+
+    def member_left(self, guild_id, user_id):
+        board = self.boards.get(str(guild_id))
+        if board is not None:
+            board.discard(str(user_id))
+
+    async def member_joined(self, guild_id, user_id):
+        board = self.boards.get(str(guild_id))
+        record = await self.store.get_level(guild_id, user_id) if board is not None else None
+        if record is not None:
+            board.update(str(user_id), record['total_xp'])
+
+leaderboards = LeaderboardIndex(data_store)
+
+XP_FLUSH_INTERVAL = 10  # seconds between applying buffered XP to the data store
+
+class XPAccumulator:
+    """Buffers XP grants in memory and applies them to the data store in batches
+
+    A chatty channel adds to one counter per member instead of producing a
+    store write per message. Level-ups are worked out when the batch is
+    applied; reads add the still-pending XP so they stay exact.
+    """
+
+    def __init__(self, store, leaderboards):
+        self.store = store
+        self.leaderboards = leaderboards
+        self.pending = {}  # {(guild_id, user_id): xp}
+        self.applying = []  # batches handed to the store that it has not returned yet
+        self._task = None
+
+    def add(self, guild_id, user_id, amount):
+        key = (str(guild_id), str(user_id))
+        self.pending[key] = self.pending.get(key, 0) + amount
+
+    def pending_xp(self, guild_id, user_id):
+        key = (str(guild_id), str(user_id))
+        return self.pending.get(key, 0) + sum(grants.get(key, 0) for grants in self.applying)
+
+    def _applied(self, results):
+        level_ups = []
+        for guild_id, user_id, old, new in results:
+            self.leaderboards.update(guild_id, user_id, new['total_xp'])
+            if new['level'] > old['level']:
+                print(f"User {user_id} reached level {new['level']} in guild {guild_id}")
+                level_ups.append((guild_id, user_id, new['level']))
+        return level_ups
+
+    async def flush_async(self):
+        """Apply buffered XP; return [(guild_id, user_id, new_level)] for members who levelled up"""
+        if not self.pending:
+            return []
+        grants, self.pending = self.pending, {}
+        # Still counted by pending_xp while the store works on it
+        self.applying.append(grants)
+        try:
+            results = await self.store.add_xp_many(grants)
+        except Exception:
+            for key, amount in grants.items():
+                self.pending[key] = self.pending.get(key, 0) + amount
+            raise
+        finally:
+            self.applying.remove(grants)
+        return self._applied(results)
+
+    def flush(self):
+        """flush_async() for shutdown, when no event loop is left"""
+        if not self.pending:
+            return []
+        grants, self.pending = self.pending, {}
+        return self._applied(self.store.add_xp_many_blocking(grants))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(XP_FLUSH_INTERVAL)
+            try:
+                await self.flush_async()
+            except Exception as e:
+                print(f"Error applying XP: {e}")
+
+xp_accumulator = XPAccumulator(data_store, leaderboards)
+atexit.register(xp_accumulator.flush)  # Registered after data_store.flush, so it runs first
+
+XP_COOLDOWN_SECONDS = 60  # a member earns message XP at most once per this many seconds
+
+class CooldownWheel:
+    """Expiring set of keys backed by a hashed timing wheel
+
+    A key is filed in the slot of the second it expires; moving the wheel
+    forward empties the slots it passes, so expiry is O(1) per key with no
+    scan over every member, and memory only holds keys seen in the last
+    period.
+    """
+
+    def __init__(self, period):
+        self.slots = [set() for _ in range(period)]  # one slot per second
+        self.active = set()
+        self.tick = int(time.monotonic())
+
+    def __len__(self):
+        return len(self.active)
+
+    def _advance(self, now):
+        tick = int(now)
+        for step in range(self.tick + 1, min(tick, self.tick + len(self.slots)) + 1):
+            slot = self.slots[step % len(self.slots)]
+            self.active -= slot
+            slot.clear()
+        self.tick = max(tick, self.tick)
+
+    def try_acquire(self, key, now=None):
+        """Return True and start the cooldown if key is not cooling down"""
+        self._advance(time.monotonic() if now is None else now)
+        if key in self.active:
+            return False
+        # The current slot was emptied on arrival and comes round again in one period
+        self.slots[self.tick % len(self.slots)].add(key)
+        self.active.add(key)
+        return True
+
+xp_cooldowns = CooldownWheel(XP_COOLDOWN_SECONDS)
+
+def add_experience(user_id, guild_id, amount, cooldown=False):
+    """Queue experience for the user; it is applied on the next XP flush
+
+    With cooldown, grants within XP_COOLDOWN_SECONDS of the last one are
+    dropped before they reach the accumulator.
+    """
+    if cooldown and not xp_cooldowns.try_acquire((guild_id, user_id)):
+        return
+    xp_accumulator.add(guild_id, user_id, amount)
+
+VOICE_XP_PER_MINUTE = 2
+VOICE_XP_TICK = 300  # seconds between crediting members who are still in voice
+
+def voice_xp_eligible(member):
+    """Members earn voice XP while unmuted, undeafened, not AFK and not alone"""
+    state = member.voice
+    if member.bot or state is None or state.channel is None or state.afk:
+        return False
+    if state.self_mute or state.self_deaf or state.mute or state.deaf:
+        return False
+    return any(not other.bot and other.id != member.id for other in state.channel.members)
+
+class VoiceSessions:
+    """When each eligible voice member started earning XP
+
+    Sessions open and close on voice state changes and are credited in
+    whole minutes on close and on a periodic tick. Credit goes through the
+    XP accumulator, so a busy voice server adds to counters rather than
+    writing per event. Voice updates missed while the gateway was away
+    can leave sessions behind, so the tick checks each member's current
+    voice state and a reconnect rebuilds every session.
+    """
+
+    def __init__(self, accumulator):
+        self.accumulator = accumulator
+        self.sessions = {}  # {(guild_id, user_id): monotonic time earning started}
+        self._task = None
+
+    def _credit(self, key, started, now):
+        """Grant XP for the whole minutes since started; return the start of the unpaid remainder"""
+        minutes = int((now - started) // 60)
+        if minutes > 0:
+            self.accumulator.add(key[0], key[1], minutes * VOICE_XP_PER_MINUTE)
+        return started + minutes * 60
+
+    def refresh(self, member, now):
+        key = (member.guild.id, member.id)
+        if voice_xp_eligible(member):
+            self.sessions.setdefault(key, now)
+        elif key in self.sessions:
+            self._credit(key, self.sessions.pop(key), now)
+
+    def refresh_channel(self, channel, now):
+        # Someone joining or leaving can make the others alone or not alone
+        for member in channel.members:
+            self.refresh(member, now)
+
+    def rebuild(self, guilds, now):
+        """Replace every session with the voice states in the cache now (after a (re)connect)"""
+        # Nobody can tell who stayed in voice while the bot was away; the gap earns nothing
+        self.sessions.clear()
+        for guild in guilds:
+            for channel in guild.voice_channels:
+                self.refresh_channel(channel, now)
+
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        for key, started in list(self.sessions.items()):
+            guild = bot.get_guild(key[0])
+            member = guild.get_member(key[1]) if guild else None
+            if member is None or not voice_xp_eligible(member):
+                # Its closing update was missed, so when it ended is unknown; credit nothing
+                del self.sessions[key]
+                continue
+            self.sessions[key] = self._credit(key, started, now)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._tick_loop())
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(VOICE_XP_TICK)
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error crediting voice XP: {e}")
+
+voice_sessions = VoiceSessions(xp_accumulator)
+atexit.register(voice_sessions.tick)  # Runs before xp_accumulator.flush
+
+async def get_user_level_data(user_id, guild_id):
+    """Get user level data, including XP that has not been flushed yet"""
+    level_data = await data_store.get_level(guild_id, user_id) or new_level_record()
+    pending = xp_accumulator.pending_xp(guild_id, user_id)
+    if pending:
+        total_xp = level_data['total_xp'] + pending
+        level, xp = level_from_total_xp(total_xp, guild_id)
+        level_data = {'level': level, 'xp': xp, 'total_xp': total_xp}
+    return level_data
 
 @bot.tree.command(name='level', description='ユーザーのレベルを表示')
 async def level_command(interaction: discord.Interaction, user: discord.Member = None):
@@ -838,68 +3764,145 @@ async def level_command(interaction: discord.Interaction, user: discord.Member =
         return
 
     target_user = user or interaction.user
-    level_data = get_user_level_data(target_user.id, interaction.guild.id)
+    # Apply buffered XP so the rank below counts it, as /ranking does
+    await xp_accumulator.flush_async()
+    level_data = await get_user_level_data(target_user.id, interaction.guild.id)
     
-    # Calculate XP needed for next level
-    current_level = level_data['level']
-    xp_needed = 100 - level_data['xp']
+    # Calculate XP needed for next level on this server's curve
+    current_level, level_xp, level_cost = level_table_for(interaction.guild.id).lookup(level_data['total_xp'])
+    xp_needed = level_cost - level_xp
     
     embed = discord.Embed(
         title=f'📊 {target_user.display_name} のレベル',
         color=0x00ff99
     )
     embed.add_field(name='🎯 レベル', value=f"{current_level}", inline=True)
-    embed.add_field(name='⭐ 経験値', value=f"{level_data['xp']}/100 XP", inline=True)
+    embed.add_field(name='⭐ 経験値', value=f"{level_xp}/{level_cost} XP", inline=True)
     embed.add_field(name='📈 総経験値', value=f"{level_data['total_xp']} XP", inline=True)
-    embed.add_field(name='🚀 次のレベルまで', value=f"{xp_needed} XP", inline=False)
+    embed.add_field(name='🚀 次のレベルまで', value=f"{xp_needed} XP", inline=True)
+
+    board = await leaderboards.board(interaction.guild)
+    rank = board.rank(str(target_user.id))
+    embed.add_field(name='🏅 順位', value=f"{rank}位 / {len(board)}人" if rank else 'ランク外', inline=True)
     
     # Progress bar
-    progress = level_data['xp'] / 100
+    progress = level_xp / level_cost
     bar_length = 20
     filled_length = int(bar_length * progress)
     bar = '█' * filled_length + '░' * (bar_length - filled_length)
-    embed.add_field(name='📊 進行度', value=f"`{bar}` {level_data['xp']}%", inline=False)
+    embed.add_field(name='📊 進行度', value=f"`{bar}` {int(progress * 100)}%", inline=False)
     
     embed.set_thumbnail(url=target_user.avatar.url if target_user.avatar else None)
     embed.set_footer(text='メッセージを送信して経験値を獲得しよう！')
     
     await interaction.response.send_message(embed=embed)
 
+RANKING_PAGE_SIZE = 10
+
 @bot.tree.command(name='ranking', description='サーバーのレベルランキングを表示')
-async def ranking_command(interaction: discord.Interaction):
+async def ranking_command(interaction: discord.Interaction, page: int = 1):
     if not is_allowed_server(interaction.guild.id):
         await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
         return
 
-    data = load_data()
-    if 'user_levels' not in data or str(interaction.guild.id) not in data['user_levels']:
+    # Apply buffered XP so the board is current
+    await xp_accumulator.flush_async()
+    board = await leaderboards.board(interaction.guild)
+    if not len(board):
         await interaction.response.send_message('❌ まだレベルデータがありません。', ephemeral=True)
         return
-    
-    guild_data = data['user_levels'][str(interaction.guild.id)]
-    
-    # Sort users by total XP
-    sorted_users = sorted(guild_data.items(), key=lambda x: x[1]['total_xp'], reverse=True)
-    
+
+    page_count = (len(board) + RANKING_PAGE_SIZE - 1) // RANKING_PAGE_SIZE
+    if page < 1 or page > page_count:
+        await interaction.response.send_message(f'❌ ページは1〜{page_count}の範囲で指定してください。', ephemeral=True)
+        return
+    offset = (page - 1) * RANKING_PAGE_SIZE
+
     embed = discord.Embed(
         title=f'🏆 {interaction.guild.name} レベルランキング',
         description='サーバー内の上位ユーザー',
         color=0xffd700
     )
-    
-    for i, (user_id, level_data) in enumerate(sorted_users[:10]):  # Top 10
+
+    for i, (user_id, total_xp) in enumerate(board.page(offset, RANKING_PAGE_SIZE), start=offset):
         user = interaction.guild.get_member(int(user_id))
-        if user:
-            rank_emoji = ['🥇', '🥈', '🥉'][i] if i < 3 else f"{i+1}."
-            embed.add_field(
-                name=f'{rank_emoji} {user.display_name}',
-                value=f'レベル: {level_data["level"]} | 総XP: {level_data["total_xp"]}',
-                inline=False
-            )
-    
-    embed.set_footer(text='メッセージを送信してランキングを上げよう！')
+        name = user.display_name if user else f'ID: {user_id}'
+        level, _ = level_from_total_xp(total_xp, interaction.guild.id)
+        rank_emoji = ['🥇', '🥈', '🥉'][i] if i < 3 else f"{i+1}."
+        embed.add_field(
+            name=f'{rank_emoji} {name}',
+            value=f'レベル: {level} | 総XP: {total_xp}',
+            inline=False
+        )
+
+    embed.set_footer(text=f'ページ {page}/{page_count} | メッセージを送信してランキングを上げよう！')
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name='xp-curve', description='レベルアップに必要な経験値の曲線を設定')
+async def xp_curve_command(interaction: discord.Interaction, curve: str = "show", base: int = 100, growth: int = 50, steps: str = None):
+    if not is_allowed_server(interaction.guild.id):
+        await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
+        return
+
+    if curve != "show" and not interaction.user.guild_permissions.manage_guild:
+        await interaction.response.send_message('❌ サーバー管理権限が必要です。', ephemeral=True)
+        return
+
+    guild_id = interaction.guild.id
+    if curve in XPCurve.KINDS:
+        if curve == "custom":
+            try:
+                step_list = tuple(int(value) for value in (steps or '').split(',') if value.strip())
+            except ValueError:
+                step_list = ()
+            if not step_list or min(step_list) < 1:
+                await interaction.response.send_message('❌ customでは各レベルの必要XPをカンマ区切りで指定してください。例: 100,150,200', ephemeral=True)
+                return
+            new_curve = XPCurve('custom', 0, 0, step_list)
+        elif base < 1 or growth < 0:
+            await interaction.response.send_message('❌ baseは1以上、growthは0以上で指定してください。', ephemeral=True)
+            return
+        else:
+            new_curve = XPCurve(curve, base, growth if curve == "quadratic" else 0, ())
+        config_registry.set('xp_curve', guild_id, new_curve)
+    elif curve == "reset":
+        config_registry.remove('xp_curve', guild_id)
+    elif curve != "show":
+        await interaction.response.send_message('❌ curveは show / linear / quadratic / custom / reset のいずれかを指定してください。', ephemeral=True)
+        return
+
+    if curve != "show":
+        await interaction.response.defer(ephemeral=True)
+        # Apply buffered XP first so it lands on the new curve, then rebuild the guild in one pass
+        await xp_accumulator.flush_async()
+        updated = await data_store.recompute_levels(guild_id)
+        await data_store.flush_async(compact=True)
+
+    current = config_registry.get('xp_curve', guild_id) or DEFAULT_XP_CURVE
+    thresholds = level_table_for(guild_id).thresholds
+    if current.kind == 'custom':
+        description = '各レベルの必要XP: ' + ', '.join(str(step) for step in current.steps[:10])
+    elif current.kind == 'quadratic':
+        description = f'レベルnの必要XP: {current.base} + {current.growth} × (n - 1)'
+    else:
+        description = f'各レベルの必要XP: {current.base}'
+
+    embed = discord.Embed(
+        title=f'📈 XP曲線: {current.kind}',
+        description=description,
+        color=0x00ff99
+    )
+    embed.add_field(
+        name='🎯 到達に必要な総XP',
+        value='\n'.join(f'レベル{level}: {thresholds[level - 1]} XP' for level in (2, 5, 10, 25, 50, 100)),
+        inline=False
+    )
+    if curve != "show":
+        embed.set_footer(text=f'{updated}人のレベルを再計算しました')
+        await interaction.followup.send(embed=embed, ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # Voting System
 active_polls = {}  # {message_id: poll_data}
 
@@ -924,28 +3927,12 @@ class PollView(discord.ui.View):
 
     def create_vote_callback(self, option_index):
         async def vote_callback(interaction):
-            data = load_data()
-            if 'polls' not in data:
-                data['polls'] = {}
-            
-            if self.poll_id not in data['polls']:
+            # Record vote (replaces the user's previous vote, if any)
+            poll_data = await data_store.record_vote(interaction.guild.id, self.poll_id, interaction.user.id, option_index)
+            if poll_data is None:
                 await interaction.response.send_message('❌ この投票は見つかりません。', ephemeral=True)
                 return
             
-            poll_data = data['polls'][self.poll_id]
-            user_id = str(interaction.user.id)
-            
-            # Check if user already voted
-            if user_id in poll_data['voters']:
-                old_option = poll_data['voters'][user_id]
-                poll_data['votes'][old_option] -= 1
-            
-            # Record new vote
-            poll_data['voters'][user_id] = option_index
-            poll_data['votes'][option_index] += 1
-            
-            save_data(data)
-            
             # Update embed
             embed = discord.Embed(
                 title=f'📊 {poll_data["question"]}',
@@ -1031,20 +4018,14 @@ async def poll_command(interaction: discord.Interaction, question: str, options:
         await message.edit(view=view)
         
         # Save poll data
-        data = load_data()
-        if 'polls' not in data:
-            data['polls'] = {}
-            
-        data['polls'][poll_id] = {
+        await data_store.set_poll(interaction.guild.id, poll_id, {
             'question': question,
             'options': option_list,
             'votes': [0] * len(option_list),
             'voters': {},  # {user_id: option_index}
             'creator': interaction.user.display_name,
-            'channel_id': interaction.channel.id,
-            'guild_id': interaction.guild.id
-        }
-        save_data(data)
+            'channel_id': interaction.channel.id
+        })
         
         # Add XP for creating poll
         add_experience(interaction.user.id, interaction.guild.id, 20)
@@ -1065,13 +4046,11 @@ async def poll_results_command(interaction: discord.Interaction, poll_id: str):
         await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
         return
 
-    data = load_data()
-    if 'polls' not in data or poll_id not in data['polls']:
+    poll_data = await data_store.get_poll(interaction.guild.id, poll_id)
+    if poll_data is None:
         await interaction.response.send_message('❌ 指定された投票が見つかりません。', ephemeral=True)
         return
     
-    poll_data = data['polls'][poll_id]
-    
     embed = discord.Embed(
         title=f'📊 投票結果: {poll_data["question"]}',
         color=0x00ff00
@@ -1107,15 +4086,12 @@ class TicketCloseView(discord.ui.View):
 
     @discord.ui.button(label='🔒 チケットを閉じる', style=discord.ButtonStyle.danger, emoji='🔒')
     async def close_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
-        data = load_data()
-        tickets = data.get('tickets', {})
+        ticket_data = await data_store.get_ticket(interaction.guild.id, self.ticket_id)
         
-        if str(self.ticket_id) not in tickets:
+        if ticket_data is None:
             await interaction.response.send_message('❌ チケットが見つかりません。', ephemeral=True)
             return
         
-        ticket_data = tickets[str(self.ticket_id)]
-        
         # Check if user is ticket creator or admin
         is_creator = str(interaction.user.id) == ticket_data['user_id']
         is_admin = interaction.user.guild_permissions.administrator
@@ -1129,10 +4105,11 @@ class TicketCloseView(discord.ui.View):
             return
         
         # Update ticket status
-        data['tickets'][str(self.ticket_id)]['status'] = 'closed'
-        data['tickets'][str(self.ticket_id)]['closed_at'] = datetime.now().isoformat()
-        data['tickets'][str(self.ticket_id)]['closed_by'] = str(interaction.user.id)
-        save_data(data)
+        await data_store.update_ticket(interaction.guild.id, self.ticket_id, {
+            'status': 'closed',
+            'closed_at': datetime.now().isoformat(),
+            'closed_by': str(interaction.user.id)
+        })
         
         # Send closure message
         embed = discord.Embed(
@@ -1162,14 +4139,11 @@ class TicketPanelView(discord.ui.View):
         await self.create_ticket_channel(interaction)
     
     async def create_ticket_channel(self, interaction):
-        data = load_data()
         user_id = str(interaction.user.id)
         guild_id = str(interaction.guild.id)
 
         # Create new ticket ID
-        ticket_id = 1
-        while str(ticket_id) in data.get('tickets', {}):
-            ticket_id += 1
+        ticket_id = await data_store.next_ticket_id(guild_id)
 
         try:
             # Check if category exists, create if necessary
@@ -1225,18 +4199,13 @@ class TicketPanelView(discord.ui.View):
             await channel.send(f"{interaction.user.mention} へのメンション", delete_after=1)
 
             # Save ticket data
-            if 'tickets' not in data:
-                data['tickets'] = {}
-
-            data['tickets'][str(ticket_id)] = {
+            await data_store.set_ticket(guild_id, ticket_id, {
                 'user_id': user_id,
-                'guild_id': guild_id,
                 'channel_id': str(channel.id),
                 'created_at': datetime.now().isoformat(),
                 'description': 'チケット作成',
                 'status': 'open'
-            }
-            save_data(data)
+            })
 
             # Send confirmation
             await interaction.response.send_message(f'✅ チケット #{ticket_id} を作成しました！ {channel.mention} で詳細を確認してください。', ephemeral=True)
@@ -1299,15 +4268,8 @@ async def ticket_list(interaction: discord.Interaction, status: str = "all"):
         await interaction.response.send_message('❌ メッセージ管理権限が必要です。', ephemeral=True)
         return
 
-    data = load_data()
-    tickets = data.get('tickets', {})
-
     # Filter tickets by guild and status
-    guild_tickets = []
-    for ticket_id, ticket_data in tickets.items():
-        if ticket_data['guild_id'] == str(interaction.guild.id):
-            if status == "all" or ticket_data['status'] == status:
-                guild_tickets.append((ticket_id, ticket_data))
+    guild_tickets = await data_store.list_tickets(interaction.guild.id, None if status == "all" else status)
 
     if not guild_tickets:
         await interaction.response.send_message('❌ 該当するチケットが見つかりません。', ephemeral=True)
@@ -1345,28 +4307,22 @@ async def close_ticket_command(interaction: discord.Interaction, ticket_id: int)
         await interaction.response.send_message('❌ 管理者権限が必要です。', ephemeral=True)
         return
 
-    data = load_data()
-    tickets = data.get('tickets', {})
+    ticket_data = await data_store.get_ticket(interaction.guild.id, ticket_id)
 
-    if str(ticket_id) not in tickets:
+    if ticket_data is None:
         await interaction.response.send_message('❌ 指定されたチケットが見つかりません。', ephemeral=True)
         return
 
-    ticket_data = tickets[str(ticket_id)]
-
-    if ticket_data['guild_id'] != str(interaction.guild.id):
-        await interaction.response.send_message('❌ このサーバーのチケットではありません。', ephemeral=True)
-        return
-
     if ticket_data['status'] == 'closed':
         await interaction.response.send_message('❌ このチケットは既に閉じられています。', ephemeral=True)
         return
 
     # Update ticket status
-    data['tickets'][str(ticket_id)]['status'] = 'closed'
-    data['tickets'][str(ticket_id)]['closed_at'] = datetime.now().isoformat()
-    data['tickets'][str(ticket_id)]['closed_by'] = str(interaction.user.id)
-    save_data(data)
+    await data_store.update_ticket(interaction.guild.id, ticket_id, {
+        'status': 'closed',
+        'closed_at': datetime.now().isoformat(),
+        'closed_by': str(interaction.user.id)
+    })
 
     # Try to find and delete the channel
     channel_id = ticket_data.get('channel_id')
@@ -1421,16 +4377,14 @@ async def setup_server_log(interaction: discord.Interaction, target_server_id: s
                     return
                 mode_text = f'チャンネル #{source_channel.name}'
                 # Store configuration with specific channel
-                server_log_configs[source_guild_id] = {"target_server": target_server_id, "channel_id": channel_id}
+                config_registry.set('server_log', source_guild_id, ServerLogConfig(target_server_id, channel_id))
             except ValueError:
                 await interaction.response.send_message('❌ 無効なチャンネルIDです。数字のみを入力してください。', ephemeral=True)
                 return
         else:
             # All channels mode
             mode_text = 'サーバーの全チャンネル'
-            server_log_configs[source_guild_id] = {"target_server": target_server_id, "channel_id": None}
-        
-        save_server_log_config()
+            config_registry.set('server_log', source_guild_id, ServerLogConfig(target_server_id, None))
 
         embed = discord.Embed(
             title='✅ サーバーログ設定完了',
@@ -1464,17 +4418,11 @@ async def server_log_status(interaction: discord.Interaction):
         color=0x0099ff
     )
 
-    if source_guild_id in server_log_configs:
-        config = server_log_configs[source_guild_id]
-        # Handle both old and new format
-        if isinstance(config, dict):
-            target_server_id = config["target_server"]
-            channel_id = config.get("channel_id")
-        else:
-            # Old format (backward compatibility)
-            target_server_id = config
-            channel_id = None
-            
+    config = config_registry.get('server_log', source_guild_id)
+    if config:
+        target_server_id = config.target_server
+        channel_id = config.channel_id
+
         target_guild = bot.get_guild(int(target_server_id))
         target_name = target_guild.name if target_guild else f"不明なサーバー (ID: {target_server_id})"
         
@@ -1503,17 +4451,10 @@ async def server_log_status(interaction: discord.Interaction):
 
     # Show reverse logging (if this server is a target)
     reverse_configs = []
-    for source_id, config in server_log_configs.items():
-        # Handle both old and new format
-        if isinstance(config, dict):
-            target_id = config["target_server"]
-        else:
-            target_id = config
-            
-        if target_id == source_guild_id:
-            source_guild = bot.get_guild(int(source_id))
-            source_name = source_guild.name if source_guild else f"不明なサーバー (ID: {source_id})"
-            reverse_configs.append(source_name)
+    for source_id in config_registry.log_sources_for(source_guild_id):
+        source_guild = bot.get_guild(int(source_id))
+        source_name = source_guild.name if source_guild else f"不明なサーバー (ID: {source_id})"
+        reverse_configs.append(source_name)
 
     if reverse_configs:
         embed.add_field(
@@ -1527,7 +4468,6 @@ async def server_log_status(interaction: discord.Interaction):
 
 
 # Random quotes system
-import random
 import asyncio
 from datetime import datetime, timedelta
 
@@ -1543,28 +4483,8 @@ MEIGEN_QUOTES = [
     "ルートヴィヒ・ヴァン・ベートーヴェン\n「諸君、喝采せよ。喜劇は終わった。」"
 ]
 
-meigen_channels = {}  # {guild_id: channel_id}
 meigen_tasks = {}  # {guild_id: task}
 
-def save_meigen_config():
-    """Save meigen channel configuration"""
-    try:
-        with open('meigen_config.json', 'w', encoding='utf-8') as f:
-            json.dump(meigen_channels, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Error saving meigen config: {e}")
-
-def load_meigen_config():
-    """Load meigen channel configuration"""
-    global meigen_channels
-    try:
-        if os.path.exists('meigen_config.json'):
-            with open('meigen_config.json', 'r', encoding='utf-8') as f:
-                meigen_channels = json.load(f)
-    except Exception as e:
-        print(f"Error loading meigen config: {e}")
-        meigen_channels = {}
-
 async def send_daily_meigen(guild_id, channel_id):
     """Send random quote at random time daily"""
     while True:
@@ -1657,13 +4577,16 @@ async def delete_messages(interaction: discord.Interaction, count: int, user: di
     try:
         if user:
             # Delete messages from specific user
-            deleted = 0
+            message_ids = []
             async for message in interaction.channel.history(limit=200):
-                if message.author == user and deleted < count:
-                    await message.delete()
-                    deleted += 1
-                    await asyncio.sleep(0.5)  # Rate limit protection
-            
+                if message.author == user and len(message_ids) < count:
+                    message_ids.append(message.id)
+
+            results = await asyncio.gather(*action_scheduler.delete_messages(interaction.channel, message_ids), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors and len(errors) == len(results):
+                raise errors[0]
+            deleted = sum(result for result in results if not isinstance(result, Exception))
             await interaction.followup.send(f'✅ {user.display_name}のメッセージを{deleted}件削除しました。', ephemeral=True)
         else:
             # Delete latest messages
@@ -1672,7 +4595,7 @@ async def delete_messages(interaction: discord.Interaction, count: int, user: di
                 messages.append(message)
             
             if messages:
-                await interaction.channel.delete_messages(messages)
+                await asyncio.gather(*action_scheduler.delete_messages(interaction.channel, [message.id for message in messages]))
                 await interaction.followup.send(f'✅ {len(messages)}件のメッセージを削除しました。', ephemeral=True)
             else:
                 await interaction.followup.send('❌ 削除するメッセージが見つかりません。', ephemeral=True)
@@ -1718,8 +4641,7 @@ async def meigen_channel_setting(interaction: discord.Interaction, interval: str
     channel_id = str(interaction.channel.id)
 
     # Save configuration with interval
-    meigen_channels[guild_id] = {"channel_id": channel_id, "interval": seconds}
-    save_meigen_config()
+    config_registry.set('meigen', guild_id, MeigenConfig(channel_id, seconds))
 
     # Stop existing task if any
     if guild_id in meigen_tasks:
@@ -1786,8 +4708,8 @@ COMMAND_HELP = {
     },
     'antispam-config': {
         'description': '荒らし対策設定を表示・変更',
-        'usage': '/antispam-config [action]',
-        'details': '同じメッセージの連投を検知して対策します。30秒以内に同じメッセージを3回以上送信した場合、すべての重複メッセージを削除し1時間のタイムアウトを適用します。actionに"show"で設定表示、"reset"でデータリセットができます。メッセージ管理権限が必要です。'
+        'usage': '/antispam-config [action] [repeat_window] [repeat_count] [timeout_minutes] [bot_window] [bot_count] [bot_ban] [raid_users]',
+        'details': '同じメッセージの連投やBotの大量投稿、レイドを検知して対策します。標準では30秒以内に同じメッセージを3回以上送信した場合、すべての重複メッセージを削除し60分のタイムアウトを適用します。actionに"show"で設定表示、"set"で指定した項目だけを変更（timeout_minutesは0で削除のみ、raid_usersは0でレイド検知無効）、"default"で標準設定に戻す、"reset"で検知データのリセットができます。設定はサーバーごとに保存され、すぐに反映されます。メッセージ管理権限が必要です。'
     },
     'spam-status': {
         'description': '現在のスパム検知状況を表示',
@@ -1854,12 +4776,32 @@ COMMAND_HELP = {
     'level': {
         'description': 'ユーザーのレベルを表示',
         'usage': '/level [ユーザー]',
-        'details': '指定したユーザー（省略時は自分）のレベル、経験値、進行度を表示します。メッセージ送信で5XP獲得できます。'
+        'details': '指定したユーザー（省略時は自分）のレベル、経験値、進行度、サーバー内順位を表示します。メッセージ送信で5XP（60秒に1回まで）、ボイスチャンネル参加で1分ごとに2XP獲得できます（ミュート・AFK・1人だけの間は対象外）。'
     },
     'ranking': {
         'description': 'サーバーのレベルランキングを表示',
-        'usage': '/ranking',
-        'details': 'サーバー内のユーザーのレベルランキングを表示します。上位10名まで表示されます。'
+        'usage': '/ranking [ページ]',
+        'details': 'サーバー内のユーザーのレベルランキングを1ページ10名ずつ表示します。ページを省略すると上位10名を表示します。サーバーを退出したユーザーは除外されます。'
+    },
+    'bot-allowlist': {
+        'description': 'スパム検知の対象外にするBotを管理',
+        'usage': '/bot-allowlist [list|add|remove] [Bot] [Webhook ID]',
+        'details': '許可リストに登録したBotやWebhookは、連続投稿によるBot Ban（Webhookは削除）の対象外になります。このBotのコピー用Webhookは常に対象外です。サーバー管理権限が必要です。'
+    },
+    'lockdown': {
+        'description': '参加数急増時のロックダウン状態を確認・操作',
+        'usage': '/lockdown [status|start|lift]',
+        'details': '60秒以内に10人以上が参加すると自動でロックダウンし、認証レベルの引き上げとロールパネルの一時停止を行い、作成7日未満のアカウントをタイムアウトします。15分後に自動解除されます。手動での開始・解除も可能です。サーバー管理権限が必要です。'
+    },
+    'automod': {
+        'description': 'リンク・メンション・大文字などの自動モデレーションを設定',
+        'usage': '/automod [show|set|off] [invites] [domains] [max_mentions] [max_emoji] [caps_percent] [zalgo] [timeout_minutes]',
+        'details': '招待リンク、ブロックしたドメイン（カンマ区切り、「-」で解除）、大量メンション、絵文字の連投、大文字の多用、崩し文字を検知し、メッセージを削除してタイムアウトします。数値に0を指定するとそのルールは無効になります。メッセージ管理権限が必要です。'
+    },
+    'xp-curve': {
+        'description': 'レベルアップに必要な経験値の曲線を設定',
+        'usage': '/xp-curve [show|linear|quadratic|custom|reset] [base] [growth] [steps]',
+        'details': 'サーバーのレベル曲線を表示・変更します。linearは毎レベルbase XP、quadraticはレベルnでbase + growth×(n-1) XP、customはstepsにカンマ区切りで各レベルの必要XPを指定します（最後の値が以降も使われます）。変更すると全員のレベルが総XPから再計算されます。変更にはサーバー管理権限が必要です。'
     },
     'delete': {
         'description': '指定した数のメッセージを削除',
@@ -2089,46 +5031,15 @@ def run_bot():
     print("Starting Discord bot...")
     bot.run(token)
 
-server_log_configs = {}
-
-def save_server_log_config():
-    try:
-        with open('server_log_config.json', 'w', encoding='utf-8') as f:
-            json.dump(server_log_configs, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Error saving server log config: {e}")
-
-def load_server_log_config():
-    global server_log_configs
-    try:
-        if os.path.exists('server_log_config.json'):
-            with open('server_log_config.json', 'r', encoding='utf-8') as f:
-                server_log_configs = json.load(f)
-    except Exception as e:
-        print(f"Error loading server log config: {e}")
-        server_log_configs = {}
-
-async def on_message_for_copy(message):
-    pass
-
-async def on_message_for_server_translation(message):
-    pass
-
 async def on_message_for_server_logging(message):
     if message.author.bot:
         return
-    source_guild_id = str(message.guild.id)
-    if source_guild_id not in server_log_configs:
+    config = config_registry.get('server_log', message.guild.id)
+    if not config:
         return
-    config = server_log_configs[source_guild_id]
-    if isinstance(config, dict):
-        target_guild_id = config["target_server"]
-        specific_channel_id = config.get("channel_id")
-        if specific_channel_id and str(message.channel.id) != specific_channel_id:
-            return
-    else:
-        target_guild_id = config
-        specific_channel_id = None
+    if config.channel_id and str(message.channel.id) != config.channel_id:
+        return
+    target_guild_id = config.target_server
     target_guild = bot.get_guild(int(target_guild_id))
     if not target_guild:
         print(f"Target guild {target_guild_id} not found")
@@ -2178,24 +5089,11 @@ async def on_message_for_server_logging(message):
     except Exception as e:
         print(f"Failed to send log message: {e}")
 
-channel_configs = {}
-
-def save_translation_config():
-    try:
-        with open('channel_config.json', 'w', encoding='utf-8') as f:
-            json.dump(channel_configs, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Error saving channel config: {e}")
+PIPELINE_STAGES = (  # (name, handler, workers, queue size)
+    ('logging', on_message_for_server_logging, 4, 2000),
+)
 
-def load_translation_config():
-    global channel_configs
-    try:
-        if os.path.exists('channel_config.json'):
-            with open('channel_config.json', 'r', encoding='utf-8') as f:
-                channel_configs = json.load(f)
-    except Exception as e:
-        print(f"Error loading channel config: {e}")
-        channel_configs = {}
+message_pipeline = MessagePipeline([PipelineStage(*stage) for stage in PIPELINE_STAGES])
 
 async def create_channel_if_not_exists(guild, channel_name, channel_type="text", category_name=None):
     existing_channel = discord.utils.get(guild.channels, name=channel_name)
@@ -2327,36 +5225,19 @@ async def stop_timenuke_command(interaction: discord.Interaction):
     )
     await interaction.response.send_message(embed=embed)
 
-def get_user_warnings(user_id, guild_id):
-    data = load_data()
-    if 'warnings' not in data:
-        data['warnings'] = {}
-    guild_key = str(guild_id)
-    user_key = str(user_id)
-    if guild_key not in data['warnings']:
-        data['warnings'][guild_key] = {}
-    if user_key not in data['warnings'][guild_key]:
+async def get_user_warnings(user_id, guild_id):
+    warning_data = await data_store.get_warnings(guild_id, user_id)
+    if warning_data is None:
         return 0
-    return data['warnings'][guild_key][user_key]['count']
+    return warning_data['count']
 
-def add_user_warning(user_id, guild_id, reason, moderator_id):
-    data = load_data()
-    if 'warnings' not in data:
-        data['warnings'] = {}
-    guild_key = str(guild_id)
-    user_key = str(user_id)
-    if guild_key not in data['warnings']:
-        data['warnings'][guild_key] = {}
-    if user_key not in data['warnings'][guild_key]:
-        data['warnings'][guild_key][user_key] = {'count': 0, 'history': []}
-    data['warnings'][guild_key][user_key]['count'] += 1
-    data['warnings'][guild_key][user_key]['history'].append({
+async def add_user_warning(user_id, guild_id, reason, moderator_id):
+    warning_data = await data_store.add_warning(guild_id, user_id, {
         'reason': reason,
         'moderator_id': str(moderator_id),
         'timestamp': datetime.now().isoformat()
     })
-    save_data(data)
-    return data['warnings'][guild_key][user_key]['count']
+    return warning_data['count']
 
 @bot.tree.command(name='warn', description='ユーザーに警告を与える')
 async def warn_user(interaction: discord.Interaction, user: discord.Member, reason: str = "規則違反"):
@@ -2369,7 +5250,9 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
     if user.guild_permissions.administrator:
         await interaction.response.send_message('❌ 管理者に警告を与えることはできません。', ephemeral=True)
         return
-    warning_count = add_user_warning(user.id, interaction.guild.id, reason, interaction.user.id)
+    # The timeout or ban below may wait behind a raid's queued actions for longer than the interaction allows
+    await interaction.response.defer()
+    warning_count = await add_user_warning(user.id, interaction.guild.id, reason, interaction.user.id)
     embed = discord.Embed(
         title='⚠️ 警告システム',
         color=0xff9900
@@ -2383,16 +5266,15 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
             embed.add_field(name='措置', value='警告のみ', inline=False)
             embed.set_footer(text='次回警告で1時間ミュート、3回目でBanとなります')
         elif warning_count == 2:
-            from datetime import timedelta
             timeout_duration = discord.utils.utcnow() + timedelta(hours=1)
-            await user.timeout(timeout_duration, reason=f"2回目の警告: {reason}")
+            await action_scheduler.run('timeout', interaction.guild.id, user.timeout, timeout_duration, reason=f"2回目の警告: {reason}")
             embed.add_field(name='措置', value='1時間タイムアウト', inline=False)
             embed.set_footer(text='次回警告でBanとなります')
         elif warning_count >= 3:
-            await user.ban(reason=f"3回目の警告: {reason}")
+            await action_scheduler.run('ban', interaction.guild.id, user.ban, reason=f"3回目の警告: {reason}")
             embed.add_field(name='措置', value='サーバーからBan', inline=False)
             embed.set_footer(text='規則違反により永久Ban')
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
         try:
             dm_embed = discord.Embed(
                 title=f'⚠️ {interaction.guild.name}で警告を受けました',
@@ -2409,9 +5291,9 @@ async def warn_user(interaction: discord.Interaction, user: discord.Member, reas
         except:
             pass
     except discord.Forbidden:
-        await interaction.response.send_message('❌ ユーザーに措置を適用する権限がありません。', ephemeral=True)
+        await interaction.followup.send('❌ ユーザーに措置を適用する権限がありません。', ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f'❌ エラーが発生しました: {str(e)}', ephemeral=True)
+        await interaction.followup.send(f'❌ エラーが発生しました: {str(e)}', ephemeral=True)
 
 @bot.tree.command(name='warnings', description='ユーザーの警告履歴を表示')
 async def show_warnings(interaction: discord.Interaction, user: discord.Member):
@@ -2423,16 +5305,11 @@ async def show_warnings(interaction: discord.Interaction, user: discord.Member):
         await interaction.response.send_message('❌ メッセージ管理権限が必要です。', ephemeral=True)
         return
 
-    data = load_data()
-    guild_key = str(interaction.guild.id)
-    user_key = str(user.id)
+    warning_data = await data_store.get_warnings(interaction.guild.id, user.id)
 
-    if ('warnings' not in data or guild_key not in data['warnings'] or 
-        user_key not in data['warnings'][guild_key]):
+    if warning_data is None:
         await interaction.response.send_message(f'❌ {user.display_name}の警告記録はありません。', ephemeral=True)
         return
-
-    warning_data = data['warnings'][guild_key][user_key]
     embed = discord.Embed(
         title=f'⚠️ {user.display_name}の警告履歴',
         description=f'**警告回数:** {warning_data["count"]}/3',
@@ -2489,10 +5366,11 @@ async def temp_mute(interaction: discord.Interaction, user: discord.Member, dura
         await interaction.response.send_message('❌ 時間形式が正しくありません。例: 30m, 2h, 1d', ephemeral=True)
         return
 
+    # The timeout may wait behind a raid's queued actions for longer than the interaction allows
+    await interaction.response.defer()
     try:
-        from datetime import timedelta
         timeout_duration = discord.utils.utcnow() + timedelta(seconds=seconds)
-        await user.timeout(timeout_duration, reason=reason)
+        await action_scheduler.run('timeout', interaction.guild.id, user.timeout, timeout_duration, reason=reason)
 
         # Format duration display
         if seconds >= 86400:
@@ -2512,7 +5390,7 @@ async def temp_mute(interaction: discord.Interaction, user: discord.Member, dura
         embed.add_field(name='モデレーター', value=interaction.user.mention, inline=True)
         embed.add_field(name='解除時刻', value=f'<t:{int(timeout_duration.timestamp())}:F>', inline=False)
 
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
 
         # Send DM to user
         try:
@@ -2526,9 +5404,9 @@ async def temp_mute(interaction: discord.Interaction, user: discord.Member, dura
             pass
 
     except discord.Forbidden:
-        await interaction.response.send_message('❌ ユーザーをミュートする権限がありません。', ephemeral=True)
+        await interaction.followup.send('❌ ユーザーをミュートする権限がありません。', ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f'❌ エラーが発生しました: {str(e)}', ephemeral=True)
+        await interaction.followup.send(f'❌ エラーが発生しました: {str(e)}', ephemeral=True)
 
 
 
@@ -2612,205 +5490,241 @@ async def support_request(interaction: discord.Interaction, content: str):
     
     await interaction.response.send_message('✅ サポート要請を送信しました。対応者が決まり次第、DMでご連絡します。', ephemeral=True)
 
-@bot.tree.command(name='allmessage', description='サーバーの全メッセージを指定したサーバーにコピー')
-async def allmessage_command(interaction: discord.Interaction, target_server_id: str, channel_id: str = None):
-    if not is_allowed_server(interaction.guild.id):
-        await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
-        return
-
-    if not interaction.user.guild_permissions.administrator:
-        await interaction.response.send_message('❌ 管理者権限が必要です。', ephemeral=True)
+async def send_job_status(job, embed):
+    """Edit the job's progress message, or post a new one if it is gone"""
+    channel = bot.get_channel(job.params['status_channel_id'])
+    if channel is None:
         return
-
-    try:
-        target_guild_id = int(target_server_id)
-        target_guild = bot.get_guild(target_guild_id)
-        
-        if not target_guild:
-            await interaction.response.send_message('❌ 指定されたサーバーが見つかりません。Botがそのサーバーに参加していることを確認してください。', ephemeral=True)
-            return
-        
-        if not target_guild.me.guild_permissions.manage_channels:
-            await interaction.response.send_message('❌ 転送先サーバーでチャンネル管理権限が必要です。', ephemeral=True)
+    message_id = job.params.get('status_message_id')
+    if message_id:
+        try:
+            await channel.get_partial_message(message_id).edit(embed=embed)
             return
+        except discord.HTTPException as e:
+            print(f"Status update error: {e}")
+    try:
+        message = await channel.send(embed=embed)
+        job.params['status_message_id'] = message.id
+        job_manager.mark_dirty('jobs')
+    except discord.HTTPException as e:
+        print(f"Failed to send job status: {e}")
+
+COPY_MODES = {'embed': '埋め込み（Bot名義）', 'webhook': 'Webhook（元の投稿者名・アイコン）'}
+COPY_WEBHOOK_NAME = 'm.m.bot copy'
+COPY_BATCH_EMBEDS = 10  # Discord's limit of embeds per message
+COPY_BATCH_CHARS = 6000  # Discord's limit of embed text per message
+COPY_SEND_RETRIES = 3  # attempts at one batch before the job fails
+COPY_RETRY_DELAY = 5  # seconds before the second attempt; doubles after that
+
+class CopyWebhooks:
+    """The bot's copy webhook for each target channel, looked up or created once"""
 
-        if channel_id:
-            try:
-                source_channel = bot.get_channel(int(channel_id))
-                if not source_channel or source_channel.guild.id != interaction.guild.id:
-                    await interaction.response.send_message('❌ 指定されたチャンネルが見つからないか、このサーバーのチャンネルではありません。', ephemeral=True)
-                    return
-                channels_to_process = [source_channel]
-                mode_text = f'チャンネル #{source_channel.name}'
-            except ValueError:
-                await interaction.response.send_message('❌ 無効なチャンネルIDです。数字のみを入力してください。', ephemeral=True)
-                return
-        else:
-            channels_to_process = interaction.guild.text_channels
-            mode_text = 'サーバーの全チャンネル'
+    def __init__(self):
+        self.webhooks = {}  # {channel ID: discord.Webhook}
+
+    async def get(self, channel):
+        webhook = self.webhooks.get(channel.id)
+        if webhook is None:
+            for existing in await channel.webhooks():
+                if existing.user == bot.user and existing.name == COPY_WEBHOOK_NAME:
+                    webhook = existing
+                    break
+            else:
+                webhook = await channel.create_webhook(name=COPY_WEBHOOK_NAME, reason="メッセージコピー用")
+            self.webhooks[channel.id] = webhook
+        return webhook
 
-        source_guild_id = str(interaction.guild.id)
-        if channel_id:
-            server_log_configs[source_guild_id] = {"target_server": target_server_id, "channel_id": channel_id}
-        else:
-            server_log_configs[source_guild_id] = {"target_server": target_server_id, "channel_id": None}
-        save_server_log_config()
+    def forget(self, channel):
+        self.webhooks.pop(channel.id, None)
 
-        await interaction.response.send_message(
-            f'✅ メッセージコピーを開始しました。\n**転送先:** {target_guild.name}\n**対象:** {mode_text}\n\n処理には時間がかかる場合があります。進行状況は別メッセージで更新されます。\n\n🔄 **サーバーログも自動で設定されました。**', 
-            ephemeral=True
-        )
+    def owns(self, webhook_id):
+        """Whether a message's webhook is one of ours"""
+        return any(webhook.id == webhook_id for webhook in self.webhooks.values())
 
-        status_channel = interaction.channel
+copy_webhooks = CopyWebhooks()
 
-        status_embed = discord.Embed(
-            title='📋 メッセージコピー進行状況',
-            description=f'**送信元:** {interaction.guild.name}\n**転送先:** {target_guild.name}\n**対象:** {mode_text}\n\nメッセージをコピーしています...',
-            color=0x0099ff
-        )
-        status_embed.add_field(
-            name='進行状況',
-            value='開始中...',
-            inline=False
+def build_copy_embed(message, footer, with_author):
+    embed = discord.Embed(
+        description=message.content if message.content else "(添付ファイルのみ)",
+        color=0x00ff99,
+        timestamp=message.created_at
+    )
+    if with_author:
+        embed.set_author(
+            name=f"{message.author.display_name} ({message.author.name})",
+            icon_url=message.author.avatar.url if message.author.avatar else None
         )
-        status_embed.set_footer(text=f'開始者: {interaction.user.display_name}')
-        
-        try:
-            status_message = await status_channel.send(embed=status_embed)
-        except:
-            status_message = None
+    embed.set_footer(text=footer)
 
-        copied_messages = 0
-        created_channels = 0
+    if message.attachments:
+        attachment_info = []
+        for attachment in message.attachments:
+            attachment_info.append(f"[{attachment.filename}]({attachment.url})")
 
-        for channel in channels_to_process:
-            try:
-                target_channel = discord.utils.get(target_guild.text_channels, name=channel.name)
-                
-                if not target_channel:
-                    category = None
-                    if channel.category:
-                        category = discord.utils.get(target_guild.categories, name=channel.category.name)
-                        if not category:
-                            category = await target_guild.create_category(channel.category.name)
-                    
-                    target_channel = await target_guild.create_text_channel(
-                        name=channel.name,
-                        category=category,
-                        topic=f"Copy from {interaction.guild.name}#{channel.name}"
-                    )
-                    created_channels += 1
-
-                channel_messages = 0
-                async for message in channel.history(limit=None, oldest_first=True):
-                    
-                    embed = discord.Embed(
-                        description=message.content if message.content else "(添付ファイルのみ)",
-                        color=0x00ff99,
-                        timestamp=message.created_at
-                    )
-                    embed.set_author(
-                        name=f"{message.author.display_name} ({message.author.name})",
-                        icon_url=message.author.avatar.url if message.author.avatar else None
-                    )
-                    embed.set_footer(text=f"Original: {interaction.guild.name} #{channel.name}")
-                    
-                    if message.attachments:
-                        attachment_info = []
-                        for attachment in message.attachments:
-                            attachment_info.append(f"[{attachment.filename}]({attachment.url})")
-                        
-                        if attachment_info:
-                            embed.add_field(
-                                name="📎 添付ファイル",
-                                value="\n".join(attachment_info),
-                                inline=False
-                            )
-                    
+        if attachment_info:
+            embed.add_field(
+                name="📎 添付ファイル",
+                value="\n".join(attachment_info),
+                inline=False
+            )
+    return embed
+
+def fits_copy_batch(batch, message, embed):
+    """Whether a webhook message can carry one more copied message: same author and within Discord's limits"""
+    return (len(batch) < COPY_BATCH_EMBEDS and batch[0][0].author.id == message.author.id
+            and sum(len(queued) for _, queued in batch) + len(embed) <= COPY_BATCH_CHARS)
+
+async def send_copy_batch(target_channel, batch, mode):
+    """Post (message, embed) pairs in one request; return how many were copied
+
+    Raises discord.HTTPException when Discord refuses the batch.
+    """
+    embeds = [embed for _, embed in batch]
+    if mode != 'webhook':
+        await action_scheduler.run('copy', target_channel.id, target_channel.send, embeds=embeds)
+        return len(batch)
+    author = batch[0][0].author
+    # Webhook names may not contain "discord" or "clyde"
+    username = re.sub(r'(?i)discord|clyde', '', author.display_name).strip()[:80] or author.name
+    for attempt in range(2):
+        webhook = await copy_webhooks.get(target_channel)
+        try:
+            await action_scheduler.run(
+                'copy', target_channel.id, webhook.send, embeds=embeds, username=username,
+                avatar_url=author.display_avatar.url
+            )
+            return len(batch)
+        except discord.NotFound:
+            # The webhook was deleted in the meantime; make a new one once
+            copy_webhooks.forget(target_channel)
+            if attempt:
+                raise
+
+def describe_allmessage_job(job):
+    progress = job.progress
+    text = (f"コピー済み {progress.get('copied', 0)}件 / 作成チャンネル {progress.get('created_channels', 0)}個 / "
+            f"完了チャンネル {len(progress.get('completed', ()))}個")
+    if job.status in JOB_ACTIVE_STATUSES and progress.get('channel'):
+        text += f" / 処理中 #{progress['channel']}"
+    return text
+
+async def run_allmessage_job(job):
+    params = job.params
+    source_guild = bot.get_guild(job.guild_id)
+    target_guild = bot.get_guild(params['target_guild_id'])
+    if source_guild is None or target_guild is None:
+        raise RuntimeError('送信元または転送先サーバーが見つかりません')
+
+    if params['channel_id']:
+        source_channel = source_guild.get_channel(params['channel_id'])
+        channels_to_process = [source_channel] if source_channel else []
+    else:
+        channels_to_process = source_guild.text_channels
+
+    status_embed = discord.Embed(
+        title='📋 メッセージコピー進行状況',
+        description=f'**送信元:** {source_guild.name}\n**転送先:** {target_guild.name}\n**対象:** {params["mode_text"]}\n\nメッセージをコピーしています...',
+        color=0x0099ff
+    )
+    status_embed.set_footer(text=f'開始者: {params["requested_by"]} | ジョブ #{job.id}')
+
+    mode = params.get('mode', 'embed')
+    copied_messages = job.progress.get('copied', 0)
+    created_channels = job.progress.get('created_channels', 0)
+    # Resume state: the last copied message per channel, and channels already finished
+    cursors = job.progress.setdefault('cursors', {})  # {channel ID (str): message ID}
+    completed = set(job.progress.get('completed', ()))
+
+    for channel in channels_to_process:
+        if channel.id in completed:
+            continue
+        try:
+            target_channel = discord.utils.get(target_guild.text_channels, name=channel.name)
+
+            if not target_channel:
+                category = None
+                if channel.category:
+                    category = discord.utils.get(target_guild.categories, name=channel.category.name)
+                    if not category:
+                        category = await target_guild.create_category(channel.category.name)
+
+                target_channel = await target_guild.create_text_channel(
+                    name=channel.name,
+                    category=category,
+                    topic=f"Copy from {source_guild.name}#{channel.name}"
+                )
+                created_channels += 1
+                job.report(created_channels=created_channels)
+
+            job.report(channel=channel.name)
+            channel_messages = 0
+            cursor = cursors.get(str(channel.id))
+            after = discord.Object(id=cursor) if cursor else None
+            batch = []  # (message, embed) pairs waiting to go out in one request
+
+            async def flush_batch():
+                nonlocal copied_messages, channel_messages
+                for attempt in range(COPY_SEND_RETRIES):
                     try:
-                        await target_channel.send(embed=embed)
-                        copied_messages += 1
-                        channel_messages += 1
-                        
-                        if copied_messages % 100 == 0 and status_message:
-                            try:
-                                status_embed.clear_fields()
-                                status_embed.add_field(
-                                    name='進行状況',
-                                    value=f'コピー済みメッセージ: {copied_messages}\n作成チャンネル: {created_channels}\n現在処理中: #{channel.name}',
-                                    inline=False
-                                )
-                                await status_message.edit(embed=status_embed)
-                            except Exception as e:
-                                print(f"Status update error: {e}")
-                                status_message = None
-                        
-                    except Exception as e:
+                        copied = await send_copy_batch(target_channel, batch, mode)
+                        break
+                    except discord.HTTPException as e:
                         print(f"Failed to copy message: {e}")
-                        continue
-                
-                print(f"Copied {channel_messages} messages from #{channel.name}")
-                
-            except Exception as e:
-                print(f"Error processing channel #{channel.name}: {e}")
-                continue
+                        if attempt == COPY_SEND_RETRIES - 1:
+                            # The cursor stays on the last batch that arrived, so nothing is skipped
+                            raise RuntimeError(f'#{channel.name} のメッセージをコピーできませんでした: {e}') from e
+                        await asyncio.sleep(COPY_RETRY_DELAY * 2 ** attempt)
+                if (copied_messages + copied) // 100 > copied_messages // 100:
+                    status_embed.clear_fields()
+                    status_embed.add_field(
+                        name='進行状況',
+                        value=f'コピー済みメッセージ: {copied_messages + copied}\n作成チャンネル: {created_channels}\n現在処理中: #{channel.name}',
+                        inline=False
+                    )
+                    await send_job_status(job, status_embed)
+                copied_messages += copied
+                channel_messages += copied
+                # The debounced job table write persists the cursor every few seconds,
+                # so a restart repeats at most the messages copied since the last write
+                cursors[str(channel.id)] = batch[-1][0].id
+                job.report(copied=copied_messages)
+                batch.clear()
+
+            async for message in channel.history(limit=None, oldest_first=True, after=after):
+                await job.checkpoint()
+                embed = build_copy_embed(message, f"Original: {source_guild.name} #{channel.name}", mode != 'webhook')
+                # Embed mode posts every message on its own, as before; webhook mode packs an author's run
+                if batch and (mode != 'webhook' or not fits_copy_batch(batch, message, embed)):
+                    await flush_batch()
+                batch.append((message, embed))
+            if batch:
+                await flush_batch()
+
+            completed.add(channel.id)
+            cursors.pop(str(channel.id), None)
+            job.report(completed=sorted(completed))
+            print(f"Copied {channel_messages} messages from #{channel.name}")
 
-        final_embed = discord.Embed(
-            title='✅ メッセージコピー完了',
-            description=f'**送信元:** {interaction.guild.name}\n**転送先:** {target_guild.name}',
-            color=0x00ff00
-        )
-        final_embed.add_field(
-            name='📊 統計情報',
-            value=f'**コピーしたメッセージ:** {copied_messages}件\n**作成したチャンネル:** {created_channels}個',
-            inline=False
-        )
-        final_embed.set_footer(text=f'完了者: {interaction.user.display_name} | 全てのメッセージが正常にコピーされました')
-        
-        if status_message:
-            try:
-                await status_message.edit(embed=final_embed)
-            except Exception as e:
-                print(f"Final status update error: {e}")
-                try:
-                    await status_channel.send(embed=final_embed)
-                except Exception as e2:
-                    print(f"Failed to send completion message: {e2}")
-        else:
-            try:
-                await status_channel.send(embed=final_embed)
-            except Exception as e:
-                print(f"Failed to send completion message: {e}")
+        except discord.HTTPException as e:
+            print(f"Error processing channel #{channel.name}: {e}")
+            continue
 
-    except ValueError:
-        try:
-            await interaction.response.send_message('❌ 無効なサーバーIDです。数字のみを入力してください。', ephemeral=True)
-        except:
-            try:
-                await interaction.followup.send('❌ 無効なサーバーIDです。数字のみを入力してください。', ephemeral=True)
-            except:
-                print("Failed to send error message about invalid server ID")
-    except Exception as e:
-        print(f"Error in allmessage command: {e}")
-        try:
-            if not interaction.response.is_done():
-                await interaction.response.send_message(f'❌ エラーが発生しました: {str(e)}', ephemeral=True)
-            else:
-                await interaction.followup.send(f'❌ エラーが発生しました: {str(e)}', ephemeral=True)
-        except Exception as e2:
-            print(f"Failed to send error message: {e2}")
-            try:
-                error_embed = discord.Embed(
-                    title='❌ allmessageコマンドエラー',
-                    description=f'エラーが発生しました: {str(e)}',
-                    color=0xff0000
-                )
-                await interaction.channel.send(embed=error_embed)
-            except Exception as e3:
-                print(f"Failed to send error message to channel: {e3}")
+    job.report(copied=copied_messages, channel=None)
+    final_embed = discord.Embed(
+        title='✅ メッセージコピー完了',
+        description=f'**送信元:** {source_guild.name}\n**転送先:** {target_guild.name}',
+        color=0x00ff00
+    )
+    final_embed.add_field(
+        name='📊 統計情報',
+        value=f'**コピーしたメッセージ:** {copied_messages}件\n**作成したチャンネル:** {created_channels}個',
+        inline=False
+    )
+    final_embed.set_footer(text=f'完了者: {params["requested_by"]} | ジョブ #{job.id}')
+    await send_job_status(job, final_embed)
 
-@bot.tree.command(name='allmember', description='指定したロールをサーバーの全メンバーに付与')
-async def allmember_command(interaction: discord.Interaction, role: discord.Role):
+@bot.tree.command(name='allmessage', description='サーバーの全メッセージを指定したサーバーにコピー')
+async def allmessage_command(interaction: discord.Interaction, target_server_id: str, channel_id: str = None, mode: str = "embed"):
     if not is_allowed_server(interaction.guild.id):
         await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
         return
@@ -2819,69 +5733,107 @@ async def allmember_command(interaction: discord.Interaction, role: discord.Role
         await interaction.response.send_message('❌ 管理者権限が必要です。', ephemeral=True)
         return
 
-    if role.name == '@everyone':
-        await interaction.response.send_message('❌ @everyoneロールは付与できません。', ephemeral=True)
+    try:
+        target_guild_id = int(target_server_id)
+    except ValueError:
+        await interaction.response.send_message('❌ 無効なサーバーIDです。数字のみを入力してください。', ephemeral=True)
         return
-    
-    if role.managed:
-        await interaction.response.send_message('❌ 管理されたロール（Bot用ロールなど）は付与できません。', ephemeral=True)
+
+    target_guild = bot.get_guild(target_guild_id)
+    if not target_guild:
+        await interaction.response.send_message('❌ 指定されたサーバーが見つかりません。Botがそのサーバーに参加していることを確認してください。', ephemeral=True)
         return
-    
-    if role >= interaction.guild.me.top_role:
-        await interaction.response.send_message('❌ Botの最高ロールより上位のロールは付与できません。', ephemeral=True)
+
+    if not target_guild.me.guild_permissions.manage_channels:
+        await interaction.response.send_message('❌ 転送先サーバーでチャンネル管理権限が必要です。', ephemeral=True)
         return
-    
-    if role.permissions.administrator:
-        await interaction.response.send_message('❌ 管理者権限を持つロールは付与できません。', ephemeral=True)
+
+    if mode not in COPY_MODES:
+        await interaction.response.send_message('❌ modeは embed / webhook のいずれかを指定してください。', ephemeral=True)
+        return
+
+    if mode == 'webhook' and not target_guild.me.guild_permissions.manage_webhooks:
+        await interaction.response.send_message('❌ webhookモードには転送先サーバーでウェブフック管理権限が必要です。', ephemeral=True)
         return
 
+    if channel_id:
+        try:
+            source_channel = bot.get_channel(int(channel_id))
+        except ValueError:
+            await interaction.response.send_message('❌ 無効なチャンネルIDです。数字のみを入力してください。', ephemeral=True)
+            return
+        if not source_channel or source_channel.guild.id != interaction.guild.id:
+            await interaction.response.send_message('❌ 指定されたチャンネルが見つからないか、このサーバーのチャンネルではありません。', ephemeral=True)
+            return
+        mode_text = f'チャンネル #{source_channel.name}'
+    else:
+        mode_text = 'サーバーの全チャンネル'
+
+    source_guild_id = str(interaction.guild.id)
+    config_registry.set('server_log', source_guild_id, ServerLogConfig(target_server_id, channel_id or None))
+
+    status_embed = discord.Embed(
+        title='📋 メッセージコピー進行状況',
+        description=f'**送信元:** {interaction.guild.name}\n**転送先:** {target_guild.name}\n**対象:** {mode_text}',
+        color=0x0099ff
+    )
+    status_embed.add_field(name='進行状況', value='待機中...', inline=False)
+    status_embed.set_footer(text=f'開始者: {interaction.user.display_name}')
+    try:
+        status_message = await interaction.channel.send(embed=status_embed)
+    except discord.HTTPException:
+        status_message = None
+
+    job = job_manager.submit('allmessage', interaction.guild.id, {
+        'target_guild_id': target_guild_id,
+        'channel_id': int(channel_id) if channel_id else None,
+        'mode_text': mode_text,
+        'mode': mode,
+        'requested_by': interaction.user.display_name,
+        'status_channel_id': interaction.channel.id,
+        'status_message_id': status_message.id if status_message else None,
+    })
+    position = job_manager.queue_position(job)
     await interaction.response.send_message(
-        f'🔄 **{role.name}** ロールをサーバーの全メンバーに付与しています...\n\nメンバーリストを読み込み中です...',
+        f'✅ メッセージコピーをジョブ #{job.id} として登録しました。\n**転送先:** {target_guild.name}\n**対象:** {mode_text}\n'
+        f'**方式:** {COPY_MODES[mode]}\n'
+        f'**待機順:** {position}番目\n\n処理には時間がかかる場合があります。進行状況は別メッセージと `/jobs status {job.id}` で確認できます。\n\n'
+        f'🔄 **サーバーログも自動で設定されました。**',
         ephemeral=True
     )
-    
-    all_members = interaction.guild.members
-    bot_members = [member for member in all_members if member.bot]
-    human_members = [member for member in all_members if not member.bot]
-    
-    members = human_members
-    total_members = len(members)
-    
+
+def describe_allmember_job(job):
+    progress = job.progress
+    return (f"処理済み {progress.get('processed', 0)}/{progress.get('total', '?')} / 付与 {progress.get('success', 0)} / "
+            f"スキップ {progress.get('skipped', 0)} / エラー {progress.get('errors', 0)}")
+
+async def run_allmember_job(job):
+    params = job.params
+    guild = bot.get_guild(job.guild_id)
+    role = guild.get_role(params['role_id']) if guild else None
+    if role is None:
+        raise RuntimeError('サーバーまたはロールが見つかりません')
+
     try:
-        print("Attempting to fetch all guild members...")
-        await interaction.guild.chunk()
-        print("Guild chunking completed")
-        
-        all_members_after_chunk = interaction.guild.members
-        human_members_after_chunk = [member for member in all_members_after_chunk if not member.bot]
-        
-        print(f"After chunking:")
-        print(f"- All members: {len(all_members_after_chunk)}")
-        print(f"- Human members: {len(human_members_after_chunk)}")
-        
-        if len(human_members_after_chunk) > total_members:
-            members = human_members_after_chunk
-            total_members = len(members)
-            all_members = all_members_after_chunk
-            bot_members = [member for member in all_members_after_chunk if member.bot]
-            human_members = human_members_after_chunk
-            print(f"Updated target members to: {total_members}")
-        
+        await guild.chunk()
     except Exception as e:
         print(f"Failed to chunk guild members: {e}")
-    
+
+    members = [member for member in guild.members if not member.bot]
+    total_members = len(members)
+    print(f"Starting allmember job #{job.id}: role {role.name} (ID: {role.id}) in {guild.name}, {total_members} members")
+
     if total_members == 0:
         error_embed = discord.Embed(
             title='❌ メンバーが見つかりません',
-            description=f'**サーバー:** {interaction.guild.name}\n**ロール:** {role.name}',
+            description=f'**サーバー:** {guild.name}\n**ロール:** {role.name}',
             color=0xff0000
         )
         error_embed.add_field(
             name='詳細情報',
-            value=f'**サーバーメンバー数:** {interaction.guild.member_count}\n'
-                  f'**読み込み済みメンバー:** {len(interaction.guild.members)}\n'
-                  f'**人間のメンバー:** {len([m for m in interaction.guild.members if not m.bot])}\n'
-                  f'**Botメンバー:** {len([m for m in interaction.guild.members if m.bot])}',
+            value=f'**サーバーメンバー数:** {guild.member_count}\n'
+                  f'**読み込み済みメンバー:** {len(guild.members)}\n'
+                  f'**Botメンバー:** {len([m for m in guild.members if m.bot])}',
             inline=False
         )
         error_embed.add_field(
@@ -2891,148 +5843,57 @@ async def allmember_command(interaction: discord.Interaction, role: discord.Role
                   f'• メンバーリストの読み込みに失敗',
             inline=False
         )
-        
-        try:
-            await interaction.channel.send(embed=error_embed)
-        except:
-            pass
+        await send_job_status(job, error_embed)
         return
 
     status_embed = discord.Embed(
         title='👥 全メンバーロール付与進行状況',
-        description=f'**ロール:** {role.name}\n**サーバー:** {interaction.guild.name}\n\nメンバーにロールを付与しています...',
+        description=f'**ロール:** {role.name}\n**サーバー:** {guild.name}\n\nメンバーにロールを付与しています...',
         color=0x0099ff
     )
-    status_embed.add_field(
-        name='進行状況',
-        value='開始中...',
-        inline=False
-    )
-    status_embed.set_footer(text=f'実行者: {interaction.user.display_name}')
-    
-    try:
-        status_message = await interaction.channel.send(embed=status_embed)
-    except:
-        status_message = None
-
-    members_with_role = 0
-    members_without_role = 0
-    
-    for member in members:
-        if role in member.roles:
-            members_with_role += 1
-        else:
-            members_without_role += 1
-    
-    print(f"Pre-check results:")
-    print(f"- Members with role: {members_with_role}")
-    print(f"- Members without role: {members_without_role}")
-    
-    if members_without_role == 0:
-        early_embed = discord.Embed(
-            title='ℹ️ 全メンバーが既にロールを所持',
-            description=f'**ロール:** {role.name}\n**サーバー:** {interaction.guild.name}\n\n全ての対象メンバー（{total_members}人）が既にこのロールを持っています。',
-            color=0xffaa00
-        )
-        early_embed.add_field(
-            name='📊 確認結果',
-            value=f'**既存所持:** {members_with_role}人\n**付与対象:** {members_without_role}人',
-            inline=False
-        )
-        early_embed.add_field(
-            name='💡 提案',
-            value='• 別のロールを選択してください\n• 特定のメンバーのロールを一度削除してからお試しください\n• これは正常な状態です（問題ではありません）',
-            inline=False
-        )
-        early_embed.set_footer(text='処理は続行されますが、変更は行われません')
-        
-        try:
-            await interaction.channel.send(embed=early_embed)
-        except:
-            pass
+    status_embed.set_footer(text=f'実行者: {params["requested_by"]} | ジョブ #{job.id}')
 
     processed_members = 0
     success_count = 0
     skip_count = 0
     error_count = 0
-    
-    print(f"Starting allmember command:")
-    print(f"- Role: {role.name} (ID: {role.id})")
-    print(f"- Guild: {interaction.guild.name} (ID: {interaction.guild.id})")
-    print(f"- Guild member count: {interaction.guild.member_count}")
-    print(f"- All members loaded: {len(all_members)}")
-    print(f"- Bot members: {len(bot_members)}")
-    print(f"- Human members: {len(human_members)}")
-    print(f"- Target members: {total_members}")
-    print(f"- Bot permissions: {interaction.guild.me.guild_permissions}")
-    print(f"- Bot top role: {interaction.guild.me.top_role}")
-    print(f"- Target role position: {role.position}")
-    print(f"- Bot can manage role: {role < interaction.guild.me.top_role}")
-    
-    if len(human_members) > 0:
-        print(f"- First few human members:")
-        for i, member in enumerate(human_members[:5]):
-            print(f"  {i+1}. {member.display_name} ({member.name}) - Has role: {role in member.roles}")
-    else:
-        print("- No human members found in server")
-        print(f"- All members list:")
-        for i, member in enumerate(all_members[:10]):
-            member_type = "Bot" if member.bot else "Human"
-            print(f"  {i+1}. {member.display_name} ({member.name}) - {member_type}")
-    
-    if total_members == 0:
-        print("WARNING: No human members found. This could be due to:")
-        print("1. Server only has bots")
-        print("2. Missing member intents")
-        print("3. Bot hasn't loaded all members yet")
+    job.report(total=total_members)
 
     for member in members:
+        await job.checkpoint()
         try:
             if role in member.roles:
                 skip_count += 1
-                print(f"Skipped {member.display_name}: Already has role")
             else:
-                await member.add_roles(role, reason=f"全メンバーロール付与 - 実行者: {interaction.user.display_name}")
-                
-                await member.reload()
-                if role in member.roles:
-                    success_count += 1
-                    print(f"Successfully added role to {member.display_name}")
-                else:
-                    error_count += 1
-                    print(f"Failed to add role to {member.display_name}: Role not found after assignment")
-                
+                # The role shows up in member.roles only once the gateway echoes the update
+                await action_scheduler.run('role', guild.id, member.add_roles, role, reason=f"全メンバーロール付与 - 実行者: {params['requested_by']}")
+                success_count += 1
+
         except discord.Forbidden:
             error_count += 1
             print(f"Failed to assign role to {member.display_name}: Missing permissions")
         except discord.HTTPException as e:
             error_count += 1
             print(f"Failed to assign role to {member.display_name}: HTTP error - {e}")
-        except Exception as e:
-            error_count += 1
-            print(f"Unexpected error with {member.display_name}: {e}")
-        
+
         processed_members += 1
-        
-        if processed_members % 10 == 0 and status_message:
-            try:
-                progress_percentage = (processed_members / total_members) * 100
-                status_embed.clear_fields()
-                status_embed.add_field(
-                    name='進行状況',
-                    value=f'処理済み: {processed_members}/{total_members} ({progress_percentage:.1f}%)\n'
-                          f'✅ 付与成功: {success_count}\n'
-                          f'⏭️ スキップ: {skip_count}\n'
-                          f'❌ エラー: {error_count}',
-                    inline=False
-                )
-                await status_message.edit(embed=status_embed)
-            except Exception as e:
-                print(f"Status update error: {e}")
-                status_message = None
-        
-        if processed_members % 5 == 0:
-            await asyncio.sleep(1)
+
+        if processed_members % 10 == 0:
+            job.report(processed=processed_members, success=success_count, skipped=skip_count, errors=error_count)
+        if processed_members % 50 == 0:
+            progress_percentage = (processed_members / total_members) * 100
+            status_embed.clear_fields()
+            status_embed.add_field(
+                name='進行状況',
+                value=f'処理済み: {processed_members}/{total_members} ({progress_percentage:.1f}%)\n'
+                      f'✅ 付与成功: {success_count}\n'
+                      f'⏭️ スキップ: {skip_count}\n'
+                      f'❌ エラー: {error_count}',
+                inline=False
+            )
+            await send_job_status(job, status_embed)
+
+    job.report(processed=processed_members, success=success_count, skipped=skip_count, errors=error_count)
 
     if skip_count == total_members and success_count == 0:
         embed_color = 0xffaa00
@@ -3049,7 +5910,7 @@ async def allmember_command(interaction: discord.Interaction, role: discord.Role
 
     final_embed = discord.Embed(
         title=embed_title,
-        description=f'**ロール:** {role.name}\n**サーバー:** {interaction.guild.name}\n\n{status_message_text}',
+        description=f'**ロール:** {role.name}\n**サーバー:** {guild.name}\n\n{status_message_text}',
         color=embed_color
     )
     final_embed.add_field(
@@ -3099,33 +5960,149 @@ async def allmember_command(interaction: discord.Interaction, role: discord.Role
             inline=False
         )
     
-    final_embed.set_footer(text=f'実行者: {interaction.user.display_name} | 処理完了')
+    final_embed.set_footer(text=f'実行者: {params["requested_by"]} | 処理完了 | ジョブ #{job.id}')
+    await send_job_status(job, final_embed)
+
+@bot.tree.command(name='allmember', description='指定したロールをサーバーの全メンバーに付与')
+async def allmember_command(interaction: discord.Interaction, role: discord.Role):
+    if not is_allowed_server(interaction.guild.id):
+        await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
+        return
+
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message('❌ 管理者権限が必要です。', ephemeral=True)
+        return
+
+    if role.name == '@everyone':
+        await interaction.response.send_message('❌ @everyoneロールは付与できません。', ephemeral=True)
+        return
+    
+    if role.managed:
+        await interaction.response.send_message('❌ 管理されたロール（Bot用ロールなど）は付与できません。', ephemeral=True)
+        return
     
-    if status_message:
-        try:
-            await status_message.edit(embed=final_embed)
-        except Exception as e:
-            print(f"Final status update error: {e}")
-            try:
-                await interaction.channel.send(embed=final_embed)
-            except Exception as e2:
-                print(f"Failed to send completion message: {e2}")
+    if role >= interaction.guild.me.top_role:
+        await interaction.response.send_message('❌ Botの最高ロールより上位のロールは付与できません。', ephemeral=True)
+        return
+    
+    if role.permissions.administrator:
+        await interaction.response.send_message('❌ 管理者権限を持つロールは付与できません。', ephemeral=True)
+        return
+
+    status_embed = discord.Embed(
+        title='👥 全メンバーロール付与進行状況',
+        description=f'**ロール:** {role.name}\n**サーバー:** {interaction.guild.name}',
+        color=0x0099ff
+    )
+    status_embed.add_field(name='進行状況', value='待機中...', inline=False)
+    status_embed.set_footer(text=f'実行者: {interaction.user.display_name}')
+    try:
+        status_message = await interaction.channel.send(embed=status_embed)
+    except discord.HTTPException:
+        status_message = None
+
+    job = job_manager.submit('allmember', interaction.guild.id, {
+        'role_id': role.id,
+        'requested_by': interaction.user.display_name,
+        'status_channel_id': interaction.channel.id,
+        'status_message_id': status_message.id if status_message else None,
+    })
+    position = job_manager.queue_position(job)
+    await interaction.response.send_message(
+        f'🔄 **{role.name}** ロールの全メンバーへの付与をジョブ #{job.id} として登録しました。（待機順: {position}番目）\n\n'
+        f'進行状況は別メッセージと `/jobs status {job.id}` で確認できます。',
+        ephemeral=True
+    )
+
+JobType = namedtuple('JobType', 'run describe priority resumable label')
+
+JOB_TYPES = {  # lower priority runs first
+    'allmember': JobType(run_allmember_job, describe_allmember_job, 0, True, '全メンバーロール付与'),
+    'allmessage': JobType(run_allmessage_job, describe_allmessage_job, 1, True, 'メッセージコピー'),
+}
+
+@bot.tree.command(name='jobs', description='長時間処理（ジョブ）の一覧表示・状態確認・操作')
+async def jobs_command(interaction: discord.Interaction, action: str = "list", job_id: int = None):
+    if not is_allowed_server(interaction.guild.id):
+        await interaction.response.send_message('❌ m.m.botを購入してください　https://discord.gg/5kwyPgd5fq', ephemeral=True)
+        return
+
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message('❌ 管理者権限が必要です。', ephemeral=True)
+        return
+
+    if action == "list":
+        jobs = job_manager.for_guild(interaction.guild.id)
+        if not jobs:
+            await interaction.response.send_message('ℹ️ このサーバーのジョブはありません。', ephemeral=True)
+            return
+        embed = discord.Embed(title='🗂️ ジョブ一覧', color=0x0099ff)
+        for job in jobs[::-1][:10]:
+            job_type = JOB_TYPES[job.kind]
+            embed.add_field(
+                name=f'#{job.id} {job_type.label}',
+                value=f'{JOB_STATUS_LABELS[job.status]}\n{job_type.describe(job)}',
+                inline=False
+            )
+        embed.set_footer(text=f'実行中 {job_manager.running.get(interaction.guild.id, 0)}件 / 同時実行上限 {JOB_GUILD_LIMIT}件')
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    if action not in ("status", "cancel", "pause", "resume"):
+        await interaction.response.send_message('❌ actionは list / status / cancel / pause / resume のいずれかを指定してください。', ephemeral=True)
+        return
+
+    job = job_manager.get(interaction.guild.id, job_id) if job_id is not None else None
+    if job is None:
+        await interaction.response.send_message('❌ 指定されたジョブが見つかりません。job_idを指定してください。', ephemeral=True)
+        return
+
+    if action == "status":
+        job_type = JOB_TYPES[job.kind]
+        embed = discord.Embed(title=f'🗂️ ジョブ #{job.id} {job_type.label}', color=0x0099ff)
+        embed.add_field(name='状態', value=JOB_STATUS_LABELS[job.status], inline=True)
+        embed.add_field(name='実行者', value=job.params.get('requested_by', '不明'), inline=True)
+        embed.add_field(name='登録日時', value=job.created_at[:19].replace('T', ' '), inline=True)
+        embed.add_field(name='進捗', value=job_type.describe(job), inline=False)
+        position = job_manager.queue_position(job)
+        if position:
+            embed.add_field(name='待機順', value=f'{position}番目', inline=True)
+        if job.error:
+            embed.add_field(name='エラー', value=job.error[:1000], inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    elif job.status not in JOB_ACTIVE_STATUSES:
+        await interaction.response.send_message('❌ このジョブは既に終了しています。', ephemeral=True)
+    elif action == "cancel":
+        job_manager.cancel(job)
+        await interaction.response.send_message(f'🛑 ジョブ #{job.id} のキャンセルを要求しました。', ephemeral=True)
+    elif action == "pause":
+        if job.status == 'paused':
+            await interaction.response.send_message('❌ このジョブは既に一時停止中です。', ephemeral=True)
+            return
+        job_manager.pause(job)
+        await interaction.response.send_message(f'⏸️ ジョブ #{job.id} を一時停止しました。`/jobs resume {job.id}` で再開できます。', ephemeral=True)
     else:
-        try:
-            await interaction.channel.send(embed=final_embed)
-        except Exception as e:
-            print(f"Failed to send completion message: {e}")
+        if job.status != 'paused':
+            await interaction.response.send_message('❌ このジョブは一時停止されていません。', ephemeral=True)
+            return
+        job_manager.resume(job)
+        await interaction.response.send_message(f'▶️ ジョブ #{job.id} を再開しました。', ephemeral=True)
 
 COMMAND_HELP.update({
     'allmember': {
         'description': '指定したロールをサーバーの全メンバーに付与',
         'usage': '/allmember <ロール>',
-        'details': 'サーバーの全メンバー（Bot除く）に指定したロールを付与します。既にロールを持っているメンバーはスキップされます。@everyone、管理されたロール、管理者権限を持つロールは付与できません。管理者権限が必要です。'
+        'details': 'サーバーの全メンバー（Bot除く）に指定したロールを付与します。既にロールを持っているメンバーはスキップされます。@everyone、管理されたロール、管理者権限を持つロールは付与できません。処理はジョブとして実行され、`/jobs` で確認・一時停止・キャンセルができます。管理者権限が必要です。'
     },
     'allmessage': {
         'description': 'サーバーの全メッセージを指定したサーバーにコピー',
-        'usage': '/allmessage <転送先サーバーID> [チャンネルID]',
-        'details': 'サーバーの全チャンネル、または指定したチャンネルのメッセージを転送先サーバーにコピーします。チャンネルIDを指定した場合はそのチャンネルのみをコピーします。チャンネルが存在しない場合は自動作成されます。管理者権限が必要です。'
+        'usage': '/allmessage <転送先サーバーID> [チャンネルID] [mode]',
+        'details': 'サーバーの全チャンネル、または指定したチャンネルのメッセージを転送先サーバーにコピーします。チャンネルIDを指定した場合はそのチャンネルのみをコピーします。チャンネルが存在しない場合は自動作成されます。コピー位置はチャンネルごとに保存され、Botが再起動しても続きから再開します。modeに"webhook"を指定すると、ウェブフック経由で元の投稿者名とアイコンのまま投稿し、同じ投稿者の連続したメッセージを最大10件ずつまとめて送信します（ウェブフック管理権限が必要）。処理はジョブとして実行され、`/jobs` で確認・一時停止・キャンセルができます。管理者権限が必要です。'
+    },
+    'jobs': {
+        'description': '長時間処理（ジョブ）の一覧表示・状態確認・操作',
+        'usage': '/jobs [list|status|cancel|pause|resume] [job_id]',
+        'details': '/allmessage や /allmember で登録されたジョブを管理します。"list"でこのサーバーのジョブ一覧、"status"で詳細な進捗、"cancel"でキャンセル、"pause"/"resume"で一時停止・再開ができます。ジョブはサーバーごとに1件ずつ順番に実行され、Botの再起動後も再開可能なものは自動で続行されます。管理者権限が必要です。'
     },
     'warn': {
         'description': 'ユーザーに警告を与える',
@@ -3173,4 +6150,7 @@ if __name__ == '__main__':
         print('DISCORD_TOKEN環境変数が設定されていません。')
         exit(1)
 
+    # Render stops the service with SIGTERM; exit normally so atexit flushes the data store
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     bot.run(token)
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import discord
+
+import main
+
+
+class FakeHTTP:
+    """Records when each call reaches Discord; answers 429 for the calls listed in limited"""
+
+    def __init__(self, limited=(), retry_after=0.05, latency=0.001):
+        self.calls = []
+        self.limited = set(limited)
+        self.retry_after = retry_after
+        self.latency = latency
+        self.limited_at = None
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def __call__(self, func, args, kwargs):
+        name = func(*args, **kwargs)
+        self.calls.append((time.monotonic(), name))
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        if name in self.limited:
+            self.limited.discard(name)
+            self.limited_at = time.monotonic()
+            response = SimpleNamespace(status=429, reason='Too Many Requests', headers={'Retry-After': str(self.retry_after)})
+            raise discord.HTTPException(response, 'rate limited')
+        return name, None
+
+    def names(self):
+        return [name for _, name in self.calls]
+
+
+def run_scheduler(http, submit):
+    async def scenario():
+        scheduler = main.ActionScheduler(http, main.ACTION_WORKERS)
+        scheduler.start()
+        futures = submit(scheduler)
+        results = await asyncio.wait_for(asyncio.gather(*futures), 5)
+        for task in scheduler.tasks:
+            task.cancel()
+        return scheduler, results
+
+    return asyncio.run(scenario())
+
+
+def test_one_bucket_runs_in_submission_order_at_its_rate(monkeypatch):
+    monkeypatch.setitem(main.ACTION_ROUTES, 'timeout', (0, 3, 50.0))
+    http = FakeHTTP()
+    names = [f'timeout-{n}' for n in range(20)]
+    scheduler, results = run_scheduler(
+        http, lambda scheduler: [scheduler.submit('timeout', 1, str, name) for name in names]
+    )
+
+    assert results == names
+    assert http.names() == names
+    # After the burst each call waits for its own token; timer jitter may shift single gaps, not the total
+    paced = [at for at, _ in http.calls[2:]]
+    assert paced[-1] - paced[0] >= (len(paced) - 1) / 50 - 0.02
+    # The lane sleeps once per token instead of re-queueing every waiting action
+    assert scheduler.deferred <= len(names) - 3
+    assert not scheduler.lanes and not scheduler.scheduled
+
+
+def test_higher_priority_routes_overtake_a_backlog(monkeypatch):
+    monkeypatch.setitem(main.ACTION_ROUTES, 'send', (2, 1, 50.0))
+    http = FakeHTTP()
+
+    def submit(scheduler):
+        sends = [scheduler.submit('send', 10, str, f'send-{n}') for n in range(10)]
+        return sends + [scheduler.submit('ban', 1, str, 'ban')]
+
+    run_scheduler(http, submit)
+    names = http.names()
+    assert names.index('ban') < 3
+    assert [name for name in names if name != 'ban'] == [f'send-{n}' for n in range(10)]
+
+
+def test_a_429_retries_the_action_before_the_rest_of_its_bucket(monkeypatch):
+    monkeypatch.setitem(main.ACTION_ROUTES, 'timeout', (0, 5, 100.0))
+    http = FakeHTTP(limited={'timeout-2'})
+    names = [f'timeout-{n}' for n in range(8)]
+    scheduler, results = run_scheduler(
+        http, lambda scheduler: [scheduler.submit('timeout', 1, str, name) for name in names]
+    )
+
+    assert results == names
+    assert scheduler.rate_limited == 1
+    after = [(at, name) for at, name in http.calls if at > http.limited_at]
+    # Nothing queued behind it goes first, and Discord's Retry-After holds the bucket back
+    assert after[0][1] == 'timeout-2'
+    assert after[0][0] - http.limited_at >= 0.05 * 0.8
+    assert [name for _, name in after[1:]] == names[len(names) - len(after[1:]):]
+
+
+def test_a_bucket_runs_one_action_at_a_time(monkeypatch):
+    # A burst large enough that only the in-flight rule keeps the lane serial
+    monkeypatch.setitem(main.ACTION_ROUTES, 'timeout', (0, 20, 50.0))
+    http = FakeHTTP(latency=0.01)
+    names = [f'timeout-{n}' for n in range(6)]
+    scheduler, results = run_scheduler(
+        http, lambda scheduler: [scheduler.submit('timeout', 1, str, name) for name in names]
+    )
+
+    assert results == names
+    assert http.most_in_flight == 1
+    # Different buckets still run side by side
+    http = FakeHTTP(latency=0.01)
+    run_scheduler(http, lambda scheduler: [scheduler.submit('timeout', scope, str, f'timeout-{scope}') for scope in range(4)])
+    assert http.most_in_flight == 4
@@ -0,0 +1,39 @@
+import pytest
+
+import main
+
+
+def test_domains_match_with_or_without_a_scheme_but_only_whole_hosts():
+    rules = main.AutoModRules(main.DEFAULT_AUTOMOD._replace(domains=('example.com',)))
+
+    for content in ('see example.com', 'https://example.com/page', 'http://cdn.example.com', '(example.com)'):
+        assert rules.check(content) == 'ブロックされたドメインへのリンク', content
+    for content in ('notexample.com', 'example.com.au', 'mail@myexample.com'):
+        assert rules.check(content) is None, content
+
+
+def test_invites_glued_to_words_are_not_counted_as_letters():
+    rules = main.AutoModRules(main.DEFAULT_AUTOMOD)
+
+    assert rules.check('joindiscord.gg/abc') == '招待リンクの投稿'
+    assert rules.check('JOINDISCORD.GG/ABC NOW PLEASE') == '招待リンクの投稿'
+    assert rules.check('THIS IS A VERY LOUD MESSAGE') == '大文字の多用'
+
+
+@pytest.mark.parametrize('value', [
+    {'domains': ['https://example.com']},
+    {'domains': 'example.com'},
+    {'domains': ['example.com'] * (main.AUTOMOD_MAX_DOMAINS + 1)},
+    {'max_mentions': -1},
+    {'caps_percent': 101},
+    {'timeout_minutes': '10'},
+    {'zalgo': 1},
+])
+def test_from_json_rejects_bad_fields_before_anything_is_compiled(value):
+    with pytest.raises(ValueError):
+        main.AutoModConfig.from_json(value)
+
+
+def test_from_json_round_trips_a_valid_config():
+    config = main.DEFAULT_AUTOMOD._replace(domains=('example.com', 'cdn.example.org'), caps_percent=0)
+    assert main.AutoModConfig.from_json(config.to_json()) == config
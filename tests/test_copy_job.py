@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+import main
+
+
+def new_message(message_id, author_id):
+    author = SimpleNamespace(id=author_id, name=f'user{author_id}', display_name=f'user{author_id}', avatar=None,
+                             display_avatar=SimpleNamespace(url='https://example.com/a.png'))
+    return SimpleNamespace(id=message_id, author=author, content=f'message {message_id}',
+                           created_at=datetime.now(timezone.utc), attachments=[])
+
+
+def setup_copy(monkeypatch, messages, send):
+    """A one-channel webhook copy whose webhook posts through send(embeds); returns the job"""
+    async def history(limit=None, oldest_first=True, after=None):
+        for message in messages:
+            if after is None or message.id > after.id:
+                yield message
+
+    async def webhooks():
+        return [webhook]
+
+    async def webhook_send(embeds, username, avatar_url):
+        return await send(embeds)
+
+    async def run(route, scope, func, *args, **kwargs):
+        return await func(*args, **kwargs)
+
+    async def send_job_status(job, embed):
+        pass
+
+    me = object()
+    webhook = SimpleNamespace(user=me, name=main.COPY_WEBHOOK_NAME, send=webhook_send)
+    source_channel = SimpleNamespace(id=100, name='general', category=None, history=history)
+    target_channel = SimpleNamespace(id=200, name='general', webhooks=webhooks)
+    guilds = {
+        1: SimpleNamespace(id=1, name='source', text_channels=[source_channel]),
+        2: SimpleNamespace(id=2, name='target', text_channels=[target_channel], categories=[]),
+    }
+    monkeypatch.setattr(main, 'bot', SimpleNamespace(get_guild=guilds.get, user=me))
+    monkeypatch.setattr(main, 'action_scheduler', SimpleNamespace(run=run))
+    monkeypatch.setattr(main, 'copy_webhooks', main.CopyWebhooks())
+    monkeypatch.setattr(main, 'job_manager', SimpleNamespace(mark_dirty=lambda name: None))
+    monkeypatch.setattr(main, 'send_job_status', send_job_status)
+    monkeypatch.setattr(main, 'COPY_RETRY_DELAY', 0)
+    params = {'target_guild_id': 2, 'channel_id': None, 'mode': 'webhook', 'mode_text': 'all', 'requested_by': 'admin'}
+    return main.Job(1, 'allmessage', 1, params)
+
+
+def refused():
+    response = SimpleNamespace(status=500, reason='Internal Server Error')
+    return discord.HTTPException(response, 'webhook send failed')
+
+
+def test_a_refused_batch_leaves_the_cursor_on_the_last_sent_message(monkeypatch):
+    # Author 10's message goes out alone; author 11's two messages share the batch that fails
+    messages = [new_message(1, 10), new_message(2, 11), new_message(3, 11)]
+    sent = []
+
+    async def send(embeds):
+        if len(sent) == 1:
+            raise refused()
+        sent.append(len(embeds))
+
+    job = setup_copy(monkeypatch, messages, send)
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.run_allmessage_job(job))
+
+    assert sent == [1]
+    assert job.progress['cursors'] == {'100': 1}
+    assert job.progress['copied'] == 1
+    assert not job.progress.get('completed')
+
+
+def test_a_batch_that_fails_once_is_retried_before_the_cursor_moves(monkeypatch):
+    messages = [new_message(1, 10), new_message(2, 11), new_message(3, 11)]
+    sent = []
+    failures = [refused()]
+
+    async def send(embeds):
+        if len(sent) == 1 and failures:
+            raise failures.pop()
+        sent.append(len(embeds))
+
+    job = setup_copy(monkeypatch, messages, send)
+    asyncio.run(main.run_allmessage_job(job))
+
+    assert sent == [1, 2]
+    assert job.progress['copied'] == 3
+    assert job.progress['completed'] == [100]
+    assert job.progress['cursors'] == {}
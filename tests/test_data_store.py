@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+import main
+
+
+def make_guild_files(tmp_path, monkeypatch, guild_ids):
+    monkeypatch.chdir(tmp_path)
+    store = main.DataStore().load()
+
+    async def fill():
+        for guild_id in guild_ids:
+            await store.add_xp(guild_id, 10, 50)
+
+    asyncio.run(fill())
+    store.flush()
+
+
+def test_load_reads_no_guild_shard_until_it_is_used(tmp_path, monkeypatch):
+    make_guild_files(tmp_path, monkeypatch, [1, 2])
+    reads = []
+    shard_load = main.DataShard.load
+
+    def recording_load(shard):
+        reads.append((shard.name, threading.current_thread().name))
+        return shard_load(shard)
+
+    monkeypatch.setattr(main.DataShard, 'load', recording_load)
+    store = main.DataStore().load()
+
+    assert store.guilds == {}
+    assert store.guild_ids() == ['1', '2']
+    assert reads == [('global', threading.current_thread().name)]
+
+    async def use_one_guild():
+        # Concurrent first uses share a single read
+        return await asyncio.gather(store.get_level(1, 10), store.get_level(1, 10))
+
+    assert asyncio.run(use_one_guild()) == [{'level': 1, 'xp': 50, 'total_xp': 50}] * 2
+    assert list(store.guilds) == ['1']
+    assert len(reads) == 2 and reads[1][0] == '1' and reads[1][1].startswith('storage')
+
+
+def test_idle_shards_are_evicted_once_their_changes_are_on_disk(tmp_path, monkeypatch):
+    make_guild_files(tmp_path, monkeypatch, [1, 2])
+    store = main.DataStore().load()
+
+    async def scenario():
+        store.start()
+        await store.get_level(1, 10)
+        await store.add_xp(2, 10, 5)
+        await store.get_level(3, 10)  # No files: an empty shard, nothing read
+        idle = time.monotonic() - main.SHARD_IDLE_SECONDS
+        for shard in store.guilds.values():
+            shard.last_access = idle
+        store.guilds['1'].last_access = time.monotonic()
+
+        await store.flush_async(compact=True)
+        resident = sorted(store.guilds)
+        # An evicted guild reads its changes back from disk
+        level = await store.get_level(2, 10)
+        return resident, level
+
+    resident, level = asyncio.run(scenario())
+    assert resident == ['1']
+    assert level == {'level': 1, 'xp': 55, 'total_xp': 55}
+    assert store.guild_ids() == ['1', '2']
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import discord
+
+import main
+
+GUILD_ID = main.ALLOWED_SERVERS[0]
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = GUILD_ID
+        self.name = 'guild'
+        self.verification_level = discord.VerificationLevel.low
+        self.system_channel = None
+        self.edits = []
+
+    async def edit(self, verification_level, reason=None):
+        self.edits.append(verification_level)
+        await asyncio.sleep(0.01)
+        self.verification_level = verification_level
+
+
+def new_member(guild, member_id):
+    created = datetime.now(timezone.utc) - timedelta(days=1)
+    return SimpleNamespace(id=member_id, guild=guild, bot=False, created_at=created)
+
+
+def test_concurrent_joins_start_one_lockdown(monkeypatch):
+    monkeypatch.setattr(main, 'join_guard', main.JoinGuard())
+    cohorts = []
+
+    async def act_on_flagged_members(guild, member_ids):
+        cohorts.append(list(member_ids))
+        return len(member_ids)
+
+    async def send_guard_notice(guild, embed):
+        pass
+
+    monkeypatch.setattr(main, 'act_on_flagged_members', act_on_flagged_members)
+    monkeypatch.setattr(main, 'send_guard_notice', send_guard_notice)
+
+    async def scenario():
+        guild = FakeGuild()
+        await asyncio.gather(*(main.on_member_join(new_member(guild, n)) for n in range(30)))
+        lockdown = main.join_guard.lockdowns[GUILD_ID]
+        lift_tasks = [task for task in asyncio.all_tasks() if task.get_coro().__name__ == 'lift_lockdown_later']
+
+        assert guild.edits == [discord.VerificationLevel.high]
+        assert lockdown[1] == discord.VerificationLevel.low
+        assert lift_tasks == [lockdown[2]]
+        # The spike's cohort once, and every later join on its own: nobody is acted on twice
+        assert sorted(len(cohort) for cohort in cohorts) == [1] * 20 + [main.JOIN_SPIKE_THRESHOLD]
+        assert sorted(member_id for cohort in cohorts for member_id in cohort) == list(range(30))
+
+        assert await main.lift_lockdown(guild)
+        assert guild.verification_level == discord.VerificationLevel.low
+        await asyncio.sleep(0)
+        assert lockdown[2].cancelled()
+
+    asyncio.run(scenario())
@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+
+class FakeStore:
+    def __init__(self, levels):
+        self.levels = levels  # {(guild_id, user_id): total_xp}
+
+    async def all_levels(self, guild_id):
+        return [(user_id, total_xp) for (guild, user_id), total_xp in self.levels.items() if guild == guild_id]
+
+    async def add_xp_many(self, grants):
+        results = []
+        for (guild_id, user_id), amount in grants.items():
+            old = self.levels.get((guild_id, user_id), 0)
+            self.levels[(guild_id, user_id)] = old + amount
+            results.append((guild_id, user_id, {'level': 0, 'total_xp': old}, {'level': 0, 'total_xp': old + amount}))
+        return results
+
+
+def test_xp_applied_after_a_member_left_does_not_put_them_back(monkeypatch):
+    members = {10: SimpleNamespace(id=10), 11: SimpleNamespace(id=11)}
+    guild = SimpleNamespace(id=1, get_member=members.get)
+    monkeypatch.setattr(main, 'bot', SimpleNamespace(get_guild={1: guild}.get))
+    store = FakeStore({('1', '10'): 50, ('1', '11'): 40})
+    leaderboards = main.LeaderboardIndex(store)
+    accumulator = main.XPAccumulator(store, leaderboards)
+
+    async def scenario():
+        board = await leaderboards.board(guild)
+        accumulator.add(1, 10, 5)
+        accumulator.add(1, 11, 30)
+        # 11 leaves with XP still buffered
+        del members[11]
+        leaderboards.member_left(1, 11)
+        await accumulator.flush_async()
+        return board
+
+    board = asyncio.run(scenario())
+    assert board.page(0, 10) == [('10', 55)]
+    assert board.rank('11') is None
@@ -0,0 +1,55 @@
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import main
+
+GREETINGS = [
+    'おはようございます',
+    'おはようございます！',
+    'おはよーございます',
+    'おはようございます〜今日もよろしくお願いします',
+    'おはようございます！今日もよろしくお願いします',
+    'おはようございます、今日もよろしくお願いします！',
+    'みなさんおはようございます今日もよろしくお願いします',
+    'おはようございます。今日もよろしくお願いします。',
+]
+
+
+def make_message(message_id, user_id, content, account_days, member_days):
+    now = datetime.now(timezone.utc)
+    author = SimpleNamespace(
+        id=user_id,
+        guild_permissions=SimpleNamespace(manage_messages=False),
+        created_at=now - timedelta(days=account_days),
+        joined_at=now - timedelta(days=member_days),
+    )
+    return SimpleNamespace(
+        id=message_id, author=author, content=content,
+        guild=SimpleNamespace(id=1), channel=SimpleNamespace(id=10),
+    )
+
+
+def observe_all(messages):
+    detector = main.RaidDetector()
+    now = time.time()
+    min_users = main.DEFAULT_ANTISPAM_POLICY.raid_users
+    return [detector.observe(message, now + n, min_users) for n, message in enumerate(messages)]
+
+
+def test_regulars_greeting_each_other_are_not_a_raid():
+    messages = [make_message(n, 100 + n, text, account_days=400, member_days=90) for n, text in enumerate(GREETINGS * 3)]
+    assert not any(observe_all(messages))
+
+
+def test_short_greetings_from_new_members_are_ignored():
+    messages = [make_message(n, 100 + n, 'おはようございます！', account_days=1, member_days=0) for n in range(20)]
+    assert not any(observe_all(messages))
+
+
+def test_new_accounts_posting_the_same_text_are_a_raid():
+    spam = 'このサーバーは終わりです 今すぐ参加 discord.gg/raid{}'
+    messages = [make_message(n, 100 + n, spam.format('!' * n), account_days=1, member_days=0) for n in range(10)]
+    results = observe_all(messages)
+    cluster = next(result for result in results if result)
+    assert len(cluster.users) == main.DEFAULT_ANTISPAM_POLICY.raid_users
@@ -0,0 +1,104 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def test_checkpoint_does_not_stall_the_loop_behind_a_reader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'bot.db')
+    store = main.SQLiteStore(path)
+
+    async def scenario():
+        await main.storage_io.run(store.load)
+        store.start()
+        for n in range(200):
+            await store.add_xp(1, n, 10)
+
+        # A reader pinned to an old snapshot makes a blocking checkpoint wait on its busy handler
+        reader = sqlite3.connect(path)
+        reader.execute('BEGIN')
+        reader.execute('SELECT COUNT(*) FROM user_levels').fetchone()
+        await store.add_xp(1, 0, 5)
+
+        started = time.monotonic()
+        checkpoint = asyncio.create_task(store.flush_async(compact=True))
+        await asyncio.sleep(0)
+        # Reads and writes carry on while the checkpoint runs
+        await store.add_xp(1, 1, 5)
+        assert (await store.get_level(1, 1))['total_xp'] == 15
+        await asyncio.wait_for(checkpoint, 2)
+        elapsed = time.monotonic() - started
+        reader.rollback()
+        reader.close()
+        await store.flush_async(compact=True)
+        return elapsed
+
+    elapsed = asyncio.run(scenario())
+    assert elapsed < 1
+    store.close()
+
+    check = sqlite3.connect(path)
+    totals = dict(check.execute('SELECT user_id, total_xp FROM user_levels WHERE user_id IN (?, ?)', ('0', '1')))
+    check.close()
+    assert totals == {'0': 15, '1': 15}
+
+
+def test_writes_commit_on_the_storage_thread_while_the_loop_reads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = main.SQLiteStore(str(tmp_path / 'bot.db'))
+
+    async def scenario():
+        await main.storage_io.run(store.load)
+        await store.add_xp(1, 10, 10)
+        gate = threading.Event()
+        blocker = asyncio.ensure_future(main.storage_io.run(gate.wait))
+        write = asyncio.ensure_future(store.add_xp(1, 10, 5))
+        await asyncio.sleep(0.05)
+        # The write waits its turn on the storage thread; the loop still reads what is committed
+        assert not write.done()
+        assert (await store.get_level(1, 10))['total_xp'] == 10
+        gate.set()
+        await blocker
+        old, new = await write
+        assert (old['total_xp'], new['total_xp']) == (10, 15)
+        assert (await store.get_level(1, 10))['total_xp'] == 15
+
+    asyncio.run(scenario())
+    with pytest.raises(sqlite3.OperationalError):
+        store.conn.execute("INSERT INTO users (user_id) VALUES ('1')")
+    store.close()
+
+
+def test_xp_batches_are_one_upsert_with_level_ups_from_the_returned_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'SQLITE_XP_BATCH', 50)
+    store = main.SQLiteStore(str(tmp_path / 'bot.db'))
+
+    async def scenario():
+        await main.storage_io.run(store.load)
+        await store.add_xp_many({('1', str(n)): 90 for n in range(120)})
+        statements = []
+        store.writer.set_trace_callback(statements.append)
+        grants = {('1', str(n)): 20 for n in range(120)}
+        grants[('2', '7')] = 30
+        results = await store.add_xp_many(grants)
+        store.writer.set_trace_callback(None)
+        return statements, results
+
+    statements, results = asyncio.run(scenario())
+    verbs = [statement.split()[0] for statement in statements]
+    # Three upserts of at most 50 grants each, then the level columns; no row is read first
+    assert verbs.count('INSERT') == 3 and 'SELECT' not in verbs
+    assert len(results) == 121
+    by_key = {(guild_id, user_id): (old, new) for guild_id, user_id, old, new in results}
+    old, new = by_key[('1', '0')]
+    assert old == dict(zip(('level', 'xp', 'total_xp'), main.level_from_total_xp(90) + (90,)))
+    assert new == dict(zip(('level', 'xp', 'total_xp'), main.level_from_total_xp(110) + (110,)))
+    assert by_key[('2', '7')] == (main.new_level_record(), dict(zip(('level', 'xp', 'total_xp'), main.level_from_total_xp(30) + (30,))))
+    assert asyncio.run(store.get_level('1', '0')) == new
+    store.close()
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import main
+
+
+class FakeAccumulator:
+    def __init__(self):
+        self.added = {}
+
+    def add(self, guild_id, user_id, amount):
+        self.added[(guild_id, user_id)] = self.added.get((guild_id, user_id), 0) + amount
+
+
+def make_guild(guild_id, in_voice, away):
+    """A guild whose voice channel holds the in_voice member IDs; away members are not in voice"""
+    channel = SimpleNamespace(members=[])
+    members = {}
+    for user_id in in_voice:
+        state = SimpleNamespace(channel=channel, afk=False, self_mute=False, self_deaf=False, mute=False, deaf=False)
+        members[user_id] = SimpleNamespace(id=user_id, bot=False, voice=state)
+        channel.members.append(members[user_id])
+    for user_id in away:
+        members[user_id] = SimpleNamespace(id=user_id, bot=False, voice=None)
+    guild = SimpleNamespace(id=guild_id, voice_channels=[channel], get_member=members.get)
+    for member in members.values():
+        member.guild = guild
+    return guild
+
+
+def test_tick_only_credits_members_still_in_voice(monkeypatch):
+    guild = make_guild(1, in_voice=[10, 11], away=[12])
+    monkeypatch.setattr(main, 'bot', SimpleNamespace(get_guild={1: guild}.get))
+    accumulator = FakeAccumulator()
+    sessions = main.VoiceSessions(accumulator)
+    # 12 left voice while the gateway was away; 13 left the server; guild 2 was removed
+    sessions.sessions = {(1, 10): 0, (1, 11): 0, (1, 12): 0, (1, 13): 0, (2, 20): 0}
+
+    sessions.tick(now=300)
+
+    per_minute = main.VOICE_XP_PER_MINUTE
+    assert accumulator.added == {(1, 10): 5 * per_minute, (1, 11): 5 * per_minute}
+    assert sessions.sessions == {(1, 10): 300, (1, 11): 300}
+
+
+def test_rebuild_replaces_sessions_with_current_voice_states(monkeypatch):
+    guild = make_guild(1, in_voice=[10, 11], away=[12])
+    monkeypatch.setattr(main, 'bot', SimpleNamespace(get_guild={1: guild}.get))
+    accumulator = FakeAccumulator()
+    sessions = main.VoiceSessions(accumulator)
+    sessions.sessions = {(1, 10): 0, (1, 12): 0}
+
+    sessions.rebuild([guild], now=1000)
+    sessions.tick(now=1060)
+
+    # The time before the reconnect is not credited to anyone
+    assert sessions.sessions == {(1, 10): 1060, (1, 11): 1060}
+    assert accumulator.added == {(1, 10): main.VOICE_XP_PER_MINUTE, (1, 11): main.VOICE_XP_PER_MINUTE}
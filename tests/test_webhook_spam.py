@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+GUILD_ID = main.ALLOWED_SERVERS[0]
+
+
+def setup_bot(monkeypatch):
+    """Fake Discord around on_message; returns the list of webhook IDs it deleted"""
+    deleted = []
+
+    async def fetch_webhook(webhook_id):
+        async def delete(reason=None):
+            deleted.append(webhook_id)
+        return SimpleNamespace(id=webhook_id, delete=delete)
+
+    async def process_commands(message):
+        pass
+
+    async def run(route, scope, func, *args, **kwargs):
+        return await func(*args, **kwargs)
+
+    async def bulk_delete_tracked(guild, entries, reason=None):
+        return len(entries)
+
+    monkeypatch.setattr(main, 'bot', SimpleNamespace(user=object(), fetch_webhook=fetch_webhook, process_commands=process_commands))
+    monkeypatch.setattr(main, 'action_scheduler', SimpleNamespace(run=run, submit=lambda *args, **kwargs: None))
+    monkeypatch.setattr(main, 'bulk_delete_tracked', bulk_delete_tracked)
+    monkeypatch.setattr(main, 'message_pipeline', SimpleNamespace(submit=lambda message: None))
+    monkeypatch.setattr(main, 'bot_spam_detector', main.BotSpamDetector(
+        main.BOT_SPAM_MAX_WINDOW_SECONDS, main.BOT_SPAM_MAX_THRESHOLD, main.BOT_SPAM_MAX_TRACKED
+    ))
+    monkeypatch.setattr(main, 'copy_webhooks', main.CopyWebhooks())
+    return deleted
+
+
+def webhook_messages(webhook_id, count):
+    author = SimpleNamespace(id=webhook_id, name='hook', bot=True, mention=f'<@{webhook_id}>')
+    guild = SimpleNamespace(id=GUILD_ID)
+    channel = SimpleNamespace(id=500)
+    return [SimpleNamespace(id=n, author=author, webhook_id=webhook_id, guild=guild, channel=channel, content='spam')
+            for n in range(1, count + 1)]
+
+
+def send_all(messages):
+    async def scenario():
+        for message in messages:
+            await main.on_message(message)
+
+    asyncio.run(scenario())
+
+
+def test_a_foreign_webhook_flooding_a_channel_is_deleted(monkeypatch):
+    deleted = setup_bot(monkeypatch)
+
+    send_all(webhook_messages(900, main.DEFAULT_ANTISPAM_POLICY.bot_count))
+
+    assert deleted == [900]
+    assert main.bot_spam_detector.banned == 1
+
+
+def test_our_copy_webhooks_are_not_checked(monkeypatch):
+    deleted = setup_bot(monkeypatch)
+    main.copy_webhooks.webhooks[500] = SimpleNamespace(id=901)
+
+    send_all(webhook_messages(901, main.DEFAULT_ANTISPAM_POLICY.bot_count * 2))
+
+    assert deleted == []
+    assert main.bot_spam_detector.checked == 0